@@ -18,6 +18,7 @@ from PIL import Image
 
 from utils.lib_math import *
 from utils.lib_io import *
+from utils.lib_trace import trace
 
 from arm_package.robotic_arm import Arm as ArmBase
 from dmp import DMP
@@ -27,6 +28,12 @@ VZ_SPEED_DEGREE = 14 # 14°/s
 VYAW_SPEED_DEGREE = 35 # 35°/s
 VYAW_SPEED_RADIAN = 25*np.pi/180
 
+## for move_handle_dmp
+DMP_N_CANDIDATES = 8 # nominal trajectory + rollouts to perturbed goals
+DMP_GOAL_NOISE = 0.02 # m, perturbation of the goal xyz of the candidate rollouts (dmp_goal_noise of cfg_arm_*.yaml)
+DMP_GOAL_NOISE_MAX = 0.03 # m, cap of the perturbation, the final move_p still goes to the real goal from the waypoints
+DMP_MIDDLE_WINDOW = 5 # waypoints within +-5 steps of each middle point
+
 ## for dh_gripper
 ADDRESS_INIT_GRIPPER = int(0x0100)
 ADDRESS_SET_FORCE = int(0x0101)
@@ -41,7 +48,7 @@ GRIPPER_BAUDRATE = 115200
 GRIPPER_DEVICE = 1
 
 class Arm():
-    def __init__(self,root_dir='./',host_ip='192.168.10.19',host_port=8080,cam2base_H_path='cfg/cam2base_H_right.csv',tool_frame='dh3',home_state=[0,0,0,0,0,0,0],middle_state=[0,0,0,0,0,0,0],arm_vel=15,if_gripper=False,gripper_force=30,gripper_start_pos=1000,gripper_vel=50):
+    def __init__(self,root_dir='./',host_ip='192.168.10.19',host_port=8080,cam2base_H_path='cfg/cam2base_H_right.csv',tool_frame='dh3',home_state=[0,0,0,0,0,0,0],middle_state=[0,0,0,0,0,0,0],arm_vel=15,if_gripper=False,gripper_force=30,gripper_start_pos=1000,gripper_vel=50,dmp_n_candidates=DMP_N_CANDIDATES,dmp_goal_noise=DMP_GOAL_NOISE):
         self.root_dir = root_dir
         self.host_ip = host_ip
         self.host_port = host_port
@@ -57,6 +64,10 @@ class Arm():
         self.gripper_start_pos = gripper_start_pos
         self.gripper_vel = gripper_vel
 
+        self.dmps = {} # dmp_refer_tjt_path: DMP, the grasp only reproduces
+        self.dmp_n_candidates = dmp_n_candidates
+        self.dmp_goal_noise = dmp_goal_noise
+
         self.connect()
         if if_gripper:
             self.connect_gripper(gripper_force,gripper_start_pos,gripper_vel)
@@ -65,7 +76,7 @@ class Arm():
     @classmethod
     def init_from_yaml(cls,root_dir='./',cfg_path='cfg/cfg_arm_right.yaml'):
         cfg = read_yaml_file(f'{root_dir}/{cfg_path}', is_convert_dict_to_class=True)
-        return cls(root_dir,cfg.host_ip,cfg.host_port,cfg.cam2base_H_path,cfg.tool_frame,cfg.home_state,cfg.middle_state,cfg.arm_vel,cfg.if_gripper,cfg.gripper_force,cfg.gripper_start_pos,cfg.gripper_vel)
+        return cls(root_dir,cfg.host_ip,cfg.host_port,cfg.cam2base_H_path,cfg.tool_frame,cfg.home_state,cfg.middle_state,cfg.arm_vel,cfg.if_gripper,cfg.gripper_force,cfg.gripper_start_pos,cfg.gripper_vel,cfg.dmp_n_candidates,cfg.dmp_goal_noise)
 
     def __str__(self):
         # self.get_j()
@@ -185,21 +196,46 @@ class Arm():
         
         return tag1 !=0 or tag2 != 0
 
-    def move_handle_dmp(self,pos,dmp_refer_tjt_path,dmp_middle_points,vel=None,save_dir=None,if_p=False,if_planb=False):
+    def move_handle_dmp(self,pos,dmp_refer_tjt_path,dmp_middle_points,vel=None,save_dir=None,if_p=False,if_planb=False,n_candidates=None,goal_noise=None):
         if not vel:
             vel = self.arm_vel
+        if n_candidates is None:
+            n_candidates = self.dmp_n_candidates
+        if goal_noise is None:
+            goal_noise = self.dmp_goal_noise
+        if goal_noise > DMP_GOAL_NOISE_MAX:
+            print(f'[Arm WARNING]: - {self.move_handle_dmp.__name__}: goal_noise {goal_noise} m capped to {DMP_GOAL_NOISE_MAX} m')
+            goal_noise = DMP_GOAL_NOISE_MAX
         
         ## init dmp
-        self.dmp = DMP(f'{self.root_dir}/{dmp_refer_tjt_path}')
+        self.dmp = self.load_dmp(dmp_refer_tjt_path)
         self.dmp_middle_points = dmp_middle_points
+        initial_pos = self.get_p()
+
+        ## candidate trajectories (K * T * 6): the nominal one first, then rollouts to perturbed goals, all at once
+        goal_poses = np.tile(np.array(pos,dtype=float),(n_candidates,1))
+        goal_poses[1:,:3] += np.random.uniform(-goal_noise,goal_noise,(n_candidates-1,3))
+        self.new_tjts = self.dmp.gen_new_tjts(initial_poses=[initial_pos],goal_poses=goal_poses)
+
+        ## pre-screen the candidates with ik before moving: the first one whose middle points all have a solution is followed for the whole path,
+        # its screened waypoints are tried first, none passing: the nominal trajectory as before the screening
+        start_joint = self.get_j()
+        k,nums = self.screen_dmp_waypoints(self.new_tjts,self.dmp_middle_points,start_joint,if_p=if_p)
+        self.new_tjt = self.new_tjts[k if k is not None else 0]
+        self.dmp_goal_offset = goal_poses[k,:3]-goal_poses[0,:3] if k is not None else None
+        print(f'[Arm INFO]: - {self.move_handle_dmp.__name__}: candidate: {k}/{n_candidates} goal offset: {None if self.dmp_goal_offset is None else np.round(self.dmp_goal_offset,4).tolist()} m')
         if save_dir:
             mkdir(save_dir)
-            self.new_tjt = self.dmp.gen_new_tjt(initial_pos=self.get_p(),goal_pos=pos,if_save=True,tjt_save_path=f'{save_dir}/refer_tjt.csv',img_save_path=f'{save_dir}/dmp.png',show=False)
-        else:
-            self.new_tjt = self.dmp.gen_new_tjt(initial_pos=self.get_p(),goal_pos=pos,if_save=False)
-        # # start moving
-        for middle_point in self.dmp_middle_points:
-            for num in range(middle_point-5,middle_point+5,3):
+            self.dmp.save_tjt(self.new_tjt,tjt_save_path=f'{save_dir}/refer_tjt.csv',img_save_path=f'{save_dir}/dmp.png',show=False)
+
+        # # start moving (the controller can still refuse a waypoint, the other steps of the window are tried then)
+        tag1 = 0
+        for i,middle_point in enumerate(self.dmp_middle_points):
+            window_nums = self.get_dmp_window(middle_point,self.new_tjt.shape[0])
+            if k is not None:
+                window_nums = [nums[i]]+[num for num in window_nums if num != nums[i]]
+            tag1 = -1
+            for num in window_nums:
                 self.middle_pose = self.dmp.get_middle_pose(tjt=self.new_tjt,num=num)
                 tag1 = self.move_p(pos=self.middle_pose,vel=vel,if_p=if_p)
                 if tag1 == 0:
@@ -222,6 +258,42 @@ class Arm():
         
         return tag1 !=0 or tag2 != 0
 
+    @staticmethod
+    def get_dmp_window(middle_point,tjt_len,window=DMP_MIDDLE_WINDOW):
+        ''' steps tried around a middle point: every 3rd step within +-window '''
+        return list(range(max(middle_point-window,0),min(middle_point+window,tjt_len),3))
+
+    @trace('IK screen',cat='arm')
+    def screen_dmp_waypoints(self,tjts,middle_points,start_joint,window=DMP_MIDDLE_WINDOW,if_p=False):
+        '''
+        tjts: K * T * 6 candidate trajectories, tried in order
+        for every middle point the first step of the window with an ik solution, seeded with the joints of the previous waypoint
+        return: index of the first candidate with a waypoint for every middle point (None if there is none), its steps (one per middle point)
+        '''
+        for k,tjt in enumerate(tjts):
+            joint = start_joint
+            nums = []
+            for middle_point in middle_points:
+                for num in self.get_dmp_window(middle_point,tjt.shape[0],window):
+                    middle_pose = self.dmp.get_middle_pose(tjt=tjt,num=num)
+                    tag,ik_result = self.ik([float(p) for p in middle_pose],start_joint=joint)
+                    if tag == 0:
+                        joint = list(ik_result)
+                        nums.append(num)
+                        break
+                else:
+                    break
+            if if_p:
+                print(f'[Arm INFO]: - {self.screen_dmp_waypoints.__name__}: candidate {k}: {len(nums)}/{len(middle_points)} middle points with an ik solution')
+            if len(nums) == len(middle_points):
+                return k,nums
+        return None,[]
+
+    def load_dmp(self,dmp_refer_tjt_path,if_p=False):
+        if dmp_refer_tjt_path not in self.dmps:
+            self.dmps[dmp_refer_tjt_path] = DMP(f'{self.root_dir}/{dmp_refer_tjt_path}',if_p=if_p)
+        return self.dmps[dmp_refer_tjt_path]
+
     def move_poses(self,poses,vel=None,trajectory_connect=1,if_p=False):
         if not vel:
             vel = self.arm_vel
@@ -407,12 +479,14 @@ class Arm():
             self.arm.print_frame(frame)
         return frame
 
+    @trace('IK',cat='arm')
     def ik(self,end_pos,start_joint=None,flag=1,if_p=False): # flag: 0 - quaternion; 1 - Euler Angle
-        if not start_joint:
+        if start_joint is None:
             start_joint = self.get_j(if_p=if_p)
         tag, ik_result =  self.arm.Algo_Inverse_Kinematics(start_joint, end_pos, flag)
         if if_p:
             print(f'[Arm INFO]: - {self.ik.__name__}: {tag} ik_result: {ik_result}')
+        return tag, ik_result
 
     def run(self):
         num = 0
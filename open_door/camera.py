@@ -1,6 +1,10 @@
 import time
+import bisect
 import keyboard
 import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import pyrealsense2 as rs
@@ -27,7 +31,12 @@ class CamIntrinsic(object):
         return f"CamIntrinsic(\n  fx={self.fx},\n  fy={self.fy},\n  cx={self.cx},\n  cy={self.cy},\n  intrinsic_matrix=\n{self.intrinsic_matrix}\n)"
 
 class Camera(object):
-    def __init__(self,width=1280,height=720,intrinsic_matrix=None,extrinsic=None,depth_scale=0.001,fps=30):
+    '''
+    if_stream: a background thread keeps the last ring_size aligned rgb-d frames, capture_* return the latest one without waiting on the pipeline
+               frames older than max_frame_age (3 frame periods) are never returned, an error of the thread is raised by get_latest / get_at
+    the png files of capture_* are written by a pool of writer_workers threads (in order for the same path), wait_writes() before reading them back
+    '''
+    def __init__(self,width=1280,height=720,intrinsic_matrix=None,extrinsic=None,depth_scale=0.001,fps=30,if_stream=True,ring_size=8,writer_workers=2):
         self.width = width
         self.height = height
         self.intrinsic = CamIntrinsic(intrinsic_matrix)
@@ -35,12 +44,28 @@ class Camera(object):
         self.extrinsic = extrinsic
         self.depth_scale = depth_scale
         self.pc = PointCloud(self.pinhole_intrinsic,self.extrinsic,1/self.depth_scale)
+        self.fps = fps
         self.connect(fps)
 
+        ## async png writer
+        self.writer = ThreadPoolExecutor(max_workers=writer_workers)
+        self.writes = {} # path: pending futures, in submission order
+        self.writes_lock = threading.Lock()
+
+        ## background acquisition
+        self.frames = deque(maxlen=ring_size) # (timestamp, rgb_img, d_img)
+        self.frames_cond = threading.Condition()
+        self.max_frame_age = 3.0/fps # s
+        self.stream_thread = None
+        self.stream_running = False
+        self.stream_error = None
+        if if_stream:
+            self.start_stream()
+
     @classmethod
     def init_from_yaml(cls,cfg_path='cfg/cfg_cam.yaml'):
         cfg = read_yaml_file(cfg_path, is_convert_dict_to_class=True)
-        return cls(cfg.width,cfg.height,cfg.intrinsic_matrix,cfg.extrinsic,cfg.depth_scale,cfg.fps)
+        return cls(cfg.width,cfg.height,cfg.intrinsic_matrix,cfg.extrinsic,cfg.depth_scale,cfg.fps,cfg.if_stream,cfg.ring_size,cfg.writer_workers)
 
     def __str__(self):
         return f"RealSense(\n  width={self.width},\n  height={self.height},\n  {self.intrinsic.__str__()},\n  depth_scale={self.depth_scale}\n)"
@@ -53,12 +78,139 @@ class Camera(object):
         self.config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, fps)
         self.config.enable_stream(rs.stream.color, self.width, self.height, rs.format.bgr8, fps)
         self.profile = self.pipeline.start(self.config)
+        self.align = rs.align(align_to=rs.stream.color)
         print('Camera Connected\n==========')
 
     def disconnect(self):
+        self.stop_stream()
+        self.wait_writes()
+        self.writer.shutdown(wait=True)
         self.pipeline.stop()
         cv2.destroyAllWindows()
 
+    def wait_for_aligned_frames(self):
+        frames = self.pipeline.wait_for_frames()
+        aligned_frames = self.align.process(frames)
+        aligned_depth_frame = aligned_frames.get_depth_frame()
+        aligned_color_frame = aligned_frames.get_color_frame()
+        # copies: the frame buffers go back to the pipeline
+        rgb_img = np.asanyarray(aligned_color_frame.get_data()).copy()
+        d_img = np.asanyarray(aligned_depth_frame.get_data()).copy()
+        return rgb_img,d_img
+
+    def start_stream(self):
+        if self.stream_running:
+            return
+        self.stream_running = True
+        self.stream_error = None
+        self.frames.clear()
+        self.stream_thread = threading.Thread(target=self.stream_loop)
+        self.stream_thread.daemon = True
+        self.stream_thread.start()
+
+    def stop_stream(self):
+        ''' needed before the methods that read the pipeline themselves (capture_video, viewers) '''
+        self.stream_running = False
+        if self.stream_thread is not None:
+            self.stream_thread.join()
+            self.stream_thread = None
+
+    def stream_loop(self):
+        try:
+            while self.stream_running:
+                try:
+                    rgb_img,d_img = self.wait_for_aligned_frames()
+                except RuntimeError as e: # frame timeout, the frames get old and get_latest refuses them
+                    print(f'[Camera ERROR] {e}')
+                    continue
+                with self.frames_cond:
+                    self.frames.append((time.time(),rgb_img,d_img))
+                    self.frames_cond.notify_all()
+        except Exception as e:
+            with self.frames_cond:
+                self.stream_error = e
+                self.stream_running = False
+                self.frames_cond.notify_all()
+
+    def check_stream(self):
+        if self.stream_error is not None:
+            raise RuntimeError(f'[Camera ERROR] acquisition thread stopped: {self.stream_error!r}') from self.stream_error
+
+    def get_latest(self,timeout=5.0):
+        '''
+        return: timestamp, rgb_img, d_img of the newest frame, shared arrays: do not modify them in place
+        waits (up to timeout) only when the newest frame is older than max_frame_age, e.g. the first one after start_stream
+        '''
+        is_fresh = lambda: self.stream_error is not None or (self.frames and time.time() - self.frames[-1][0] <= self.max_frame_age)
+        with self.frames_cond:
+            if not is_fresh():
+                self.frames_cond.wait_for(is_fresh,timeout=timeout)
+            self.check_stream()
+            if not self.frames:
+                raise RuntimeError('[Camera ERROR] no frame from the stream')
+            frame = self.frames[-1]
+        age = time.time() - frame[0]
+        if age > self.max_frame_age:
+            raise RuntimeError(f'[Camera ERROR] stream stalled, newest frame is {age:.3f} s old')
+        return frame
+
+    def get_at(self,t):
+        '''
+        return: timestamp, rgb_img, d_img of the frame of the ring closest to time t (time.time()), within max_frame_age of t
+        '''
+        with self.frames_cond:
+            self.check_stream()
+            frames = list(self.frames)
+        if not frames or t > frames[-1][0]:
+            frame = self.get_latest() # t after the newest frame: the next one
+        else:
+            times = [frame[0] for frame in frames]
+            i = bisect.bisect_left(times,t)
+            frame = frames[i-1] if i > 0 and t - times[i-1] <= times[i] - t else frames[i]
+        if abs(frame[0] - t) > self.max_frame_age:
+            raise RuntimeError(f'[Camera ERROR] no frame within {self.max_frame_age:.3f} s of {t}')
+        return frame
+
+    def get_frames(self):
+        ''' rgb_img, d_img: latest frame of the stream, or the next one of the pipeline if not streaming '''
+        if self.stream_running or self.stream_error is not None: # a dead stream raises, it never falls back silently
+            _,rgb_img,d_img = self.get_latest()
+            return rgb_img,d_img
+        return self.wait_for_aligned_frames()
+
+    def write_after(self,previous,save_path,img):
+        # the earlier write of the same path (submitted before, so already running or ahead in the queue) finishes first
+        if previous is not None:
+            previous.exception()
+        return cv2.imwrite(save_path,img)
+
+    def save_async(self,save_path,img):
+        with self.writes_lock:
+            pending = self.writes.setdefault(save_path,[])
+            future = self.writer.submit(self.write_after,pending[-1] if pending else None,save_path,img)
+            pending.append(future)
+        future.add_done_callback(lambda future: self.write_done(save_path,future))
+        return future
+
+    def write_done(self,save_path,future):
+        with self.writes_lock:
+            pending = self.writes.get(save_path,[])
+            if future in pending and future.exception() is None:
+                pending.remove(future)
+                if not pending:
+                    del self.writes[save_path]
+
+    def wait_writes(self,save_path=None):
+        ''' block until every pending png of save_path (all paths if None) is on disk, raise the error of a failed write '''
+        with self.writes_lock:
+            if save_path is None:
+                futures = [future for pending in self.writes.values() for future in pending]
+                self.writes = {}
+            else:
+                futures = self.writes.pop(save_path,[])
+        for future in futures:
+            future.result()
+
     def init_intrinsic(self):
         profile = self.pipeline.get_active_profile()
         color_stream = profile.get_stream(rs.stream.color)
@@ -85,41 +237,28 @@ class Camera(object):
         return depth_scale
 
     def capture_rgb(self,rgb_save_path=None):
-        frames = self.pipeline.wait_for_frames()
-        align = rs.align(align_to=rs.stream.color)
-        aligned_frames = align.process(frames)
-        aligned_color_frame = aligned_frames.get_color_frame()
-        rgb_img = np.asanyarray(aligned_color_frame.get_data())
+        rgb_img,_ = self.get_frames()
         if rgb_save_path is not None:
-            cv2.imwrite(rgb_save_path,rgb_img)
+            self.save_async(rgb_save_path,rgb_img)
         return rgb_img
 
     def capture_d(self,d_save_path=None):
-        frames = self.pipeline.wait_for_frames()
-        align = rs.align(align_to=rs.stream.color)
-        aligned_frames = align.process(frames)
-        aligned_depth_frame = aligned_frames.get_depth_frame()
-        d_img = np.asanyarray(aligned_depth_frame.get_data())
+        _,d_img = self.get_frames()
         if d_save_path is not None:
-            cv2.imwrite(d_save_path,d_img)
+            self.save_async(d_save_path,d_img)
         return d_img
 
     def capture_rgbd(self,rgb_save_path=None,d_save_path=None):
-        frames = self.pipeline.wait_for_frames()
-        align = rs.align(align_to=rs.stream.color)
-        aligned_frames = align.process(frames)
-        aligned_depth_frame = aligned_frames.get_depth_frame()
-        aligned_color_frame = aligned_frames.get_color_frame()
-        d_img = np.asanyarray(aligned_depth_frame.get_data())
-        rgb_img = np.asanyarray(aligned_color_frame.get_data())
+        rgb_img,d_img = self.get_frames()
         if rgb_save_path is not None:
-            cv2.imwrite(rgb_save_path,rgb_img)
+            self.save_async(rgb_save_path,rgb_img)
         if d_save_path is not None:
-            cv2.imwrite(d_save_path,d_img)
+            self.save_async(d_save_path,d_img)
             # np.save(d_save_path, d_img)
         return rgb_img,d_img
 
     def capture_video(self,duration,fps,save_path=None):
+        self.stop_stream() # this loop reads the pipeline itself
         fourcc = cv2.VideoWriter_fourcc(*"MP4V")
         out = cv2.VideoWriter(save_path, fourcc, fps, (self.width, self.height))
         # Record for specified duration
@@ -234,13 +373,7 @@ class Camera(object):
 
     def gen_pc_rs(self,pcd_path="pc.pcd"):
         ## need to wait for few seconds after starting the realsense, or else the visualization image will be wired!!!
-        frames = self.pipeline.wait_for_frames()
-        align = rs.align(align_to=rs.stream.color)
-        aligned_frames = align.process(frames)
-        aligned_depth_frame = aligned_frames.get_depth_frame()
-        aligned_color_frame = aligned_frames.get_color_frame()
-        d_img = np.asanyarray(aligned_depth_frame.get_data())
-        rgb_img = np.asanyarray(aligned_color_frame.get_data())
+        rgb_img,d_img = self.get_frames()
         rgb_img = cv2.cvtColor(rgb_img, cv2.COLOR_RGB2BGR)  # Convert to BGR
 
         pcd = self.pc.gen_pc_from_rgbd(rgb_img,d_img,pcd_path)
@@ -294,6 +427,7 @@ class Camera(object):
             print(f"Device: {serial_number}")
 
     def display_and_record(self):
+        self.stop_stream() # this loop reads the pipeline itself
         cv2.namedWindow('RealSense RGB', cv2.WINDOW_AUTOSIZE)
         fourcc = cv2.VideoWriter_fourcc(*'XVID')
         recording = False
@@ -329,6 +463,7 @@ class Camera(object):
             print(f"Recording stopped. {frame_count} frames recorded.")
 
     def rgbd_viewer(self):
+        self.stop_stream() # this loop reads the pipeline itself
         try:
             while True:
                 # Wait for a coherent pair of frames: depth and color
@@ -0,0 +1,139 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-02 16:08:45
+Version: v1
+File:
+Brief: joint current monitor of the primitives: a sampling thread at a fixed rate writing (timestamp, 7 currents) into a preallocated ring buffer,
+       every sample checked against the [min, max] bands of all joints at once
+       result: -1 safety issue (outside thresholds_safety), 0 event detected (outside thresholds_event), 1 no issue
+       rate and buffer_size come from monitor of cfg/cfg.yaml
+       stop() only flags the sampling thread, a late sample of a stopped session is dropped (one stop_event per session)
+       start() waits up to stop_timeout for the get_c() still in flight of the last session, then starts anyway
+'''
+import time
+import threading
+import numpy as np
+
+NUM_JOINTS = 7
+STOP_TIMEOUT = 0.5 # s, wait of start() for the last get_c() of the previous session
+
+class CurrentMonitor(object):
+    SAFETY_ISSUE = -1
+    EVENT_DETECTED = 0
+    NO_ISSUE = 1
+
+    def __init__(self,rate,buffer_size,stop_timeout=STOP_TIMEOUT):
+        '''
+        rate: Hz, buffer_size: samples, the oldest ones are overwritten
+        '''
+        self.rate = rate
+        self.period = 1.0/rate
+        self.buffer_size = buffer_size
+        self.stop_timeout = stop_timeout
+        self.buffer = np.zeros((buffer_size,1+NUM_JOINTS),dtype=np.float64) # timestamp, current of joint 0-6
+        self.count = 0 # samples written in this session
+        self.lock = threading.Lock() # held for bookkeeping only, never around get_c()
+        self.stop_event = threading.Event()
+        self.stop_event.set()
+        self.thread = None
+        self.start_time = None
+        self.result = None # (result, current, time since start) of the first issue of the session
+
+    def __str__(self):
+        print(f'[CurrentMonitor]: rate: {self.rate} Hz, buffer_size: {self.buffer_size}, samples: {self.count}, result: {self.result}')
+        return ''
+
+    @staticmethod
+    def to_bands(thresholds):
+        ''' [[min,max], ...] of the first joints -> lows, highs (NUM_JOINTS), no limit for the other joints '''
+        lows = np.full(NUM_JOINTS,-np.inf)
+        highs = np.full(NUM_JOINTS,np.inf)
+        if thresholds is not None and len(thresholds):
+            thresholds = np.asarray(thresholds,dtype=np.float64).reshape(-1,2)
+            lows[:len(thresholds)] = thresholds[:,0]
+            highs[:len(thresholds)] = thresholds[:,1]
+        return lows,highs
+
+    def check(self,currents):
+        '''
+        currents: NUM_JOINTS or N * NUM_JOINTS
+        return: -1 / 0 / 1 per sample (scalar for a single sample)
+        '''
+        currents = np.asarray(currents,dtype=np.float64)
+        safety = ((currents < self.safety_lows) | (currents > self.safety_highs)).any(axis=-1)
+        event = ((currents < self.event_lows) | (currents > self.event_highs)).any(axis=-1)
+        result = np.where(safety,self.SAFETY_ISSUE,np.where(event,self.EVENT_DETECTED,self.NO_ISSUE))
+        return int(result) if result.ndim == 0 else result
+
+    def start(self,get_current,thresholds_safety,thresholds_event=None,on_issue=None,on_stop=None,if_event_stop=True):
+        '''
+        get_current: Arm.get_c of the arm in use
+        on_issue(result, current, t): called once for the first issue, under the lock (stop() returns after it)
+        on_stop(): stops the motion, called after on_issue for a safety issue (and an event if if_event_stop)
+        '''
+        self.stop()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(self.stop_timeout) # the last session is still in get_c()
+            if self.thread.is_alive():
+                print(f'[CurrentMonitor WARNING]: - start: get_c() of the last session still running after {self.stop_timeout} s, starting anyway')
+        self.safety_lows,self.safety_highs = self.to_bands(thresholds_safety)
+        self.event_lows,self.event_highs = self.to_bands(thresholds_event)
+        with self.lock:
+            self.count = 0
+            self.result = None
+            self.start_time = time.time()
+            self.stop_event = threading.Event() # one per session, a late sample of the last session is dropped
+        self.thread = threading.Thread(target=self.loop,args=(self.stop_event,get_current,on_issue,on_stop,if_event_stop))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def loop(self,stop_event,get_current,on_issue,on_stop,if_event_stop):
+        next_time = time.perf_counter()
+        while not stop_event.is_set():
+            current = get_current()
+            t = time.time()
+            result = self.check(current[:NUM_JOINTS])
+            with self.lock:
+                if stop_event.is_set():
+                    break
+                self.push(t,current)
+                if result != self.NO_ISSUE:
+                    self.result = (result,list(current),t-self.start_time)
+                    if on_issue:
+                        on_issue(result,current,t-self.start_time)
+            if result != self.NO_ISSUE:
+                if on_stop and (result == self.SAFETY_ISSUE or if_event_stop):
+                    on_stop()
+                break
+            next_time += self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                stop_event.wait(delay)
+            else:
+                next_time = time.perf_counter() # get_c() slower than the rate, no catching up
+
+    def push(self,t,current):
+        row = self.buffer[self.count % self.buffer_size]
+        row[0] = t
+        row[1:] = current[:NUM_JOINTS]
+        self.count += 1
+
+    def stop(self):
+        '''
+        return: result of the session (None if no issue)
+        '''
+        with self.lock:
+            self.stop_event.set()
+            return self.result
+
+    def get_data(self):
+        '''
+        return: samples of the session in time order, N * (1+NUM_JOINTS): time since start, current of joint 0-6
+        '''
+        with self.lock:
+            n = min(self.count,self.buffer_size)
+            i = self.count % self.buffer_size
+            data = np.concatenate([self.buffer[i:n],self.buffer[:i]]) if self.count > self.buffer_size else self.buffer[:n].copy()
+        data[:,0] -= self.start_time if self.start_time is not None else 0
+        return data
@@ -1,5 +1,7 @@
 import matplotlib.pyplot as plt
 import os
+import glob
+import hashlib
 import numpy as np
 import pandas as pd
 import numpy as np
@@ -7,33 +9,94 @@ import matplotlib.pyplot as plt
 
 from dmp_package.dmp_discrete import dmp_discrete
 
+DMP_N_BFS = 1000
+# bump it when the learning of dmp_discrete changes, every cached weight file is learned again
+DMP_CACHE_VERSION = 1
+
 class DMP():
-    def __init__(self,tjt_path):
+    '''
+    the weights learned from a reference trajectory are cached in {tjt_dir}/dmp_cache/{tjt_name}_{hash}_{n_bfs}_v{DMP_CACHE_VERSION}.npz,
+    hash: sha1 of the csv content, so a recorded (changed) csv is learned again and its old cache files are removed
+    '''
+    def __init__(self,tjt_path,n_bfs=DMP_N_BFS,if_cache=True,cache_dir=None,if_p=False):
+        self.tjt_path = tjt_path
         self.tjt_dir = os.path.dirname(tjt_path)
-        df = pd.read_csv(tjt_path, header=None)
-        self.refer_tjt = np.array(df)
+        with open(tjt_path,'rb') as f:
+            content = f.read()
+        self.refer_tjt = np.loadtxt(content.decode('utf-8').splitlines(),delimiter=',',ndmin=2)
         self.data_dim = self.refer_tjt.shape[0] # 6
         self.data_len = self.refer_tjt.shape[1]
-        self.dmp = dmp_discrete(n_dmps=self.data_dim, n_bfs=1000, dt=1.0/self.data_len)
-        self.dmp.learning(self.refer_tjt)
+        self.n_bfs = n_bfs
+        self.dmp = dmp_discrete(n_dmps=self.data_dim, n_bfs=self.n_bfs, dt=1.0/self.data_len)
+
+        ## cached weights or learning
+        self.cache_dir = cache_dir if cache_dir else f'{self.tjt_dir}/dmp_cache'
+        tjt_name = os.path.splitext(os.path.basename(tjt_path))[0]
+        self.cache_path = f'{self.cache_dir}/{tjt_name}_{hashlib.sha1(content).hexdigest()[:16]}_{self.n_bfs}_v{DMP_CACHE_VERSION}.npz'
+        self.if_cached = if_cache and self.load_cache()
+        if not self.if_cached:
+            self.dmp.learning(self.refer_tjt)
+            if if_cache:
+                self.save_cache()
+        if if_p:
+            print(f'[DMP] {tjt_path}: {"cached" if self.if_cached else "learned"} ({self.cache_path})')
+
+    def load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path) as weights:
+                self.dmp.set_weights(dict(weights))
+            return True
+        except Exception as e:
+            print(f'[DMP] invalid cache {self.cache_path}: {e}, learning again')
+            return False
+
+    def save_cache(self):
+        os.makedirs(self.cache_dir,exist_ok=True)
+        # the caches of older versions of this csv are stale, the ones of other n_bfs / cache versions are kept
+        tjt_name = os.path.splitext(os.path.basename(self.tjt_path))[0]
+        for path in glob.glob(f'{glob.escape(self.cache_dir)}/{glob.escape(tjt_name)}_{"?"*16}_{self.n_bfs}_v{DMP_CACHE_VERSION}.npz'):
+            if path != self.cache_path:
+                os.remove(path)
+        tmp_path = self.cache_path.replace('.npz','.tmp.npz')
+        np.savez(tmp_path,**self.dmp.get_weights())
+        os.replace(tmp_path,self.cache_path)
     
     def gen_new_tjt(self,initial_pos,goal_pos,if_save=True,tjt_save_path=None,img_save_path=None,show=False):
         new_tjt, _, _ = self.dmp.reproduce(initial=initial_pos, goal=goal_pos)
         
         if if_save:
-            # save new tjt
-            if not tjt_save_path:
-                tjt_save_path = f'{self.tjt_dir}/new_tjt.csv'
-            df = pd.DataFrame(np.array(new_tjt))
-            df.to_csv(tjt_save_path, index=False, header=None)
-            
-            # save img
-            if not img_save_path:
-                img_save_path = f'{self.tjt_dir}/dmp.png'
-            self.plot_tjt(self.refer_tjt,new_tjt,show=show,save_path=img_save_path)
+            self.save_tjt(new_tjt,tjt_save_path,img_save_path,show)
         
         return new_tjt
 
+    def save_tjt(self,new_tjt,tjt_save_path=None,img_save_path=None,show=False):
+        # save new tjt
+        if not tjt_save_path:
+            tjt_save_path = f'{self.tjt_dir}/new_tjt.csv'
+        df = pd.DataFrame(np.array(new_tjt))
+        df.to_csv(tjt_save_path, index=False, header=None)
+        
+        # save img
+        if not img_save_path:
+            img_save_path = f'{self.tjt_dir}/dmp.png'
+        self.plot_tjt(self.refer_tjt,new_tjt,show=show,save_path=img_save_path)
+
+    def gen_new_tjts(self,initial_poses,goal_poses):
+        '''
+        one trajectory for each (initial_pos, goal_pos), all at once
+        initial_poses, goal_poses: K * 6 (one pose is used for all K)
+        return: K * T * 6, new_tjts[k] is gen_new_tjt(initial_poses[k],goal_poses[k])
+        '''
+        initial_poses = np.array(initial_poses,dtype=float).reshape(-1,self.data_dim)
+        goal_poses = np.array(goal_poses,dtype=float).reshape(-1,self.data_dim)
+        K = max(len(initial_poses),len(goal_poses))
+        initial_poses = np.broadcast_to(initial_poses,(K,self.data_dim))
+        goal_poses = np.broadcast_to(goal_poses,(K,self.data_dim))
+        new_tjts, _, _ = self.dmp.reproduce_batch(initials=initial_poses, goals=goal_poses)
+        return new_tjts
+
     def get_poses(self,tjt,step=50,if_p=False):
         poses = []
         data_dim = tjt.shape[0]
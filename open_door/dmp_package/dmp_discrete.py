@@ -6,7 +6,7 @@ Email: chaubyZou@163.com
 
 #%% import package
 import numpy as np
-from scipy.interpolate import interp1d
+from scipy.signal import lfilter
 import matplotlib.pyplot as plt
 
 
@@ -47,6 +47,22 @@ class dmp_discrete():
         # reset state
         self.reset_state()
 
+    # Learned parameters, to store them instead of learning again (open_door/dmp.py caches them)
+    def get_weights(self):
+        return {'w': self.w, 'psi_centers': self.psi_centers, 'h': self.h, 'delta': self.delta,
+                'y0': self.y0, 'goal': self.goal, 'y_demo': self.y_demo}
+
+    def set_weights(self, weights):
+        assert weights['w'].shape == (self.n_dmps, self.n_bfs), 'weights of another dmp'
+        self.w = np.array(weights['w'], dtype=float)
+        self.psi_centers = np.array(weights['psi_centers'], dtype=float)
+        self.h = np.array(weights['h'], dtype=float)
+        self.delta = np.array(weights['delta'], dtype=float).reshape(self.n_dmps, 1)
+        self.y0 = np.array(weights['y0'], dtype=float)
+        self.goal = np.array(weights['goal'], dtype=float)
+        self.y_demo = np.array(weights['y_demo'], dtype=float)
+        self.reset_state()
+
     # Reset the system state
     def reset_state(self):
         self.y = self.y0.copy()
@@ -61,11 +77,15 @@ class dmp_discrete():
         x_track = cs.run() # get all x over run time
         t_track = np.linspace(0, cs.run_time, cs.timesteps) # get all time ticks over run time
 
-        for n in range(len(t_centers)):
-            for i, t in enumerate(t_track):
-                if abs(t_centers[n] - t) <= cs.dt: # find the x center corresponding to the time center
-                    self.psi_centers[n] = x_track[i]
-        
+        # the x center corresponding to the time center: the last time tick with |t_center - t| <= dt
+        # (t_track is sorted, the ticks within dt are found by searchsorted, the neighbours are checked with the exact condition)
+        i_last = np.searchsorted(t_track, t_centers + cs.dt, side='right') - 1
+        i_candidates = np.clip(i_last[:, None] + np.array([1, 0, -1]), 0, len(t_track) - 1) # n_bfs * 3, last first
+        is_within = np.abs(t_centers[:, None] - t_track[i_candidates]) <= cs.dt
+        has_center = is_within.any(axis=1)
+        i_centers = i_candidates[np.arange(self.n_bfs), np.argmax(is_within, axis=1)]
+        self.psi_centers[has_center] = x_track[i_centers[has_center]]
+
         return self.psi_centers
 
     def generate_psi(self, x):
@@ -80,26 +100,19 @@ class dmp_discrete():
         x_track = self.cs.run()
         psi_track = self.generate_psi(x_track)
 
-        for d in range(self.n_dmps):
-            # ------------ Original DMP in Schaal 2002
-            # delta = self.goal[d] - self.y0[d]
-            
-            # ------------ Modified DMP in Schaal 2008
-            delta = 1.0
-            self.delta[d] = self.goal[d] - self.y0[d]
-
-            for b in range(self.n_bfs):
-                # as both number and denom has x(g-y_0) term, thus we can simplify the calculation process
-                numer = np.sum(x_track * psi_track[:,b] * f_target[:,d])
-                denom = np.sum(x_track**2 * psi_track[:,b])
-                # numer = np.sum(psi_track[:,b] * f_target[:,d]) # the simpler calculation
-                # denom = np.sum(x_track * psi_track[:,b])
-                # self.w[d, b] = numer / (denom*delta)
-
-                self.w[d, b] = numer / denom
-                if abs(delta) > 1e-6:
-                    self.w[d, b] = self.w[d, b] / delta
-                
+        # ------------ Original DMP in Schaal 2002
+        # delta = self.goal - self.y0
+
+        # ------------ Modified DMP in Schaal 2008 (delta = 1.0, w is not divided by it)
+        self.delta = (self.goal - self.y0).reshape(self.n_dmps, 1)
+
+        # all dimensions and basis functions at once: numer[d, b] = sum_t(x * psi[:,b] * f_target[:,d])
+        # as both number and denom has x(g-y_0) term, thus we can simplify the calculation process
+        numer = ((x_track[:, None] * psi_track).T @ f_target).T # n_dmps * n_bfs
+        denom = (x_track**2) @ psi_track # n_bfs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.w = numer / denom
+
         self.w = np.nan_to_num(self.w)
 
         return self.w
@@ -114,11 +127,8 @@ class dmp_discrete():
 
         # interpolate the demonstrated trajectory to be the same length with timesteps
         x = np.linspace(0, self.cs.run_time, y_demo.shape[1])
-        y = np.zeros((self.n_dmps, self.timesteps))
-        for d in range(self.n_dmps):
-            y_tmp = interp1d(x, y_demo[d])
-            for t in range(self.timesteps):
-                y[d, t] = y_tmp(t*self.dt)
+        t_track = np.arange(self.timesteps)*self.dt
+        y = np.array([np.interp(t_track, x, y_demo[d]) for d in range(self.n_dmps)])
         
         # calculate velocity and acceleration of y_demo
 
@@ -138,14 +148,14 @@ class dmp_discrete():
         # # ddy_demo = np.hstack((ddy_demo[:,0].reshape(self.n_dmps, 1), ddy_demo))
 
         x_track = self.cs.run()
-        f_target = np.zeros((y_demo.shape[1], self.n_dmps))
-        for d in range(self.n_dmps):
-            # ---------- Original DMP in Schaal 2002
-            # f_target[:,d] = ddy_demo[d] - self.alpha_y[d]*(self.beta_y[d]*(self.goal[d] - y_demo[d]) - dy_demo[d])
-
-            # ---------- Modified DMP in Schaal 2008, fixed the problem of g-y_0 -> 0
-            k = self.alpha_y[d]
-            f_target[:,d] = (ddy_demo[d] - self.alpha_y[d]*(self.beta_y[d]*(self.goal[d] - y_demo[d]) - dy_demo[d]))/k + x_track*(self.goal[d] - self.y0[d])
+        # ---------- Original DMP in Schaal 2002
+        # f_target = (ddy_demo - alpha_y*(beta_y*(goal - y_demo) - dy_demo)).T
+
+        # ---------- Modified DMP in Schaal 2008, fixed the problem of g-y_0 -> 0
+        alpha_y, beta_y = self.alpha_y[:, None], self.beta_y[:, None]
+        goal, y0 = self.goal[:, None], self.y0[:, None]
+        k = alpha_y
+        f_target = ((ddy_demo - alpha_y*(beta_y*(goal - y_demo) - dy_demo))/k + x_track*(goal - y0)).T # timesteps * n_dmps
         
         self.generate_weights(f_target)
 
@@ -172,34 +182,93 @@ class dmp_discrete():
 
     def reproduce(self, tau=None, initial=None, goal=None):
         # set temporal scaling
-        if tau == None:
+        if tau is None:
             timesteps = self.timesteps
         else:
             timesteps = round(self.timesteps/tau)
 
         # set initial state
-        if initial != None:
-            self.y0 = initial
+        if initial is not None:
+            self.y0 = np.array(initial, dtype=float)
         
         # set goal state
-        if goal != None:
-            self.goal = goal
+        if goal is not None:
+            self.goal = np.array(goal, dtype=float)
         
         # reset state
         self.reset_state()
 
-        y_reproduce = np.zeros((timesteps, self.n_dmps))
-        dy_reproduce = np.zeros((timesteps, self.n_dmps))
-        ddy_reproduce = np.zeros((timesteps, self.n_dmps))
+        return self.rollout(timesteps, self.tau if tau is None else tau)
+
+    def reproduce_batch(self, initials, goals, tau=None):
+        '''
+        K trajectories at once, one for each (initial, goal) pair, the weights are shared
+        initials, goals: K * n_dmps
+        return: y, dy, ddy (K * timesteps * n_dmps), y[k] is reproduce(tau, initials[k], goals[k])[0]
+        '''
+        timesteps = self.timesteps if tau is None else round(self.timesteps/tau)
+        self.cs.reset_state()
+        return self.rollout_batch(timesteps, self.tau if tau is None else tau, np.array(initials, dtype=float), np.array(goals, dtype=float))
+
+    def rollout(self, timesteps, tau=1.0):
+        '''
+        the whole trajectory at once, same result as calling step() timesteps times
+        return: y, dy, ddy (timesteps * n_dmps)
+        '''
+        self.delta_2 = (self.goal - self.y0).reshape(self.n_dmps, 1) # Modified DMP extended
+        y_reproduce, dy_reproduce, ddy_reproduce = [r[0] for r in self.rollout_batch(timesteps, tau, self.y0[None, :], self.goal[None, :])]
 
+        # leave the state where step() would have left it
+        if timesteps > 0:
+            self.y, self.dy, self.ddy = y_reproduce[-1].copy(), dy_reproduce[-1].copy(), ddy_reproduce[-1].copy()
+
+        return y_reproduce, dy_reproduce, ddy_reproduce
+
+    def rollout_batch(self, timesteps, tau, y0, goal):
+        '''
+        the canonical system and the forcing term for all timesteps, then the spring-damper integration
+        (semi-implicit Euler, linear in the state) as one 2nd order IIR filter per dimension
+        y0, goal: K * n_dmps
+        return: y, dy, ddy (K * timesteps * n_dmps)
+        '''
+        # canonical system (x after each step, as step_discrete)
+        x_track = np.zeros(timesteps)
         for t in range(timesteps):
-            y_reproduce[t], dy_reproduce[t], ddy_reproduce[t] = self.step(tau=tau)
-        
+            x_track[t] = self.cs.step_discrete(tau)
+
+        # forcing term, Modified DMP with a simple solution to overcome the drawbacks of trajectory reproduction
+        psi_track = self.generate_psi(x_track) # timesteps * n_bfs
+        k = self.alpha_y
+        delta = self.delta.reshape(-1)
+        delta_2 = goal - y0 # K * n_dmps
+        k2 = np.where(np.abs(delta) > 1e-5, delta_2 / np.where(np.abs(delta) > 1e-5, delta, 1.0), 1.0)
+        forcing = (psi_track @ self.w.T)*x_track[:, None] / np.sum(psi_track, axis=1)[:, None] # timesteps * n_dmps
+        f = k*(forcing[None, :, :]*k2[:, None, :]) - k*delta_2[:, None, :]*x_track[None, :, None] # K * timesteps * n_dmps
+
+        # e = y - goal: dy_t+1 = (1-alpha*h)*dy_t - alpha*beta*h*e_t + h*f_t, e_t+1 = e_t + h*dy_t+1 (h = tau*dt)
+        # -> e_t+1 + a1*e_t + a2*e_t-1 = h^2*f_t, started from rest (e_-1 = e_0 = y0 - goal)
+        h = tau*self.dt
+        y_reproduce = np.zeros(f.shape)
+        for d in range(self.n_dmps):
+            alpha_y, beta_y = self.alpha_y[d], self.beta_y[d]
+            a1 = alpha_y*h + alpha_y*beta_y*h**2 - 2
+            a2 = 1 - alpha_y*h
+            e0 = y0[:, d] - goal[:, d] # K
+            zi = np.stack([-(a1 + a2)*e0, -a2*e0], axis=1) # initial conditions of the filter (direct form II transposed)
+            e, _ = lfilter([h**2, 0, 0], [1, a1, a2], f[:, :, d], axis=1, zi=zi)
+            y_reproduce[:, :, d] = e + goal[:, d:d+1]
+
+        # velocity and acceleration
+        y_prev = np.concatenate((y0[:, None, :], y_reproduce[:, :-1]), axis=1)
+        dy_reproduce = (y_reproduce - y_prev) / h
+        dy_prev = np.concatenate((np.zeros((len(y0), 1, self.n_dmps)), dy_reproduce[:, :-1]), axis=1)
+        ddy_reproduce = self.alpha_y*(self.beta_y*(goal[:, None, :] - y_prev) - dy_prev) + f
+
         return y_reproduce, dy_reproduce, ddy_reproduce
 
     def step(self, tau=None):
         # run canonical system
-        if tau == None:
+        if tau is None:
             tau = self.tau
         x = self.cs.step_discrete(tau)
 
@@ -218,9 +287,9 @@ class dmp_discrete():
             # ---------- Modified DMP with a simple solution to overcome the drawbacks of trajectory reproduction
             k = self.alpha_y[d]
 
-            self.delta_2[d] = self.goal[d] - self.y0[d] # Modified DMP extended
-            if abs(self.delta[d]) > 1e-5:
-                k2 = self.delta_2[d]/self.delta[d]
+            self.delta_2[d, 0] = self.goal[d] - self.y0[d] # Modified DMP extended
+            if abs(self.delta[d, 0]) > 1e-5:
+                k2 = self.delta_2[d, 0]/self.delta[d, 0]
             else:
                 k2 = 1.0
 
@@ -27,7 +27,7 @@ class DTSAM():
         x,y,orientation = detic_sam(img_path,self.classes,self.device,self.threshold)
         return x,y,orientation
 
-    def get_xy_server(self,img_path,server,remote_python_path,remote_root_dir,remote_img_dir):
+    def get_xy_server(self,img_path,server,remote_python_path,remote_root_dir,remote_img_dir,client=None):
         remote_dtsam_script_dir = f'{remote_root_dir}/dtsam_package/'
         remote_dtsam_script_path = f'detic_sam.py'
         local_img_path = img_path
@@ -38,27 +38,41 @@ class DTSAM():
         server.transfer_file_local2remote(local_img_path,remote_img_path)
 
         # dtsam
-        dtsam_cmd = f'cd {remote_dtsam_script_dir}; {remote_python_path} {remote_dtsam_script_path} -i {remote_img_path} -c {self.classes} -d {self.device} -t {self.threshold}'
-        server.exec_cmd(dtsam_cmd)
+        if client is not None:
+            # perception daemon: models are already loaded on the server
+            data = client.dtsam(remote_img_path,self.classes,self.threshold)
+        else:
+            dtsam_cmd = f'cd {remote_dtsam_script_dir}; {remote_python_path} {remote_dtsam_script_path} -i {remote_img_path} -c {self.classes} -d {self.device} -t {self.threshold}'
+            server.exec_cmd(dtsam_cmd)
 
         # transfer the output dir to the server
         server.transfer_folder_remote2local(f'{remote_img_dir}/dtsam/', f'{os.path.dirname(local_img_path)}/dtsam/')
 
         # open dtsam_result.json to get x and y
-        with open(f'{os.path.dirname(local_img_path)}/dtsam/dtsam_result.json','r') as f:
-            data = json.load(f)
-            x = data['Cx']
-            y = data['Cy']
-            w = data['w']
-            h = data['h']
-            box = data['box']
-            orientation = data['orientation']
+        if client is None:
+            with open(f'{os.path.dirname(local_img_path)}/dtsam/dtsam_result.json','r') as f:
+                data = json.load(f)
+        x = data['Cx']
+        y = data['Cy']
+        w = data['w']
+        h = data['h']
+        box = data['box']
+        orientation = data['orientation']
         # print(f'Cx: {x}, Cy: {y}')
         # print(f'w: {w}, h: {h} orientation: {orientation}')
         # print(f'box:{box}')
         
         return x,y,orientation,w,h,box
 
+    def get_xy_payload(self,rgb_img,client,vis_dir=None):
+        '''
+        rgb_img: BGR array from the camera, sent to the perception server in the request (no sftp)
+        vis_dir: remote dir for the visualizations (bbox/segm/mask/center.png), None to skip them
+        return: x,y,orientation,w,h,box and the handle mask (bool array, None if nothing is detected)
+        '''
+        data = client.dtsam_payload(rgb_img,self.classes,self.threshold,vis_dir=vis_dir)
+        return data['Cx'],data['Cy'],data['orientation'],data['w'],data['h'],data['box'],data['mask']
+
     def process_images_server(self,img_path,server,remote_python_path,remote_root_dir,remote_img_dir):
         local_img_path = img_path
         
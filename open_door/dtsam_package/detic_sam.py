@@ -18,6 +18,12 @@ from mpl_toolkits.mplot3d import Axes3D
 from PIL import Image, ImageDraw
 import torch
 import time
+import hashlib
+
+# CLIP text embeddings of the custom vocabularies are cached here (resolved before changing the working directory)
+EMBEDDING_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'clip_embeddings')
+TEXT_ENCODER_VERSION = 'detic-clip-ViT-B/32' # change it if build_text_encoder changes, so old cache files are not used
+
 # Change the current working directory to 'Detic'
 
 try:
@@ -54,7 +60,7 @@ import matplotlib.patches as patches
 sys.path.append("..")
 from segment_anything import sam_model_registry, SamPredictor
 
-def DETIC_predictor():
+def DETIC_predictor(device='cpu'):
     # Build the detector and download our pretrained weights
     cfg = get_cfg()
     add_centernet_config(cfg)
@@ -64,7 +70,7 @@ def DETIC_predictor():
     cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.1 # set threshold for this model
     cfg.MODEL.ROI_BOX_HEAD.ZEROSHOT_WEIGHT_PATH = 'rand'
     cfg.MODEL.ROI_HEADS.ONE_CLASS_PER_PROPOSAL = True # For better visualization purpose. Set to False for all classes.
-    cfg.MODEL.DEVICE='cpu' # 'cuda' or 'cpu'
+    cfg.MODEL.DEVICE=device # 'cuda' or 'cpu'
     detic_predictor = DefaultPredictor(cfg)
     return detic_predictor
 
@@ -91,11 +97,39 @@ def default_vocab():
     num_classes = len(metadata.thing_classes)
     reset_cls_test(detic_predictor.model, classifier, num_classes)
 
-def get_clip_embeddings(vocabulary, prompt='a '):
-    text_encoder = build_text_encoder(pretrain=True)
-    text_encoder.eval()
-    texts = [prompt + x for x in vocabulary]
-    emb = text_encoder(texts).detach().permute(1, 0).contiguous().cpu()
+_text_encoder = None
+_clip_embeddings = {} # vocab key -> D x C embedding
+
+def get_text_encoder():
+    # only built when an embedding is missing from both caches
+    global _text_encoder
+    if _text_encoder is None:
+        _text_encoder = build_text_encoder(pretrain=True)
+        _text_encoder.eval()
+    return _text_encoder
+
+def get_vocab_key(vocabulary, prompt='a '):
+    data = json.dumps([TEXT_ENCODER_VERSION, prompt, list(vocabulary)])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+def get_clip_embeddings(vocabulary, prompt='a ', use_cache=True):
+    '''
+    D x C CLIP text embeddings of the vocabulary, cached in memory and on disk (EMBEDDING_CACHE_DIR/<vocab key>.npy)
+    '''
+    key = get_vocab_key(vocabulary, prompt)
+    if use_cache and key in _clip_embeddings:
+        return _clip_embeddings[key]
+    cache_path = os.path.join(EMBEDDING_CACHE_DIR, f'{key}.npy')
+    if use_cache and os.path.exists(cache_path):
+        emb = torch.from_numpy(np.load(cache_path))
+    else:
+        texts = [prompt + x for x in vocabulary]
+        with torch.no_grad():
+            emb = get_text_encoder()(texts).detach().permute(1, 0).contiguous().cpu()
+        if use_cache:
+            os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+            np.save(cache_path, emb.numpy())
+    _clip_embeddings[key] = emb
     return emb
 
 def visualize_detic(output):
@@ -106,11 +140,20 @@ def visualize_detic(output):
 
 def custom_vocab(detic_predictor, classes, threshold=0.3):
     vocabulary = 'custom'
-    metadata = MetadataCatalog.get("__unused2")
-    metadata.thing_classes = classes # Change here to try your own vocabularies!
-    classifier = get_clip_embeddings(metadata.thing_classes)
-    num_classes = len(metadata.thing_classes)
-    reset_cls_test(detic_predictor.model, classifier, num_classes)
+    if isinstance(classes, str):
+        classes = [classes]
+    key = get_vocab_key(classes)
+    # one metadata per vocabulary: detectron2 refuses to overwrite thing_classes of an existing metadata
+    metadata = MetadataCatalog.get(f"__dtsam_{key}")
+    if not hasattr(metadata, 'thing_classes'):
+        metadata.thing_classes = list(classes) # Change here to try your own vocabularies!
+
+    # only swap the classifier head when the vocabulary changes (e.g. lever -> knob)
+    if getattr(detic_predictor, 'vocab_key', None) != key:
+        classifier = get_clip_embeddings(metadata.thing_classes)
+        num_classes = len(metadata.thing_classes)
+        reset_cls_test(detic_predictor.model, classifier, num_classes)
+        detic_predictor.vocab_key = key
 
     # Reset visualization threshold
     output_score_threshold = threshold
@@ -124,15 +167,36 @@ def Detic(im, metadata, detic_predictor, visualize=False):
 
     # Run model and show results
     output =detic_predictor(im[:, :, ::-1])  # Detic expects BGR images.
-    v = Visualizer(im, metadata)
-    out = v.draw_instance_predictions(output["instances"].to('cpu'))
     instances = output["instances"].to('cpu')
     boxes = instances.pred_boxes.tensor.numpy()
     classes = instances.pred_classes.numpy()
     if visualize:
+        v = Visualizer(im, metadata)
+        out = v.draw_instance_predictions(instances)
         visualize_detic(out)
     return boxes, classes
 
+def Detic_batch(ims, detic_predictor):
+    '''
+    Same as Detic() for a list of RGB images, in one forward pass (the preprocessing of DefaultPredictor.__call__).
+    '''
+    inputs = []
+    for im in ims:
+        original_image = im[:, :, ::-1]  # Detic expects BGR images.
+        if detic_predictor.input_format == "RGB":
+            original_image = original_image[:, :, ::-1]
+        height, width = original_image.shape[:2]
+        image = detic_predictor.aug.get_transform(original_image).apply_image(original_image)
+        image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
+        inputs.append({"image": image, "height": height, "width": width})
+    with torch.no_grad():
+        outputs = detic_predictor.model(inputs)
+    detections = []
+    for output in outputs:
+        instances = output["instances"].to('cpu')
+        detections.append((instances.pred_boxes.tensor.numpy(), instances.pred_classes.numpy()))
+    return detections
+
 def show_mask(mask, ax, random_color=False):
     if random_color:
         color = np.concatenate([np.random.random(3), np.array([0.6])], axis=0)
@@ -159,6 +223,7 @@ def visualize_output(im, masks, input_boxes, classes, image_save_path, mask_only
             plt.gca().text(x, y - 5, class_name, color='white', fontsize=12, fontweight='bold', bbox=dict(facecolor='green', edgecolor='green', alpha=0.5))
     plt.axis('off')
     plt.savefig(image_save_path)
+    plt.close()
     #plt.show()
 
 def SAM_predictor(device):
@@ -182,6 +247,47 @@ def SAM(im, boxes, class_idx, metadata, sam_predictor):
     )
     return masks
 
+def SAM_batch(ims, boxes_list, sam_predictor):
+    '''
+    SAM for several RGB images: the ViT image encoder (the expensive part) runs once on the stacked batch,
+    then the boxes of each image are decoded with its own features. Images without boxes are skipped.
+    return: list of masks (None for images without boxes)
+    '''
+    model = sam_predictor.model
+    masks_list = [None] * len(ims)
+    indices = [i for i, boxes in enumerate(boxes_list) if len(boxes) > 0]
+    if len(indices) == 0:
+        return masks_list
+
+    input_images, input_sizes = [], []
+    for i in indices:
+        # same preprocessing as SamPredictor.set_image, the model pads every image to img_size x img_size
+        input_image = sam_predictor.transform.apply_image(ims[i])
+        input_image_torch = torch.as_tensor(input_image, device=sam_predictor.device)
+        input_image_torch = input_image_torch.permute(2, 0, 1).contiguous()[None, :, :, :]
+        input_sizes.append(tuple(input_image_torch.shape[-2:]))
+        input_images.append(model.preprocess(input_image_torch))
+    with torch.no_grad():
+        features = model.image_encoder(torch.cat(input_images, dim=0))
+
+    for k, i in enumerate(indices):
+        sam_predictor.reset_image()
+        sam_predictor.features = features[k:k+1]
+        sam_predictor.original_size = ims[i].shape[:2]
+        sam_predictor.input_size = input_sizes[k]
+        sam_predictor.is_image_set = True
+        input_boxes = torch.tensor(boxes_list[i], device=sam_predictor.device)
+        transformed_boxes = sam_predictor.transform.apply_boxes_torch(input_boxes, ims[i].shape[:2])
+        masks, _, _ = sam_predictor.predict_torch(
+            point_coords=None,
+            point_labels=None,
+            boxes=transformed_boxes,
+            multimask_output=False,
+        )
+        masks_list[i] = masks
+    sam_predictor.reset_image()
+    return masks_list
+
 def generate_colors(num_colors):
     hsv_colors = []
     for i in range(num_colors):
@@ -263,9 +369,7 @@ def test_process_2d_mask(mask):
     # Print the center coordinates
     print("Center:", Cx, Cy)
 
-def detic_sam(image_path,classes='handle',device='cuda:0',threshold=0.3):
-    start_time = time.time()
-
+def detic_sam(image_path,classes='handle',device='cuda:0',threshold=0.3,detic_predictor=None,sam_predictor=None,return_result=False):
     # We are one directory up in Detic.
     image_path = os.path.join("..", image_path)
     image_dir = os.path.dirname(image_path)+'/dtsam'
@@ -278,10 +382,29 @@ def detic_sam(image_path,classes='handle',device='cuda:0',threshold=0.3):
     # open image
     image = Image.open(image_path)
     image = np.array(image, dtype=np.uint8)
+
+    result,mask = detic_sam_array(image,classes,device,threshold,detic_predictor,sam_predictor,image_dir=image_dir)
+
+    result_save_path = image_dir+'/dtsam_result.json'
+    with open(result_save_path, 'w') as file:
+        json.dump(result, file, indent=4)
     
-    # crete predictor
-    detic_predictor = DETIC_predictor()
-    sam_predictor = SAM_predictor(device)
+    if return_result:
+        return result
+    return result['Cx'],result['Cy'],result['orientation']
+
+def detic_sam_array(image,classes='handle',device='cuda:0',threshold=0.3,detic_predictor=None,sam_predictor=None,image_dir=None):
+    '''
+    image: np.uint8 RGB array. Visualizations (bbox/segm/mask/center.png) are only written when image_dir is given.
+    return: result dict (w,h,box,Cx,Cy,orientation) and the handle mask (bool array, None if nothing is detected)
+    '''
+    start_time = time.time()
+
+    # predictors are owned by a DticSamEngine which lives as long as the process
+    if detic_predictor is None or sam_predictor is None:
+        engine = get_engine(device)
+        detic_predictor = engine.detic_predictor if detic_predictor is None else detic_predictor
+        sam_predictor = engine.sam_predictor if sam_predictor is None else sam_predictor
     metadata = custom_vocab(detic_predictor, classes,threshold)
     predictor_time = time.time() - start_time
     # print(f'[predictor_time]: {predictor_time} s')
@@ -291,10 +414,16 @@ def detic_sam(image_path,classes='handle',device='cuda:0',threshold=0.3):
     detic_detect_time = time.time() - predictor_time
     # print(f'[detic_detect_time]: {detic_detect_time} s')
 
-    # assert len(boxes) > 0, "Zero detections."
+    return segment_detections(image, boxes, class_idx, metadata, sam_predictor, image_dir=image_dir)
 
-    result_save_path = image_dir+'/dtsam_result.json'
+def segment_detections(image, boxes, class_idx, metadata, sam_predictor, image_dir=None, masks=None):
+    '''
+    SAM on the Detic boxes of one image, then the handle center/orientation from the first mask.
+    masks: SAM masks computed beforehand (e.g. by SAM_batch), SAM is run here if None
+    '''
+    # assert len(boxes) > 0, "Zero detections."
 
+    mask = None
     if len(boxes) == 0:
         print(f'Zero detections.')
         w = 0
@@ -304,20 +433,22 @@ def detic_sam(image_path,classes='handle',device='cuda:0',threshold=0.3):
         orientation = ''
         box = [0,0,0,0]
     else:
-        masks = SAM(image, boxes, class_idx, metadata, sam_predictor)
-        sam_detect_time = time.time() - detic_detect_time
-        # print(f'[sam_detect_time]: {sam_detect_time} s')
-
-        # Save detections as a png. Save only segmentation without bounding box as a separate image.
-        classes = [metadata.thing_classes[idx] for idx in class_idx]
-        bbox_image_save_path = image_dir+'/bbox.png'
-        segm_image_save_path = image_dir+'/segm.png'
-        mask_image_save_path = image_dir+'/mask.png'
-        center_image_save_path = image_dir+'/center.png'
-        visualize_output(image, masks, boxes, classes, bbox_image_save_path)
-        visualize_output(image, masks, boxes, classes, segm_image_save_path, mask_only=True)
-        Cx, Cy = process_masks(masks,mask_image_save_path,center_image_save_path)
-        orientation = 'horizontal'
+        if masks is None:
+            masks = SAM(image, boxes, class_idx, metadata, sam_predictor)
+
+        mask = masks[0].cpu().numpy()[0]
+        if image_dir:
+            # Save detections as a png. Save only segmentation without bounding box as a separate image.
+            classes = [metadata.thing_classes[idx] for idx in class_idx]
+            bbox_image_save_path = image_dir+'/bbox.png'
+            segm_image_save_path = image_dir+'/segm.png'
+            mask_image_save_path = image_dir+'/mask.png'
+            center_image_save_path = image_dir+'/center.png'
+            visualize_output(image, masks, boxes, classes, bbox_image_save_path)
+            visualize_output(image, masks, boxes, classes, segm_image_save_path, mask_only=True)
+            Cx, Cy = process_masks(masks,mask_image_save_path,center_image_save_path)
+        else:
+            Cx, Cy = get_mask_center(mask,save_path=None)
         box = [float(value) for value in boxes[0].tolist()]
         w, h = box[2] - box[0], box[3] - box[1]
         orientation = 'horizontal' if w >= h else 'vertical'
@@ -332,10 +463,56 @@ def detic_sam(image_path,classes='handle',device='cuda:0',threshold=0.3):
               "Cy":Cy,
               "orientation":orientation
     }
-    with open(result_save_path, 'w') as file:
-        json.dump(result, file, indent=4)
-    
-    return Cx,Cy,orientation
+    return result,mask
+
+class DticSamEngine(object):
+    '''
+    Owns the Detic and SAM predictors for the lifetime of the process, so the SwinB and ViT-H weights are loaded once.
+    device: SAM device, detic_device: Detic device (the same as device if not given)
+    '''
+    def __init__(self, device='cuda:0', detic_device=None, classes='handle', threshold=0.3):
+        self.device = device
+        self.detic_device = detic_device if detic_device else device
+        self.classes = classes
+        self.threshold = threshold
+        self.detic_predictor = DETIC_predictor(self.detic_device)
+        self.sam_predictor = SAM_predictor(self.device)
+        custom_vocab(self.detic_predictor, self.classes, self.threshold)
+
+    def detect(self, image, classes=None, threshold=None, image_dir=None):
+        '''
+        image: np.uint8 RGB array
+        return: result dict (w,h,box,Cx,Cy,orientation) and the handle mask (None if nothing is detected)
+        '''
+        classes = self.classes if classes is None else classes
+        threshold = self.threshold if threshold is None else threshold
+        return detic_sam_array(image, classes, self.device, threshold, self.detic_predictor, self.sam_predictor, image_dir=image_dir)
+
+    def detect_batch(self, images, classes=None, threshold=None, image_dirs=None, batch_size=4):
+        '''
+        images: list of np.uint8 RGB arrays, Detic and the SAM image encoder run batch_size images per forward pass
+        return: list of (result, mask)
+        '''
+        classes = self.classes if classes is None else classes
+        threshold = self.threshold if threshold is None else threshold
+        if image_dirs is None:
+            image_dirs = [None] * len(images)
+        metadata = custom_vocab(self.detic_predictor, classes, threshold)
+        outputs = []
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i+batch_size]
+            detections = Detic_batch(batch, self.detic_predictor)
+            masks_list = SAM_batch(batch, [boxes for boxes, _ in detections], self.sam_predictor)
+            for image, (boxes, class_idx), masks, image_dir in zip(batch, detections, masks_list, image_dirs[i:i+batch_size]):
+                outputs.append(segment_detections(image, boxes, class_idx, metadata, self.sam_predictor, image_dir=image_dir, masks=masks))
+        return outputs
+
+_engines = {} # device -> DticSamEngine
+
+def get_engine(device='cuda:0'):
+    if device not in _engines:
+        _engines[device] = DticSamEngine(device)
+    return _engines[device]
 
 def main(args):
     detic_sam(args.image_path,args.classes,args.device,args.threshold)
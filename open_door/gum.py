@@ -12,24 +12,44 @@ import time
 
 from utils.lib_io import *
 
+GUM_PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'gum_package')
+
 class GUM(object):
-    def __init__(self,img_w=640,img_h=640,model_path='checkpoints/gum.pth',device='cuda:0'):
+    def __init__(self,img_w=640,img_h=640,model_path='checkpoints/gum.pth',device='cuda:0',backend='server',local_model_path='checkpoints/gum_int8_dynamic.onnx'):
         self.img_w = img_w
         self.img_h = img_h
         self.model_path = model_path
         self.device = device
+        self.backend = backend # 'server': on the gpu server, 'local': exported model (gum_package/export.py) on this cpu
+        self.local_model_path = local_model_path
+        self.if_local = backend == 'local'
+        self.local_session = None
     
     @classmethod
     def init_from_yaml(cls,cfg_path='cfg/cfg_gum.yaml'):
         cfg = read_yaml_file(cfg_path, is_convert_dict_to_class=True)
-        return cls(cfg.img_w,cfg.img_h,cfg.model_path,cfg.device)
+        return cls(cfg.img_w,cfg.img_h,cfg.model_path,cfg.device,cfg.backend,cfg.local_model_path)
 
     def get_dxdyR(self,image_path='',mask_path='',root_dir=''):
         from gum_package.get_dxdyR import get_dxdyR
         dx,dy,R = get_dxdyR(image_path,mask_path,self.model_path,self.device,root_dir)
         return dx,dy,R
     
-    def get_dxdyR_server(self,image_path,mask_path,server,remote_python_path,remote_root_dir,remote_img_dir):
+    def load_local(self):
+        # load once, the session stays warm between grasps
+        if self.local_session is None:
+            from gum_package.get_dxdyR import GUMInferenceSession
+            self.local_session = GUMInferenceSession(self.local_model_path,device='cpu',root_dir=GUM_PACKAGE_DIR)
+        return self.local_session
+
+    def get_dxdyR_local(self,image,mask):
+        '''
+        image,mask: cropped rgb image and center image (path / PIL / RGB array), no ssh or sftp
+        '''
+        dx,dy,R = self.load_local().predict(image,mask)
+        return dx,dy,R
+
+    def get_dxdyR_server(self,image_path,mask_path,server,remote_python_path,remote_root_dir,remote_img_dir,client=None):
         start_time = time.time()
 
         local_rgb_img_path = image_path
@@ -44,7 +64,11 @@ class GUM(object):
         transfer_time = time.time()
         # print(f'[Transfer1 time]: {transfer_time - start_time} s')
 
-        # gum
+        # gum (perception daemon: the model is already loaded on the server and the result comes back in the response)
+        if client is not None:
+            data = client.gum(remote_rgb_img_path,remote_mask_path)
+            return data['dx'],data['dy'],data['R']
+
         remote_gum_script_dir = f'{remote_root_dir}/gum_package/'
         remote_gum_script_path = f'get_dxdyR.py'
         gum_cmd = f'cd {remote_gum_script_dir}; {remote_python_path} {remote_gum_script_path} -i {remote_rgb_img_path} -m {remote_mask_path} -model {self.model_path} -d {self.device}'
@@ -66,6 +90,13 @@ class GUM(object):
 
         return dx,dy,R
 
+    def get_dxdyR_payload(self,rgb_img,mask_img,client):
+        '''
+        rgb_img,mask_img: cropped images (PIL or BGR array), sent to the perception server in the request (no sftp)
+        '''
+        data = client.gum_payload(rgb_img,mask_img)
+        return data['dx'],data['dy'],data['R']
+
 if __name__ == "__main__":
     gum = GUM()
     image_path = r'/media/datadisk10tb/leo/projects/realman-robot/open_door/data/test/trajectory_000/1.png'
@@ -0,0 +1,72 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-09-25 16:40:52
+Version: v1
+File:
+Brief: cpu latency and dx/dy/R error of the exported gum models (export.py) against the fp32 model
+       usage: python benchmark.py -model checkpoints/gum.pth -exported checkpoints/gum.ts checkpoints/gum.onnx checkpoints/gum_int8_dynamic.onnx -data /media/datadisk10tb/leo/projects/data/lever/test
+'''
+import time
+import argparse
+import numpy as np
+import torch
+
+from get_dxdyR import GUMInferenceSession
+from export import load_test_dataset
+
+def run(session,dataset,n_warmup=5):
+    '''
+    one sample per forward pass, as on the robot
+    return: outputs (num * 3), latencies (num) in ms
+    '''
+    for image,mask,_ in dataset[:n_warmup]:
+        session.forward(image.unsqueeze(0),mask.unsqueeze(0))
+    outputs,latencies = [],[]
+    for image,mask,_ in dataset:
+        start_time = time.time()
+        output = session.forward(image.unsqueeze(0),mask.unsqueeze(0))
+        latencies.append((time.time()-start_time)*1000)
+        outputs.append(output[0])
+    return np.array(outputs),np.array(latencies)
+
+def benchmark(model_path,exported_paths,data_dir,num=None,num_threads=None):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    dataset = load_test_dataset(data_dir,num)
+    targets = np.array([target.numpy() for _,_,target in dataset])
+
+    results = {}
+    fp32_outputs = None
+    for path in [model_path]+exported_paths:
+        session = GUMInferenceSession(path,device='cpu')
+        print(session)
+        outputs,latencies = run(session,dataset)
+        if fp32_outputs is None:
+            fp32_outputs = outputs
+        results[path] = {'latency_mean':latencies.mean(),
+                         'latency_p50':np.percentile(latencies,50),
+                         'latency_p90':np.percentile(latencies,90),
+                         'error_vs_fp32':np.abs(outputs-fp32_outputs).mean(axis=0), # dx,dy,R
+                         'error_vs_label':np.abs(outputs-targets).mean(axis=0), # dx,dy,R
+        }
+
+    print(f'[Benchmark] {len(dataset)} samples, batch size 1, cpu')
+    print(f'{"model":<50} {"mean(ms)":>9} {"p50(ms)":>9} {"p90(ms)":>9} {"|d|-fp32 (dx,dy,R)":>26} {"|d|-label (dx,dy,R)":>26}')
+    for path,r in results.items():
+        error_vs_fp32 = ','.join(f'{e:.3f}' for e in r['error_vs_fp32'])
+        error_vs_label = ','.join(f'{e:.3f}' for e in r['error_vs_label'])
+        print(f'{path[-50:]:<50} {r["latency_mean"]:>9.2f} {r["latency_p50"]:>9.2f} {r["latency_p90"]:>9.2f} {error_vs_fp32:>26} {error_vs_label:>26}')
+    return results
+
+def main(args):
+    benchmark(args.model_path,args.exported_paths,args.data_dir,args.num,args.num_threads)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-model", "--model_path", type=str, default="./checkpoints/gum.pth", help="fp32 model (state dict), the reference.")
+    parser.add_argument("-exported", "--exported_paths", nargs="+", default=[], help="Exported models (*.ts / *.onnx) to compare.")
+    parser.add_argument("-data", "--data_dir", type=str, required=True, help="GUM test split.")
+    parser.add_argument("-n", "--num", type=int, default=None, help="Number of test samples (all if not given).")
+    parser.add_argument("-t", "--num_threads", type=int, default=None, help="torch cpu threads.")
+    main(parser.parse_args())
@@ -3,118 +3,182 @@ Author: TX-Leo
 Mail: tx.leo.wz@gmail.com
 Date: 2024-09-18 23:24:23
 Version: v1
-File: 
-Brief: 
+File:
+Brief: batched evaluation of gum checkpoints (*.pth, or *.onnx / *.ts of export.py) on the test sets
+       metrics over all samples at once: mse, mae / rmse / relative error of dx, dy, R,
+       pixel error of the grasp point (Cx+dx, Cy+dy) and of the unlock point (grasp point after rotate_point by R)
+       broken down by handle category, orientation and both
+       {output_dir}/eval.json: all metrics of every model, {output_dir}/eval.csv: one row per model and group
+       usage: python eval.py -model checkpoints/gum*.pth -manifest manifests/all.yaml
+              python eval.py -model checkpoints/gum8.pth checkpoints/gum8.onnx -data /media/datadisk10tb/leo/projects/data/crossbar/test
 '''
 import os
-import matplotlib.pyplot as plt
+import csv
+import json
+import time
+import argparse
 import numpy as np
 import torch
-import torch.nn as nn
 from torch.utils.data import DataLoader
 
-from handle_grasp_unlock_dataset import HandleGraspUnlockDataset
-from handle_grasp_unlock_model import HandleGraspUnlockModel
-
-BATCH_SIZE = 16
-RESNET_DEPTH = 18
-
-def eval():
-    eval_dataset_dir = r'/media/datadisk10tb/leo/projects/data/lver/test'
-    model_load_path = r'./checkpoints/gum8.pth'
-    eval_vis_path = r'./checkpoints/'
-
-    ## dataset and dataloader
-    eval_dataset = HandleGraspUnlockDataset(root_dir=eval_dataset_dir)
-    print(eval_dataset)
-    eval_dataset = [data for data in eval_dataset if data is not None]
-    eval_dataloader = DataLoader(eval_dataset, batch_size=BATCH_SIZE, shuffle=False)
-
-    ## model
-    model = HandleGraspUnlockModel(resnet_depth=RESNET_DEPTH, pretrained=True,device=device).to(device)
-    model.load_state_dict(torch.load(model_load_path))
-    model.eval()
-    
-    total_loss = 0.0
-    loss_fn = nn.MSELoss()
-
-    relative_errors = []
-    all_real_values = []
-    all_predicted_values = []
-
-    with torch.no_grad():
-        for i, (images, masks, targets) in enumerate(eval_dataloader):
-            outputs = model(images, masks)
-
-            loss = loss_fn(outputs, targets.to(device))
-            total_loss += loss.item()
-
-            all_real_values.extend(targets.cpu().numpy())
-            all_predicted_values.extend(outputs.cpu().detach().numpy())
-
-            for j in range(targets.size(0)):
-                real_dx, real_dy, real_R = targets[j].cpu().numpy()
-
-                ## forward
-                predicted_dx, predicted_dy, predicted_R = outputs[j].cpu().detach().numpy()
-
-                ## error
-                if real_dx != 0:
-                    relative_error_dx = abs((predicted_dx - real_dx) / real_dx)
-                else:
-                    # relative_error_dx = float('inf')
-                    relative_error_dx = 0
-                if real_dy != 0:
-                    relative_error_dy = abs((predicted_dy - real_dy) / real_dy)
-                else:
-                    # relative_error_dy = float('inf')
-                    relative_error_dy = 0
-                if real_R != 0:
-                    relative_error_R = abs((predicted_R - real_R) / real_R)
-                else:
-                    # relative_error_R = float('inf')
-                    relative_error_R = 0
-                print(f'relative_error_dx: {relative_error_dx}')
-                print(f'relative_error_dy: {relative_error_dy}')
-                print(f'relative_error_R: {relative_error_R}')
-                relative_errors.append([relative_error_dx, relative_error_dy, relative_error_R])
-
-            print(f'Batch [{i+1}/{len(eval_dataloader)}], Loss: {loss.item():.4f}')
-
-    average_loss = total_loss / len(eval_dataloader)
-    print(f'Average eval Loss: {average_loss:.4f}')
-
-    # Calculate the average relative error for all samples
-    relative_errors = np.array(relative_errors)
-    mean_relative_errors = np.mean(relative_errors, axis=0)
-    print(f"Mean Relative Errors (dx, dy, R): {mean_relative_errors}")
-
-    labels = ['dx', 'dy', 'R']
-    colors = ['blue', 'green', 'red']
-    
-    plt.figure(figsize=(15, 5))
-
-    for i in range(3):
-        plt.figure()
-        
-        real_values = [val[i] for val in all_real_values]
-        predicted_values = [val[i] for val in all_predicted_values]
-
-        x = np.arange(len(real_values))
-
-        plt.bar(x - 0.2, real_values, width=0.4, label='Real', color='red')
-        plt.bar(x + 0.2, predicted_values, width=0.4, label='Predicted', color='green')
-
-        plt.xlabel('Data Index')
-        plt.ylabel(f'{labels[i]} Value')
-        plt.title(f'Real vs. Predicted {labels[i]}')
-        plt.legend()
-        plt.grid(True)
-
-        plt.tight_layout()
-        plt.savefig(os.path.join(eval_vis_path, f"eval_vis_{labels[i]}_lver_8.png"))
-        plt.close()
-    
+from handle_data_packing import get_samples
+from get_dxdyR import GUMInferenceSession
+from train import load_manifest, load_dataset, is_packed, to_device
+
+import sys
+root_dir = "../"
+sys.path.append(root_dir)
+from utils.lib_rgbd import rotate_points
+
+BATCH_SIZE = 64
+LABELS = ['dx', 'dy', 'R']
+SPLITS = ['train', 'test', 'val', 'train_small', 'original']
+
+def get_category(dataset_dir):
+    ''' .../lever/test -> lever '''
+    dataset_dir = os.path.normpath(dataset_dir)
+    name = os.path.basename(dataset_dir)
+    return os.path.basename(os.path.dirname(dataset_dir)) if name in SPLITS else name
+
+def load_infos(dataset_dirs):
+    '''
+    category, orientation, Cx, Cy of every sample, in the order of load_dataset
+    '''
+    categories, orientations, Cx, Cy = [], [], [], []
+    for dataset_dir in dataset_dirs:
+        if is_packed(dataset_dir):
+            with open(os.path.join(dataset_dir, 'index.json'), 'r') as f:
+                index = json.load(f)
+            categories += [index['category']] * index['num']
+            orientations += index['orientations']
+            Cx += index['Cx']
+            Cy += index['Cy']
+        else:
+            samples = get_samples(dataset_dir)
+            categories += [get_category(dataset_dir)] * len(samples)
+            orientations += [annotations.get('orientation', '') for _, annotations in samples]
+            Cx += [annotations.get('Cx', 0) for _, annotations in samples]
+            Cy += [annotations.get('Cy', 0) for _, annotations in samples]
+    return {'category': np.array(categories), 'orientation': np.array(orientations), 'Cx': np.array(Cx, dtype=np.float64), 'Cy': np.array(Cy, dtype=np.float64)}
+
+def predict(session, dataloader, on_device_normalize):
+    '''
+    return: outputs, targets (N * 3)
+    '''
+    outputs, targets = [], []
+    for images, masks, target in dataloader:
+        images, masks, _ = to_device(images, masks, target, torch.device(session.device), on_device_normalize)
+        outputs.append(session.forward(images, masks))
+        targets.append(target.numpy())
+    return np.concatenate(outputs).astype(np.float64), np.concatenate(targets).astype(np.float64)
+
+def compute_metrics(outputs, targets, infos):
+    '''
+    per sample errors of the whole set at once, then averaged per group
+    return: {group: metrics}, group: 'all' / category / orientation / category-orientation
+    '''
+    errors = outputs - targets # N * 3
+    abs_errors = np.abs(errors)
+    nonzero = targets != 0
+    relative_errors = np.where(nonzero, abs_errors / np.where(nonzero, np.abs(targets), 1), np.nan) # no relative error for a zero label
+
+    ## grasp point and unlock point (rotate_point of the grasp point by R, as primitive.py)
+    orientation = np.where(infos['orientation'] == 'vertical', 'vertical', 'horizontal')
+    x1_real, y1_real = infos['Cx'] + targets[:, 0], infos['Cy'] + targets[:, 1]
+    x1_pred, y1_pred = infos['Cx'] + outputs[:, 0], infos['Cy'] + outputs[:, 1]
+    x2_real, y2_real, _, _ = rotate_points(x1_real, y1_real, targets[:, 2], orientation)
+    x2_pred, y2_pred, _, _ = rotate_points(x1_pred, y1_pred, outputs[:, 2], orientation)
+    grasp_errors = np.hypot(x1_pred - x1_real, y1_pred - y1_real)
+    unlock_errors = np.hypot(x2_pred - x2_real, y2_pred - y2_real)
+
+    groups = {'all': np.ones(len(targets), dtype=bool)}
+    for category in np.unique(infos['category']):
+        groups[category] = infos['category'] == category
+    for orientation_name in np.unique(infos['orientation']):
+        groups[orientation_name] = infos['orientation'] == orientation_name
+    for category in np.unique(infos['category']):
+        for orientation_name in np.unique(infos['orientation']):
+            group = (infos['category'] == category) & (infos['orientation'] == orientation_name)
+            if group.any():
+                groups[f'{category}-{orientation_name}'] = group
+
+    metrics = {}
+    for name, group in groups.items():
+        if not group.any():
+            continue
+        metrics[name] = {'num': int(group.sum()),
+                         'mse': float((errors[group] ** 2).mean()),
+                         'mae': dict(zip(LABELS, abs_errors[group].mean(axis=0).tolist())),
+                         'rmse': dict(zip(LABELS, np.sqrt((errors[group] ** 2).mean(axis=0)).tolist())),
+                         'relative_error': dict(zip(LABELS, [float(np.nanmean(e)) if not np.isnan(e).all() else None for e in relative_errors[group].T])),
+                         'grasp_px_error_mean': float(grasp_errors[group].mean()),
+                         'grasp_px_error_median': float(np.median(grasp_errors[group])),
+                         'unlock_px_error_mean': float(unlock_errors[group].mean()),
+                         'unlock_px_error_median': float(np.median(unlock_errors[group])),
+                         'R_sign_accuracy': float((np.sign(outputs[group, 2]) == np.sign(targets[group, 2])).mean()),
+        }
+    return metrics
+
+def to_rows(model_path, metrics):
+    rows = []
+    for group, m in metrics.items():
+        row = {'model': model_path, 'group': group, 'num': m['num'], 'mse': m['mse']}
+        for key in ['mae', 'rmse', 'relative_error']:
+            row.update({f'{key}_{label}': m[key][label] for label in LABELS})
+        row.update({key: m[key] for key in ['grasp_px_error_mean', 'grasp_px_error_median', 'unlock_px_error_mean', 'unlock_px_error_median', 'R_sign_accuracy']})
+        rows.append(row)
+    return rows
+
+def print_metrics(model_path, metrics):
+    print(f'[Eval] {model_path}')
+    print(f'{"group":<24} {"num":>6} {"mae dx":>8} {"mae dy":>8} {"mae R":>8} {"rmse dx":>8} {"rmse dy":>8} {"rmse R":>8} {"grasp px":>9} {"unlock px":>9}')
+    for group, m in metrics.items():
+        print(f'{group:<24} {m["num"]:>6} {m["mae"]["dx"]:>8.2f} {m["mae"]["dy"]:>8.2f} {m["mae"]["R"]:>8.2f} {m["rmse"]["dx"]:>8.2f} {m["rmse"]["dy"]:>8.2f} {m["rmse"]["R"]:>8.2f} {m["grasp_px_error_mean"]:>9.2f} {m["unlock_px_error_mean"]:>9.2f}')
+
+def eval(model_paths, dataset_dirs, output_dir='./checkpoints/eval', device='cuda:0', batch_size=BATCH_SIZE, num_workers=8):
+    ## dataset (loaded once for all models)
+    on_device_normalize = all(is_packed(d) for d in dataset_dirs)
+    dataset = load_dataset(dataset_dirs, normalize=not on_device_normalize)
+    infos = load_infos(dataset_dirs)
+    assert len(dataset) == len(infos['category'])
+    print(f'[Eval] {len(dataset)} samples')
+    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=True)
+
+    report, rows = {}, []
+    for model_path in model_paths:
+        start_time = time.time()
+        session = GUMInferenceSession(model_path, device=device)
+        outputs, targets = predict(session, dataloader, on_device_normalize)
+        metrics = compute_metrics(outputs, targets, infos)
+        report[model_path] = metrics
+        rows += to_rows(model_path, metrics)
+        print_metrics(model_path, metrics)
+        print(f'[Eval Time] {time.time()-start_time:.1f} s')
+        GUMInferenceSession.models.clear() # one model in memory at a time
+
+    ## report
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'eval.json'), 'w') as f:
+        json.dump({'datasets': dataset_dirs, 'models': report}, f, indent=4)
+    with open(os.path.join(output_dir, 'eval.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f'[Report] {output_dir}/eval.json, {output_dir}/eval.csv')
+    return report
+
+def main(args):
+    dataset_dirs = args.data_dirs if args.data_dirs else load_manifest(args.manifest)['val']
+    device = args.device if args.device else ("cuda:0" if torch.cuda.is_available() else "cpu")
+    eval(args.model_paths, dataset_dirs, args.output_dir, device, args.batch_size, args.num_workers)
+
 if __name__ == "__main__":
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    eval(device)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-model", "--model_paths", nargs="+", default=['./checkpoints/gum8.pth'], help="Models to evaluate (*.pth / *.onnx / *.ts).")
+    parser.add_argument("-manifest", "--manifest", type=str, default='manifests/all.yaml', help="Test sets: the val split of a manifest.")
+    parser.add_argument("-data", "--data_dirs", nargs="+", default=None, help="Test sets (packs or folders), instead of the manifest.")
+    parser.add_argument("-o", "--output_dir", type=str, default='./checkpoints/eval', help="Folder of eval.json and eval.csv.")
+    parser.add_argument("-b", "--batch_size", type=int, default=BATCH_SIZE, help="Batch size.")
+    parser.add_argument("-w", "--num_workers", type=int, default=8, help="DataLoader workers.")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run on.")
+    main(parser.parse_args())
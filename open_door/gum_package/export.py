@@ -0,0 +1,110 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-09-25 15:06:21
+Version: v1
+File:
+Brief: export a trained gum*.pth for the cpu of the robot laptop (GUM backend: 'local' in cfg_gum.yaml)
+       {name}.ts: traced torchscript, {name}.onnx: onnx graph
+       -q dynamic: int8 weights ({name}_int8_dynamic.ts / .onnx)
+       -q static: int8 weights and activations, calibrated on the gum test split ({name}_int8_static.onnx)
+       usage: python export.py -model checkpoints/gum.pth -q dynamic static -data /media/datadisk10tb/leo/projects/data/lever/test
+       then: python benchmark.py -model checkpoints/gum.pth -exported checkpoints/gum.onnx checkpoints/gum_int8_dynamic.onnx ...
+'''
+import os
+import argparse
+import torch
+import torch.nn as nn
+
+from get_dxdyR import GUMInferenceSession
+from handle_grasp_unlock_dataset import HandleGraspUnlockDataset
+
+ONNX_OPSET = 13
+
+def get_example_inputs(batch_size=1):
+    image = torch.randn(batch_size,3,224,224)
+    mask = torch.randn(batch_size,3,224,224)
+    return image,mask
+
+def load_test_dataset(data_dir,num=None):
+    dataset = HandleGraspUnlockDataset(root_dir=data_dir)
+    print(dataset)
+    dataset = [data for data in dataset if data is not None]
+    return dataset[:num] if num else dataset
+
+def export_torchscript(model,save_path):
+    image,mask = get_example_inputs()
+    with torch.no_grad():
+        traced = torch.jit.trace(model,(image,mask))
+    traced.save(save_path)
+    print(f'[Export] torchscript: {save_path}')
+    return save_path
+
+def export_onnx(model,save_path):
+    image,mask = get_example_inputs()
+    torch.onnx.export(model,(image,mask),save_path,
+                      input_names=['image','mask'],output_names=['dxdyR'],
+                      dynamic_axes={'image':{0:'batch_size'},'mask':{0:'batch_size'},'dxdyR':{0:'batch_size'}},
+                      opset_version=ONNX_OPSET)
+    print(f'[Export] onnx: {save_path}')
+    return save_path
+
+def quantize_dynamic_torchscript(model,save_path):
+    # torch only has dynamic int8 kernels for the linear layers (the predictor), the resnet stays fp32
+    quantized = torch.ao.quantization.quantize_dynamic(model,{nn.Linear},dtype=torch.qint8)
+    return export_torchscript(quantized,save_path)
+
+def quantize_dynamic_onnx(onnx_path,save_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(onnx_path,save_path,weight_type=QuantType.QInt8)
+    print(f'[Export] onnx int8 (dynamic): {save_path}')
+    return save_path
+
+def quantize_static_onnx(onnx_path,save_path,dataset):
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+
+    class GUMCalibrationDataReader(CalibrationDataReader):
+        def __init__(self,dataset):
+            self.data = iter(dataset)
+
+        def get_next(self):
+            data = next(self.data,None)
+            if data is None:
+                return None
+            image,mask,_ = data
+            return {'image':image.unsqueeze(0).numpy(),'mask':mask.unsqueeze(0).numpy()}
+
+    quantize_static(onnx_path,save_path,GUMCalibrationDataReader(dataset),
+                    quant_format=QuantFormat.QDQ,activation_type=QuantType.QUInt8,weight_type=QuantType.QInt8,per_channel=True)
+    print(f'[Export] onnx int8 (static, {len(dataset)} calibration samples): {save_path}')
+    return save_path
+
+def export(model_path,quantization=[],data_dir=None,num_calibration=100):
+    '''
+    model_path: gum*.pth (state dict of train.py), the exported models are saved next to it
+    quantization: [] / ['dynamic'] / ['static'] / ['dynamic','static']
+    return: list of the exported model paths
+    '''
+    name = os.path.splitext(model_path)[0]
+    model = GUMInferenceSession(model_path,device='cpu').model
+
+    save_paths = [export_torchscript(model,f'{name}.ts'),export_onnx(model,f'{name}.onnx')]
+    if 'dynamic' in quantization:
+        save_paths.append(quantize_dynamic_torchscript(model,f'{name}_int8_dynamic.ts'))
+        save_paths.append(quantize_dynamic_onnx(f'{name}.onnx',f'{name}_int8_dynamic.onnx'))
+    if 'static' in quantization:
+        assert data_dir, 'static quantization needs the test split for calibration (-data)'
+        dataset = load_test_dataset(data_dir,num_calibration)
+        save_paths.append(quantize_static_onnx(f'{name}.onnx',f'{name}_int8_static.onnx',dataset))
+    return save_paths
+
+def main(args):
+    export(args.model_path,args.quantization,args.data_dir,args.num_calibration)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-model", "--model_path", type=str, default="./checkpoints/gum.pth", help="Trained model (state dict) to export.")
+    parser.add_argument("-q", "--quantization", nargs="*", default=[], choices=['dynamic','static'], help="int8 quantization to export as well.")
+    parser.add_argument("-data", "--data_dir", type=str, default=None, help="GUM test split for the static quantization calibration.")
+    parser.add_argument("-n", "--num_calibration", type=int, default=100, help="Number of calibration samples.")
+    main(parser.parse_args())
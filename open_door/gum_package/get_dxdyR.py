@@ -17,17 +17,106 @@ import sys
 root_dir = "./gum_package"
 sys.path.append(root_dir)
     
-from handle_grasp_unlock_model import HandleGraspUnlockModel
+import numpy as np
+from handle_grasp_unlock_model import HandleGraspUnlockModel, GUM_TRANSFORM, get_fusion_from_state_dict
 
 RESNET_DEPTH = 18
 
-def get_dxdyR(image_path='',mask_path='',model_path='checkpoints/gum8.pth',device='cuda:0',root_dir='./',if_p=False):
+def get_runtime(model_path):
+    ''' 'onnx': onnx graph (export.py), 'torchscript': traced model (export.py), 'torch': state dict (train.py) '''
+    if model_path.endswith('.onnx'):
+        return 'onnx'
+    if model_path.endswith('.ts'):
+        return 'torchscript'
+    return 'torch'
+
+class GUMInferenceSession(object):
+    '''
+    keeps the gum model warm: one model per (checkpoint, device, resnet depth) in the process,
+    the ImageNet weights are skipped since the checkpoint overwrites them anyway,
+    the fusion ('shared'/'dual'/'early') is read from the checkpoint weights
+    the exported models of export.py run on the cpu: *.onnx with onnxruntime, *.ts with torchscript
+    usage:
+        session = GUMInferenceSession('checkpoints/gum.pth','cpu',root_dir='./gum_package')
+        dx,dy,R = session.predict(image,mask)
+    '''
+    models = {}
+
+    def __init__(self,model_path='checkpoints/gum8.pth',device='cuda:0',root_dir='./',resnet_depth=RESNET_DEPTH):
+        self.model_path = os.path.abspath(os.path.join(root_dir,model_path))
+        self.runtime = get_runtime(self.model_path)
+        self.device = str(device) if self.runtime == 'torch' else 'cpu'
+        self.resnet_depth = resnet_depth
+        key = (self.model_path,self.device,self.resnet_depth)
+        if key not in self.models:
+            self.models[key] = self.load(self.model_path,self.runtime,self.device,self.resnet_depth)
+        self.model = self.models[key]
+
+    @staticmethod
+    def load(model_path,runtime,device,resnet_depth):
+        if runtime == 'onnx':
+            import onnxruntime
+            return onnxruntime.InferenceSession(model_path,providers=['CPUExecutionProvider'])
+        if runtime == 'torchscript':
+            return torch.jit.load(model_path,map_location='cpu').eval()
+        state_dict = torch.load(model_path, map_location=device)
+        model = HandleGraspUnlockModel(resnet_depth=resnet_depth, pretrained=False, device=device, fusion=get_fusion_from_state_dict(state_dict)).to(device)
+        model.load_state_dict(state_dict)
+        model.eval()
+        return model
+
+    def __str__(self):
+        return f'[GUMInferenceSession]: model_path: {self.model_path}, runtime: {self.runtime}, device: {self.device}, resnet_depth: {self.resnet_depth}'
+
+    def to_tensor(self,img):
+        '''
+        img: path, PIL image or np.uint8 array in RGB order (h*w*3), a 2d mask array becomes white on black
+        return: 3 * 224 * 224 tensor
+        '''
+        if isinstance(img,str):
+            img = Image.open(img)
+        elif isinstance(img,np.ndarray):
+            if img.dtype == bool:
+                img = img.astype(np.uint8)*255
+            img = Image.fromarray(img)
+        return GUM_TRANSFORM(img.convert('RGB'))
+
+    def predict(self,image,mask):
+        '''
+        image: cropped rgb image, mask: cropped center image (mask + red dot at the handle center, see mask2center_image)
+        return: dx,dy,R
+        '''
+        return self.predict_batch([image],[mask])[0]
+
+    def predict_batch(self,images,masks):
+        '''
+        one forward pass for all the (image,mask) pairs
+        return: list of (dx,dy,R)
+        '''
+        images = torch.stack([self.to_tensor(image) for image in images]) # batch_size * 3 * 224 * 224
+        masks = torch.stack([self.to_tensor(mask) for mask in masks]) # batch_size * 3 * 224 * 224
+        outputs = self.forward(images,masks)
+        return [(float(dx),float(dy),float(R)) for dx,dy,R in outputs]
+
+    def forward(self,images,masks):
+        '''
+        images,masks: transformed tensors, batch_size * 3 * 224 * 224
+        return: np.array, batch_size * 3 (dx,dy,R)
+        '''
+        if self.runtime == 'onnx':
+            outputs = self.model.run(None,{'image':images.numpy(),'mask':masks.numpy()})[0]
+            return np.asarray(outputs).reshape(-1,3)
+        with torch.no_grad():
+            return self.model(images,masks).reshape(-1,3).cpu().numpy()
+
+def load_model(model_path='checkpoints/gum8.pth',device='cuda:0',root_dir='./'):
+    return GUMInferenceSession(model_path,device,root_dir).model
+
+def get_dxdyR(image_path='',mask_path='',model_path='checkpoints/gum8.pth',device='cuda:0',root_dir='./',if_p=False,model=None):
     start_time = time.time()
-    ## model
-    model = HandleGraspUnlockModel(resnet_depth=RESNET_DEPTH, pretrained=True).to(device)
-    model_path = f'{root_dir}/{model_path}'
-    model.load_state_dict(torch.load(model_path))
-    model.eval()
+    ## model (a loaded model can be passed in by a long-lived process, e.g. perception_server.py)
+    if model is None:
+        model = load_model(model_path,device,root_dir)
     load_time = time.time()
     # print(f'[load_time]: {load_time-start_time} s')
 
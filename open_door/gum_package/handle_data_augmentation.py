@@ -46,9 +46,10 @@ class HandleDataAugmentator:
         self.crop_height = 640
         self.sum = 0
 
-        if not os.path.exists(self.output_train_dir):
+        # no output dirs: only the augmentation itself is used (handle_data_augmentation_online.py)
+        if self.output_train_dir and not os.path.exists(self.output_train_dir):
             os.makedirs(self.output_train_dir)
-        if not os.path.exists(self.output_test_dir):
+        if self.output_test_dir and not os.path.exists(self.output_test_dir):
             os.makedirs(self.output_test_dir)
 
     def augment_data(self):
@@ -176,25 +177,7 @@ class HandleDataAugmentator:
                     # self.visualization(translated_data,new_filepath,new_filepath.replace('.png', '_vis.png'))
 
                     # 4. Crop image and annotations
-                    crop_x_min = translated_data['Cx'] - self.crop_width // 2
-                    crop_y_min = translated_data['Cy'] - self.crop_height // 2
-                    crop_x_max = crop_x_min + self.crop_width
-                    crop_y_max = crop_y_min + self.crop_height
-
-                    # Adjust crop coordinates to stay within image boundaries
-                    if crop_x_min < 0:
-                        crop_x_min = 0
-                        crop_x_max = self.crop_width
-                    elif crop_x_max > new_width:
-                        crop_x_max = new_width
-                        crop_x_min = new_width - self.crop_width
-
-                    if crop_y_min < 0:
-                        crop_y_min = 0
-                        crop_y_max = self.crop_height
-                    elif crop_y_max > new_height:
-                        crop_y_max = new_height
-                        crop_y_min = new_height - self.crop_height
+                    crop_x_min, crop_y_min, crop_x_max, crop_y_max = self.get_crop_box(translated_data['Cx'], translated_data['Cy'], new_width, new_height)
 
                     # Crop image
                     cropped_image = translated_image.crop((crop_x_min, crop_y_min, crop_x_max, crop_y_max))
@@ -221,6 +204,35 @@ class HandleDataAugmentator:
                     self.visualization(cropped_data,new_filepath,new_filepath.replace('.png', '_vis.png'))
 
 
+    def get_crop_box(self, Cx, Cy, img_w, img_h):
+        """
+        Crop box of crop_width * crop_height centered on the handle, shifted to stay within the image boundaries.
+
+        Returns:
+            tuple: (crop_x_min, crop_y_min, crop_x_max, crop_y_max)
+        """
+        crop_x_min = Cx - self.crop_width // 2
+        crop_y_min = Cy - self.crop_height // 2
+        crop_x_max = crop_x_min + self.crop_width
+        crop_y_max = crop_y_min + self.crop_height
+
+        # Adjust crop coordinates to stay within image boundaries
+        if crop_x_min < 0:
+            crop_x_min = 0
+            crop_x_max = self.crop_width
+        elif crop_x_max > img_w:
+            crop_x_max = img_w
+            crop_x_min = img_w - self.crop_width
+
+        if crop_y_min < 0:
+            crop_y_min = 0
+            crop_y_max = self.crop_height
+        elif crop_y_max > img_h:
+            crop_y_max = img_h
+            crop_y_min = img_h - self.crop_height
+
+        return crop_x_min, crop_y_min, crop_x_max, crop_y_max
+
     def adjust_annotations(self, data, tx, ty, ratio):
         """
         Adjusts the annotations based on translation and resize.
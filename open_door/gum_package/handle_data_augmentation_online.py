@@ -0,0 +1,189 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-09-27 14:52:08
+Version: v1
+File:
+Brief: on-the-fly version of handle_data_augmentation.py: the same Flip/Resize/Translate/Crop, sampled anew for every sample of every epoch,
+       applied to a batch of original images on the gpu (one grid_sample from the original image straight to 224 * 224), nothing written to disk
+       the annotations go through the adjust_annotations* of HandleDataAugmentator, so the targets are the ones the offline path would write
+       handle_data_augmentation.py stays the reproducible offline path
+       usage:
+           augmentator = HandleDataAugmentator(input_dir, None, None) # ranges of the augmentation, nothing is written
+           dataset = OriginalHandleDataset(input_dir, split='train', repeat=50)
+           dataloader = DataLoader(dataset, batch_size=32, shuffle=True, num_workers=8, pin_memory=True, collate_fn=collate_original)
+           augmentation = OnlineAugmentation(augmentator)
+           for images, masks, sizes, datas in dataloader:
+               images, masks, targets, datas = augmentation(images.to(device), masks.to(device), sizes, datas)
+'''
+import os
+import re
+import copy
+import json
+import random
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch.utils.data import Dataset
+
+from handle_grasp_unlock_dataset import normalize_batch
+
+class OriginalHandleDataset(Dataset):
+    '''
+    annotated original images ({n}.jpg + {n}_mask.png + {n}.json), same files and train/test split as HandleDataAugmentator.augment_data
+    returns the decoded uint8 tensors (3 * H * W) and the annotations, the augmentation happens after batching
+    repeat: samples of each image per epoch (offline: 2 * translation_num * resize_num = 50), each one gets its own random augmentation
+    '''
+    def __init__(self, input_dir, split='train', train_ratio=0.95, repeat=1):
+        self.input_dir = input_dir
+        self.repeat = repeat
+        image_files = sorted([f for f in os.listdir(input_dir) if re.match(r'^\d+\.jpg$', f)], key=lambda f: int(os.path.splitext(f)[0]))
+        samples = []
+        for image_file in image_files:
+            json_path = os.path.join(input_dir, os.path.splitext(image_file)[0] + '.json')
+            if not os.path.exists(json_path):
+                continue
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+            if 'dx' not in data: # not annotated
+                continue
+            samples.append((os.path.join(input_dir, image_file), data))
+        num_train = int(train_ratio*len(samples)) + 1
+        self.samples = samples[:num_train] if split == 'train' else samples[num_train:]
+        self.num = len(self.samples) * self.repeat
+
+    def __len__(self):
+        return self.num
+
+    def __str__(self):
+        print(f'Num of dataset is {self.num} ({len(self.samples)} images * {self.repeat})')
+        return ''
+
+    def __getitem__(self, idx):
+        image_path, data = self.samples[idx % len(self.samples)]
+        image = np.asarray(Image.open(image_path).convert("RGB"), dtype=np.uint8)
+        mask = Image.open(os.path.splitext(image_path)[0] + '_mask.png').convert("RGB")
+        if mask.size != (image.shape[1], image.shape[0]):
+            mask = mask.resize((image.shape[1], image.shape[0]))
+        mask = np.asarray(mask, dtype=np.uint8)
+        image = torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+        mask = torch.from_numpy(np.ascontiguousarray(mask.transpose(2, 0, 1)))
+        return image, mask, copy.deepcopy(data)
+
+def collate_original(batch):
+    '''
+    original images have different sizes: zero padded to the largest one of the batch
+    return: images, masks (B * 3 * H_max * W_max, uint8), sizes (B * 2, w h), datas (list of dict)
+    '''
+    h_max = max(image.shape[1] for image, _, _ in batch)
+    w_max = max(image.shape[2] for image, _, _ in batch)
+    images = torch.zeros((len(batch), 3, h_max, w_max), dtype=torch.uint8)
+    masks = torch.zeros((len(batch), 3, h_max, w_max), dtype=torch.uint8)
+    sizes = torch.zeros((len(batch), 2), dtype=torch.float32)
+    for i, (image, mask, _) in enumerate(batch):
+        h, w = image.shape[1:]
+        images[i, :, :h, :w] = image
+        masks[i, :, :h, :w] = mask
+        sizes[i] = torch.tensor([w, h])
+    return images, masks, sizes, [data for _, _, data in batch]
+
+class OnlineAugmentation(object):
+    '''
+    Flip/Resize/Translate/Crop of HandleDataAugmentator as one affine map per sample, in continuous pixel coordinates:
+        x_translated = ratio * x_flipped + tx, crop: x_cropped = x_translated - crop_x_min
+    every output pixel is sampled back through it, black where the offline path pastes/crops outside the image
+    out_size: size of the model input (the offline path crops 640 * 640 and GUM_TRANSFORM resizes it to 224)
+    supersample: grid of supersample * out_size averaged down, the antialiasing of the PIL resize
+    '''
+    def __init__(self, augmentator, out_size=224, supersample=2, normalize=True, seed=None):
+        self.augmentator = augmentator
+        self.out_size = out_size
+        self.supersample = supersample
+        self.normalize = normalize
+        self.random = random.Random(seed)
+
+    def sample_params(self):
+        ''' one draw of the offline loop: flip k, resize ratio, translation tx ty '''
+        k = self.random.randint(0, 1)
+        ratio = self.random.uniform(self.augmentator.ratio_min, self.augmentator.ratio_max)
+        tx = self.random.randint(self.augmentator.translation_x_min, self.augmentator.translation_x_max)
+        ty = self.random.randint(self.augmentator.translation_y_min, self.augmentator.translation_y_max)
+        return k, ratio, tx, ty
+
+    def augment_annotations(self, data, img_w, img_h, k, ratio, tx, ty):
+        '''
+        same steps as HandleDataAugmentator.augment_single_image
+        return: augmented annotations, flip axis (None / 'horizontal' / 'vertical'), crop_x_min, crop_y_min, new_w, new_h
+        '''
+        augmentator = self.augmentator
+        data = copy.deepcopy(data)
+        flip = data['orientation'] if k == 1 and data['orientation'] in ['horizontal', 'vertical'] else None
+        if flip:
+            data = augmentator.adjust_annotations_for_flipping(data, img_w, img_h)
+        new_w, new_h = int(img_w * ratio), int(img_h * ratio)
+        data = augmentator.adjust_annotations(data, 0, 0, ratio)
+        data = augmentator.adjust_annotations(data, tx, ty, 1)
+        crop_x_min, crop_y_min, _, _ = augmentator.get_crop_box(data['Cx'], data['Cy'], new_w, new_h)
+        data = augmentator.adjust_annotations_for_cropping(data, crop_x_min, crop_y_min)
+        return data, flip, crop_x_min, crop_y_min, new_w, new_h
+
+    def get_grid(self, sizes, params, padded_w, padded_h, device):
+        '''
+        sampling grid (B * S * S * 2, normalized for grid_sample) and valid mask (B * 1 * S * S)
+        '''
+        S = self.out_size * self.supersample
+        crop_w, crop_h = self.augmentator.crop_width, self.augmentator.crop_height
+        params = torch.tensor(params, dtype=torch.float32, device=device) # B * 7: flip_x, flip_y, ratio, tx, ty, crop_x_min, crop_y_min
+        sizes = sizes.to(device)
+        flip_x, flip_y, ratio, tx, ty, crop_x_min, crop_y_min = [p.view(-1, 1) for p in params.unbind(dim=1)]
+        img_w, img_h = sizes[:, 0:1], sizes[:, 1:2]
+        new_w, new_h = torch.floor(img_w * ratio), torch.floor(img_h * ratio)
+
+        ## output pixel centers -> cropped -> translated -> flipped -> original
+        u = (torch.arange(S, device=device, dtype=torch.float32) + 0.5) * crop_w / S # 1 * S
+        v = (torch.arange(S, device=device, dtype=torch.float32) + 0.5) * crop_h / S
+        x_translated = u + crop_x_min # B * S
+        y_translated = v + crop_y_min
+        x_flipped = (x_translated - tx) / ratio
+        y_flipped = (y_translated - ty) / ratio
+        x = torch.where(flip_x > 0, img_w - x_flipped, x_flipped)
+        y = torch.where(flip_y > 0, img_h - y_flipped, y_flipped)
+
+        ## black outside the translated canvas and outside the original image
+        valid_x = (x_translated >= 0) & (x_translated < new_w) & (x >= 0) & (x < img_w)
+        valid_y = (y_translated >= 0) & (y_translated < new_h) & (y >= 0) & (y < img_h)
+        valid = (valid_y.unsqueeze(2) & valid_x.unsqueeze(1)).unsqueeze(1).float() # B * 1 * S * S
+
+        ## normalized to the padded batch (align_corners=False)
+        grid_x = (2 * x / padded_w - 1).unsqueeze(1).expand(-1, S, -1)
+        grid_y = (2 * y / padded_h - 1).unsqueeze(2).expand(-1, -1, S)
+        grid = torch.stack([grid_x, grid_y], dim=-1)
+        return grid, valid
+
+    def warp(self, images, grid, valid):
+        output = F.grid_sample(images.float(), grid, mode='bilinear', padding_mode='zeros', align_corners=False) * valid
+        if self.supersample > 1:
+            output = F.avg_pool2d(output, self.supersample)
+        return output
+
+    def __call__(self, images, masks, sizes, datas):
+        '''
+        images, masks: B * 3 * H * W uint8 (collate_original), on the device where the augmentation runs
+        return: images, masks (B * 3 * out_size * out_size, normalized as GUM_TRANSFORM if normalize else 0-255 float), targets (B * 3: dx dy R), augmented annotations
+        '''
+        params, augmented_datas = [], []
+        for (img_w, img_h), data in zip(sizes.tolist(), datas):
+            k, ratio, tx, ty = self.sample_params()
+            data, flip, crop_x_min, crop_y_min, _, _ = self.augment_annotations(data, img_w, img_h, k, ratio, tx, ty)
+            params.append([flip == 'horizontal', flip == 'vertical', ratio, tx, ty, crop_x_min, crop_y_min])
+            augmented_datas.append(data)
+
+        grid, valid = self.get_grid(sizes, params, images.shape[3], images.shape[2], images.device)
+        images = self.warp(images, grid, valid)
+        masks = self.warp(masks, grid, valid)
+        if self.normalize:
+            images = normalize_batch(images)
+            masks = normalize_batch(masks)
+        targets = torch.tensor([[data['dx'], data['dy'], data['R']] for data in augmented_datas], dtype=torch.float32, device=images.device)
+        return images, masks, targets, augmented_datas
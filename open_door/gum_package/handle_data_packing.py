@@ -0,0 +1,105 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-09-26 10:21:37
+Version: v1
+File:
+Brief: pack a gum dataset folder (augmented {name}.png + {name}_mask.png + {name}.json) into memory-mapped arrays,
+       decoded and resized once, read by PackedHandleGraspUnlockDataset without PIL or json in the training loop
+       {output_dir}/images.npy: uint8, N * size * size * 3 (rgb)
+       {output_dir}/masks.npy: uint8, N * size * size * 3 (center image: white mask + red dot)
+       {output_dir}/targets.npy: float32, N * 3 (dx, dy, R)
+       {output_dir}/index.json: size, category and per sample name, orientation, Cx, Cy
+       one output dir per category/split, they are merged by PackedHandleGraspUnlockDataset([dir1, dir2, ...])
+       usage: python handle_data_packing.py -i /media/datadisk10tb/leo/projects/data/lever/train -o /media/datadisk10tb/leo/projects/data/packed/lever_train -c lever
+'''
+import os
+import re
+import json
+import argparse
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+PACK_SIZE = 224 # same as the Resize of GUM_TRANSFORM
+
+def get_mask_path(image_path):
+    return os.path.splitext(image_path)[0] + '_mask.png'
+
+def get_samples(input_dir):
+    '''
+    annotated samples of a dataset folder, same files as HandleGraspUnlockDataset
+    return: list of (image_path, annotations)
+    '''
+    image_files = sorted([f for f in os.listdir(input_dir) if re.match(r'.*_.*_.*_\d+\.png$', f)])
+    samples = []
+    for image_file in image_files:
+        image_path = os.path.join(input_dir, image_file)
+        json_path = os.path.splitext(image_path)[0] + '.json'
+        if not os.path.exists(json_path):
+            continue
+        with open(json_path, 'r') as f:
+            annotations = json.load(f)
+        if 'dx' not in annotations: # not annotated
+            continue
+        samples.append((image_path, annotations))
+    return samples
+
+def load_sample(image_path, size=PACK_SIZE):
+    image = Image.open(image_path).convert("RGB").resize((size, size), Image.BILINEAR)
+    mask = Image.open(get_mask_path(image_path)).convert("RGB").resize((size, size), Image.BILINEAR)
+    return np.asarray(image, dtype=np.uint8), np.asarray(mask, dtype=np.uint8)
+
+def pack_dataset(input_dir, output_dir, category=None, size=PACK_SIZE, num_workers=8):
+    samples = get_samples(input_dir)
+    num = len(samples)
+    print(f'[Packing] {input_dir}: {num} samples -> {output_dir}')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if category is None:
+        category = os.path.basename(os.path.normpath(input_dir))
+
+    ## arrays are written in place, the whole dataset never sits in memory
+    images = np.lib.format.open_memmap(f'{output_dir}/images.npy', mode='w+', dtype=np.uint8, shape=(num, size, size, 3))
+    masks = np.lib.format.open_memmap(f'{output_dir}/masks.npy', mode='w+', dtype=np.uint8, shape=(num, size, size, 3))
+    targets = np.lib.format.open_memmap(f'{output_dir}/targets.npy', mode='w+', dtype=np.float32, shape=(num, 3))
+
+    ## decode with threads (PIL releases the GIL)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        loaded = executor.map(lambda sample: load_sample(sample[0], size), samples)
+        for i, ((image, mask), (image_path, annotations)) in enumerate(zip(loaded, samples)):
+            images[i] = image
+            masks[i] = mask
+            targets[i] = [annotations['dx'], annotations['dy'], annotations['R']]
+            if (i+1) % 500 == 0:
+                print(f'[Packed] {i+1}/{num}')
+    images.flush()
+    masks.flush()
+    targets.flush()
+    del images, masks, targets
+
+    ## index last, it marks the pack as complete
+    index = {'num': num,
+             'size': size,
+             'category': category,
+             'source': os.path.abspath(input_dir),
+             'names': [os.path.basename(image_path) for image_path, _ in samples],
+             'orientations': [annotations.get('orientation', '') for _, annotations in samples],
+             'Cx': [annotations.get('Cx', 0) for _, annotations in samples],
+             'Cy': [annotations.get('Cy', 0) for _, annotations in samples],
+    }
+    with open(f'{output_dir}/index.json', 'w') as f:
+        json.dump(index, f)
+    return index
+
+def main(args):
+    pack_dataset(args.input_dir, args.output_dir, args.category, args.size, args.num_workers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_dir", type=str, required=True, help="Dataset folder (output of handle_data_augmentation.py).")
+    parser.add_argument("-o", "--output_dir", type=str, required=True, help="Pack folder.")
+    parser.add_argument("-c", "--category", type=str, default=None, help="Handle category (lever/doorknob/drawer/crossbar), the folder name if not given.")
+    parser.add_argument("-s", "--size", type=int, default=PACK_SIZE, help="Image size after resizing.")
+    parser.add_argument("-w", "--num_workers", type=int, default=8, help="Decoding threads.")
+    main(parser.parse_args())
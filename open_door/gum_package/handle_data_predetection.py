@@ -3,50 +3,138 @@ Author: TX-Leo
 Mail: tx.leo.wz@gmail.com
 Date: 2024-07-15 23:36:56
 Version: v1
-File: 
-Brief: 
+File:
+Brief: pre-detect handles (dtsam) for the gum dataset, writes {name}.json (dtsam result) and {name}_mask.png (center.png) next to each image
+       local (run it on the gpu server): one DticSamEngine for all images, batched Detic + SAM image encoder, already processed images are skipped
+           python handle_data_predetection.py -i ./data/lever2/ ./data/drawer2/ -b 4
+           python handle_data_predetection.py -i manifest.txt (one image path per line, relative to the manifest)
+       server: the old way, one ssh call per image through dtsam.process_images_server
+           python handle_data_predetection.py -i ./data/lever2/ -m server
 '''
 import os
 import time
+import json
+import argparse
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
-root_dir = "../"
+root_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
 sys.path.append(root_dir)
 from utils.lib_io import *
-from server import Server 
-from dtsam import DTSAM
-
-## os
-# root_dir = r'./data/doorknob2/'
-# names = get_filenames(folder=root_dir,is_base_name=False,filter='jpg')
-
-root_dir = r'./data/crossbar2/'
-names1 = get_filenames(folder=root_dir,is_base_name=False,filter='jpg')
-
-root_dir = r'./data/drawer2/'
-names2 = get_filenames(folder=root_dir,is_base_name=False,filter='jpg')
-
-root_dir = r'./data/lever2/'
-names3 = get_filenames(folder=root_dir,is_base_name=False,filter='jpg')
-
-names = names1+names2+names3
-
-## init
-server = Server.init_from_yaml(cfg_path=f'../cfg/cfg_server.yaml')
-dtsam = DTSAM.init_from_yaml(cfg_path=f'../cfg/cfg_dtsam.yaml')
-
-## remote
-remote_python_path = '/media/datadisk10tb/leo/anaconda3/envs/rm/bin/python'
-remote_root_dir = '/media/datadisk10tb/leo/projects/realman-robot/open_door/'
-remote_img_dir = '/media/datadisk10tb/leo/projects/realman-robot/open_door/trajectory/remote/'
-
-## dtsam
-start_time = time.time()
-num = 0
-for name in names:
-    print(f'Process {os.path.basename(name)} ...')
-    rgb_img_path = name
-    dtsam.process_images_server(rgb_img_path,server,remote_python_path,remote_root_dir,remote_img_dir)
-    num += 1
-    print(f'[All Time] {time.time()-start_time} s')
-    print(f'[Average Time] {(time.time()-start_time)/num} s')
+from utils.lib_rgbd import mask2center_image
+
+def get_image_names(inputs,filter='jpg'):
+    names = []
+    for input in inputs:
+        if os.path.isdir(input):
+            names += get_filenames(folder=input,is_base_name=False,filter=filter)
+        else:
+            # manifest
+            manifest_dir = os.path.dirname(os.path.abspath(input))
+            with open(input,'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        names.append(line if os.path.isabs(line) else os.path.join(manifest_dir,line))
+    # the masks of previous runs are pngs in the same folders
+    names = [os.path.abspath(name) for name in names if not name.endswith('_mask.png')]
+    return names
+
+def get_result_paths(name):
+    f_name = os.path.basename(name).split('.')[0]
+    json_path = f'{os.path.dirname(name)}/{f_name}.json'
+    mask_path = f'{os.path.dirname(name)}/{f_name}_mask.png'
+    return json_path,mask_path
+
+def load_images(names):
+    return [np.array(Image.open(name).convert('RGB'),dtype=np.uint8) for name in names]
+
+def predetect_local(names,classes='handle',device='cuda:0',threshold=0.3,batch_size=4,overwrite=False):
+    ## resume: skip the images which already have a result
+    todo = [name for name in names if overwrite or not os.path.exists(get_result_paths(name)[0])]
+    print(f'[Predetection] {len(names)} images, {len(names)-len(todo)} done before, {len(todo)} to process')
+    if len(todo) == 0:
+        return
+
+    ## engine (detic_sam.py changes the working directory to dtsam_package/Detic, so all paths are absolute by now)
+    start_time = time.time()
+    os.chdir(f'{root_dir}/dtsam_package')
+    sys.path.insert(0,f'{root_dir}/dtsam_package')
+    from detic_sam import DticSamEngine
+    engine = DticSamEngine(device=device,classes=classes,threshold=threshold)
+    print(f'[Load Time] {time.time()-start_time} s')
+
+    ## detect, the next chunk is read from disk while the current one is on the gpu
+    start_time = time.time()
+    chunks = [todo[i:i+batch_size] for i in range(0,len(todo),batch_size)]
+    num = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(load_images,chunks[0])
+        for i,chunk in enumerate(chunks):
+            images = future.result()
+            if i+1 < len(chunks):
+                future = executor.submit(load_images,chunks[i+1])
+            outputs = engine.detect_batch(images,batch_size=batch_size)
+            for name,(result,mask) in zip(chunk,outputs):
+                json_path,mask_path = get_result_paths(name)
+                if mask is not None:
+                    mask2center_image(mask,result['Cx'],result['Cy'],dot_size=5,save_path=mask_path)
+                # json last, it marks the image as done
+                with open(json_path,'w') as f:
+                    json.dump(result,f,indent=4)
+            num += len(chunk)
+            print(f'[Processed] {num}/{len(todo)}')
+            print(f'[All Time] {time.time()-start_time} s')
+            print(f'[Average Time] {(time.time()-start_time)/num} s')
+
+def predetect_server(names,overwrite=False):
+    from server import Server
+    from dtsam import DTSAM
+
+    ## init
+    server = Server.init_from_yaml(cfg_path=f'{root_dir}/cfg/cfg_server.yaml')
+    dtsam = DTSAM.init_from_yaml(cfg_path=f'{root_dir}/cfg/cfg_dtsam.yaml')
+
+    ## remote
+    remote_python_path = '/media/datadisk10tb/leo/anaconda3/envs/rm/bin/python'
+    remote_root_dir = '/media/datadisk10tb/leo/projects/realman-robot/open_door/'
+    remote_img_dir = '/media/datadisk10tb/leo/projects/realman-robot/open_door/trajectory/remote/'
+
+    ## dtsam
+    start_time = time.time()
+    num = 0
+    for name in names:
+        if not overwrite and os.path.exists(get_result_paths(name)[0]):
+            continue
+        print(f'Process {os.path.basename(name)} ...')
+        rgb_img_path = name
+        dtsam.process_images_server(rgb_img_path,server,remote_python_path,remote_root_dir,remote_img_dir)
+        num += 1
+        print(f'[All Time] {time.time()-start_time} s')
+        print(f'[Average Time] {(time.time()-start_time)/num} s')
+
+def main(args):
+    names = get_image_names(args.inputs,args.filter)
+    if args.mode == 'local':
+        # same defaults as the robot (cfg_dtsam.yaml)
+        cfg = read_yaml_file(f'{root_dir}/cfg/cfg_dtsam.yaml', is_convert_dict_to_class=True)
+        classes = args.classes if args.classes else cfg.classes
+        device = args.device if args.device else cfg.device
+        threshold = args.threshold if args.threshold is not None else cfg.threshold
+        predetect_local(names,classes,device,threshold,args.batch_size,args.overwrite)
+    else:
+        predetect_server(names,args.overwrite)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--inputs", nargs="+", default=['./data/crossbar2/','./data/drawer2/','./data/lever2/'], help="Image folders or manifest files (one image path per line).")
+    parser.add_argument("-f", "--filter", type=str, default="jpg", help="Image extension in the folders.")
+    parser.add_argument("-m", "--mode", type=str, default="local", choices=['local','server'], help="local: batched engine on this machine, server: one ssh call per image.")
+    parser.add_argument("-c", "--classes", nargs="+", default=None, help="List of classes to detect (cfg_dtsam.yaml if not given).")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run on (cfg_dtsam.yaml if not given).")
+    parser.add_argument("-t", "--threshold", type=float, default=None, help="detection score threshold (cfg_dtsam.yaml if not given)")
+    parser.add_argument("-b", "--batch_size", type=int, default=4, help="Images per Detic / SAM image encoder forward pass.")
+    parser.add_argument("--overwrite", default=False, action='store_true', help="Process images which already have a result.")
+    main(parser.parse_args())
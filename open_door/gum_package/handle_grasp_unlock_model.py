@@ -5,26 +5,65 @@ from torchvision import models
 from torchvision import transforms
 
 RESNET_DEPTH = 18
+FUSIONS = ['shared','dual','early']
 
 import sys
 root_dir = "../"
 sys.path.append(root_dir)
 from utils.lib_io import *
 
+## same transform as HandleGraspUnlockDataset, built once
+GUM_TRANSFORM = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+])
+
+def get_fusion_from_state_dict(state_dict):
+    ''' fusion of a saved model, from its weights '''
+    if any(key.startswith('mask_resnet.') for key in state_dict):
+        return 'dual'
+    if state_dict['resnet.conv1.weight'].shape[1] == 4:
+        return 'early'
+    return 'shared'
+
 class HandleGraspUnlockModel(nn.Module):
-    def __init__(self, resnet_depth=18, pretrained=True,device='cuda:0'):
+    def __init__(self, resnet_depth=18, pretrained=True,device='cuda:0',fusion='shared'):
+        '''
+        pretrained: ImageNet weights for the resnet, not needed when a checkpoint is loaded afterwards
+        fusion:
+            'shared': (old models) image and mask go through the same resnet, two passes with one set of weights
+            'dual': image and mask have their own resnet, two passes with two sets of weights
+            'early': the mask is a 4th input channel (rgb+mask) of one resnet, one pass
+        '''
         super(HandleGraspUnlockModel, self).__init__()
+        assert fusion in FUSIONS, f'fusion should be one of {FUSIONS}'
+        self.fusion = fusion
 
         ## reset
         self.resnet = models.__dict__[f'resnet{resnet_depth}'](pretrained=pretrained)
+        if fusion == 'early':
+            # 4 input channels, the mask channel starts from the mean of the rgb filters
+            conv1 = self.resnet.conv1
+            self.resnet.conv1 = nn.Conv2d(4, conv1.out_channels, kernel_size=conv1.kernel_size, stride=conv1.stride, padding=conv1.padding, bias=False)
+            with torch.no_grad():
+                self.resnet.conv1.weight[:, :3] = conv1.weight
+                self.resnet.conv1.weight[:, 3:] = conv1.weight.mean(dim=1, keepdim=True)
         
         self.image_encoder = nn.Sequential(*list(self.resnet.children())[:-1])  # Remove the last FC layer
-        self.mask_encoder = nn.Sequential(*list(self.resnet.children())[:-1])  # Remove the last FC layer
+        if fusion == 'shared':
+            self.mask_encoder = nn.Sequential(*list(self.resnet.children())[:-1])  # Remove the last FC layer
+        elif fusion == 'dual':
+            self.mask_resnet = models.__dict__[f'resnet{resnet_depth}'](pretrained=pretrained)
+            self.mask_encoder = nn.Sequential(*list(self.mask_resnet.children())[:-1])  # Remove the last FC layer
+        else:
+            self.mask_encoder = None
 
         self.feature_dim = self.resnet.fc.in_features
+        n_features = self.feature_dim if fusion == 'early' else 2 * self.feature_dim
 
         self.predictor = nn.Sequential( 
-            nn.Linear(2 * self.feature_dim, 512),  # merge tow resnet features
+            nn.Linear(n_features, 512),  # merge tow resnet features (or the features of the 4-channel resnet)
             nn.ReLU(),
             nn.Linear(512, 256),
             nn.ReLU(),
@@ -34,16 +73,16 @@ class HandleGraspUnlockModel(nn.Module):
         self.device = device
 
     def forward(self, image, mask):
-        image_features = self.image_encoder(image.to(self.device)).squeeze() # batch_size * 512
-        mask_features = self.mask_encoder(mask.to(self.device)).squeeze() # batch_size * 512
-        
-        # check dimension
-        if len(image_features.shape) == 1:
-            image_features = image_features.unsqueeze(0).flatten(start_dim=1)  # batch_size * 512
-        if len(mask_features.shape) == 1:
-            mask_features = mask_features.unsqueeze(0).flatten(start_dim=1)  # batch_size * 512
-
-        features = torch.cat((image_features, mask_features), dim=1)
+        image = image.to(self.device)
+        mask = mask.to(self.device)
+        if self.fusion == 'early':
+            # channel mean of the mask image: the red center dot stays different from the white mask
+            x = torch.cat((image, mask.mean(dim=1, keepdim=True)), dim=1) # batch_size * 4 * 224 * 224
+            features = self.image_encoder(x).flatten(start_dim=1) # batch_size * 512
+        else:
+            image_features = self.image_encoder(image).flatten(start_dim=1) # batch_size * 512
+            mask_features = self.mask_encoder(mask).flatten(start_dim=1) # batch_size * 512
+            features = torch.cat((image_features, mask_features), dim=1)
         output = self.predictor(features)
 
         return output
@@ -51,17 +90,13 @@ class HandleGraspUnlockModel(nn.Module):
     def gum_api(self,image_path,mask_path,if_p=False):
         start_time = time.time()
         self.eval()
-        image = Image.open(image_path).convert("RGB")
-        mask = Image.open(mask_path).convert("RGB")
+        # paths or PIL images (the perception server passes decoded images)
+        image = Image.open(image_path).convert("RGB") if isinstance(image_path,str) else image_path.convert("RGB")
+        mask = Image.open(mask_path).convert("RGB") if isinstance(mask_path,str) else mask_path.convert("RGB")
 
         ## transform
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        image = transform(image) # 3 * 224 * 224
-        mask = transform(mask) # 3 * 224 * 224
+        image = GUM_TRANSFORM(image) # 3 * 224 * 224
+        mask = GUM_TRANSFORM(mask) # 3 * 224 * 224
 
         ## add batch dimension
         image = image.unsqueeze(0) # 1 * 3 * 224 * 224
@@ -14,7 +14,7 @@ from torch.utils.data import DataLoader
 from torchvision import transforms
 
 from handle_grasp_unlock_dataset import HandleGraspUnlockDataset
-from handle_grasp_unlock_model import HandleGraspUnlockModel
+from handle_grasp_unlock_model import HandleGraspUnlockModel, get_fusion_from_state_dict
 
 import sys
 root_dir = "../"
@@ -26,8 +26,9 @@ RESNET_DEPTH = 18
 def test(device):
     ## model
     model_load_path = r'./checkpoints/gum2.pth'
-    model = HandleGraspUnlockModel(resnet_depth=RESNET_DEPTH, pretrained=True,device=device).to(device)
-    model.load_state_dict(torch.load(model_load_path))
+    state_dict = torch.load(model_load_path, map_location=device)
+    model = HandleGraspUnlockModel(resnet_depth=RESNET_DEPTH, pretrained=False,device=device,fusion=get_fusion_from_state_dict(state_dict)).to(device)
+    model.load_state_dict(state_dict)
     model.eval()
 
     root_dir = r'/media/datadisk10tb/leo/projects/data/drawer/test'
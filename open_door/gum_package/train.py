@@ -3,123 +3,295 @@ Author: TX-Leo
 Mail: tx.leo.wz@gmail.com
 Date: 2024-07-19 13:34:10
 Version: v1
-File: 
-Brief: 
+File:
+Brief: gum training, configured by cfg/cfg_gum_train.yaml, datasets merged from a manifest (manifests/*.yaml)
+       mixed precision, DataLoader workers with pinned memory, cosine/step lr, validation every val_every epochs
+       checkpoints/{name}/last.pth: everything to resume (-resume), best.pth: state dict with the lowest val loss (for get_dxdyR.py / export.py)
+       checkpoints/{name}/metrics.csv + loss.png instead of the interactive plot
+       online_augmentation: the train split is augmented on the fly from the original images (original of the manifest), see handle_data_augmentation_online.py
+       usage: python train.py -manifest manifests/all.yaml -name gum18_all
+              python train.py -manifest manifests/all.yaml -name gum18_all -resume
+              python train.py -manifest manifests/all.yaml -name gum18_all_online -online
 '''
+import os
+import csv
+import math
 import time
+import json
+import random
+import argparse
+import numpy as np
 import torch
-import matplotlib.pyplot as plt
 import torch.nn as nn
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, ConcatDataset, Subset
 
-from handle_grasp_unlock_dataset import HandleGraspUnlockDataset
+from handle_data_packing import get_samples
+from handle_grasp_unlock_dataset import HandleGraspUnlockDataset, PackedHandleGraspUnlockDataset, normalize_batch
 from handle_grasp_unlock_model import HandleGraspUnlockModel
+from handle_data_augmentation import HandleDataAugmentator
+from handle_data_augmentation_online import OriginalHandleDataset, OnlineAugmentation, collate_original
 
-BATCH_SIZE = 16
-RESNET_DEPTH = 18
-LR = 1e-4
-N_EPOCHS = 50
+import sys
+root_dir = "../"
+sys.path.append(root_dir)
+from utils.lib_io import *
+
+METRICS = ['epoch', 'lr', 'train_loss', 'val_loss', 'val_mae_dx', 'val_mae_dy', 'val_mae_R', 'time']
+
+def load_manifest(manifest_path):
+    '''
+    return: {'train': [dir, ...], 'val': [dir, ...], 'original': [dir, ...]} with absolute paths
+    '''
+    manifest = read_yaml_file(manifest_path, is_convert_dict_to_class=False)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    return {split: [d if os.path.isabs(d) else os.path.join(manifest_dir, d) for d in (manifest.get(split) or [])] for split in ['train', 'val', 'original']}
+
+def is_packed(dataset_dir):
+    return os.path.exists(os.path.join(dataset_dir, 'index.json'))
+
+def load_dataset(dataset_dirs, normalize=True):
+    '''
+    one dataset for all dirs, packs are read memory-mapped, folders with PIL (only the annotated samples)
+    '''
+    datasets = []
+    for dataset_dir in dataset_dirs:
+        if is_packed(dataset_dir):
+            dataset = PackedHandleGraspUnlockDataset(dataset_dir, normalize=normalize)
+        else:
+            dataset = HandleGraspUnlockDataset(root_dir=dataset_dir)
+            annotated = set(os.path.basename(image_path) for image_path, _ in get_samples(dataset_dir))
+            dataset = Subset(dataset, [i for i, image_file in enumerate(dataset.image_files) if image_file in annotated])
+        print(f'[Dataset] {dataset_dir}: {len(dataset)}')
+        datasets.append(dataset)
+    return ConcatDataset(datasets)
+
+def load_original_dataset(dataset_dirs, repeat):
+    ''' train split of the original images, augmented after batching '''
+    datasets = []
+    for dataset_dir in dataset_dirs:
+        dataset = OriginalHandleDataset(dataset_dir, split='train', repeat=repeat)
+        print(f'[Dataset] {dataset_dir}: {len(dataset.samples)} * {repeat}')
+        datasets.append(dataset)
+    return ConcatDataset(datasets)
+
+def get_dataloader(dataset, cfg, shuffle, collate_fn=None):
+    kwargs = {'num_workers': cfg.num_workers, 'pin_memory': cfg.pin_memory, 'collate_fn': collate_fn}
+    if cfg.num_workers > 0:
+        kwargs.update({'prefetch_factor': cfg.prefetch_factor, 'persistent_workers': True})
+    return DataLoader(dataset, batch_size=cfg.batch_size, shuffle=shuffle, drop_last=shuffle and len(dataset) > cfg.batch_size, **kwargs)
+
+def get_scheduler(optimizer, cfg):
+    '''
+    lr factor of each epoch (stepped once per epoch), linear warmup first
+    '''
+    def lr_lambda(epoch):
+        if epoch < cfg.warmup_epochs:
+            return (epoch + 1) / cfg.warmup_epochs
+        if cfg.scheduler == 'cosine':
+            progress = (epoch - cfg.warmup_epochs) / max(1, cfg.n_epochs - cfg.warmup_epochs)
+            ratio_min = cfg.lr_min / cfg.lr
+            return ratio_min + (1 - ratio_min) * 0.5 * (1 + math.cos(math.pi * progress))
+        elif cfg.scheduler == 'step':
+            return cfg.gamma ** ((epoch - cfg.warmup_epochs) // cfg.step_size)
+        return 1.0
+    return torch.optim.lr_scheduler.LambdaLR(optimizer, lr_lambda)
+
+def to_device(images, masks, targets, device, on_device_normalize):
+    images = images.to(device, non_blocking=True)
+    masks = masks.to(device, non_blocking=True)
+    targets = targets.to(device, non_blocking=True)
+    if on_device_normalize:
+        images = normalize_batch(images)
+        masks = normalize_batch(masks)
+    return images, masks, targets
+
+def validate(model, dataloader, device, on_device_normalize, amp):
+    '''
+    return: mse loss, mae (dx, dy, R)
+    '''
+    model.eval()
+    loss_sum, abs_error_sum, num = 0.0, torch.zeros(3, device=device), 0
+    with torch.no_grad():
+        for images, masks, targets in dataloader:
+            images, masks, targets = to_device(images, masks, targets, device, on_device_normalize)
+            with torch.autocast(device_type=device.type, enabled=amp):
+                outputs = model(images, masks)
+            outputs = outputs.float()
+            loss_sum += nn.functional.mse_loss(outputs, targets, reduction='sum').item() / 3
+            abs_error_sum += (outputs - targets).abs().sum(dim=0)
+            num += targets.shape[0]
+    model.train()
+    return loss_sum / max(num, 1), (abs_error_sum / max(num, 1)).tolist()
+
+def save_checkpoint(path, epoch, model, optimizer, scheduler, scaler, best_val_loss, cfg):
+    # written to a temporary file first, an interrupted save does not destroy the last checkpoint
+    torch.save({'epoch': epoch,
+                'model': model.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'scheduler': scheduler.state_dict(),
+                'scaler': scaler.state_dict(),
+                'best_val_loss': best_val_loss,
+                'cfg': vars(cfg)}, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def save_metrics(metrics_path, row):
+    is_new = not os.path.exists(metrics_path)
+    with open(metrics_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=METRICS)
+        if is_new:
+            writer.writeheader()
+        writer.writerow(row)
+
+def plot_losses(metrics_path, save_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    with open(metrics_path, 'r') as f:
+        rows = list(csv.DictReader(f))
+    epochs = [int(row['epoch']) for row in rows]
+    fig, ax = plt.subplots()
+    ax.plot(epochs, [float(row['train_loss']) for row in rows], label='train')
+    val = [(int(row['epoch']), float(row['val_loss'])) for row in rows if row['val_loss']]
+    if val:
+        ax.plot(*zip(*val), label='val')
+    ax.set_title('Training Loss')
+    ax.set_xlabel('Epoch')
+    ax.set_ylabel('Loss')
+    ax.set_yscale('log')
+    ax.legend()
+    fig.savefig(save_path)
+    plt.close(fig)
+
+def train(cfg, device, resume=False):
+    random.seed(cfg.seed)
+    np.random.seed(cfg.seed)
+    torch.manual_seed(cfg.seed)
+    torch.backends.cudnn.benchmark = True
+    amp = cfg.amp and device.type == 'cuda'
+
+    save_dir = os.path.join(cfg.save_dir, cfg.name)
+    os.makedirs(save_dir, exist_ok=True)
+    last_path = os.path.join(save_dir, 'last.pth')
+    best_path = os.path.join(save_dir, 'best.pth')
+    metrics_path = os.path.join(save_dir, 'metrics.csv')
 
-def train(device):
     ## dataset and dataloader
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/lever/train'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset1 = [data for data in train_dataset if data is not None]
-
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/doorknob/train'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset2 = [data for data in train_dataset if data is not None]
-    
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/drawer/train'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset3 = [data for data in train_dataset if data is not None]
-    
-    train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/crossbar/train'
-    train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    print(train_dataset)
-    train_dataset4 = [data for data in train_dataset if data is not None]
-    
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/lever/test'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset5 = [data for data in train_dataset if data is not None]
-
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/doorknob/test'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset6 = [data for data in train_dataset if data is not None]
-    
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/drawer/test'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset7 = [data for data in train_dataset if data is not None]
-    
-    train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/crossbar/test'
-    train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    print(train_dataset)
-    train_dataset8 = [data for data in train_dataset if data is not None]
-
-    # train_dataset = train_dataset1+train_dataset2+train_dataset3+train_dataset4+train_dataset5+train_dataset6+train_dataset7+train_dataset8
-    
-    # train_dataset_dir = r'/media/datadisk10tb/leo/projects/data/lever/train_small'
-    # train_dataset = HandleGraspUnlockDataset(root_dir=train_dataset_dir)
-    # print(train_dataset)
-    # train_dataset = [data for data in train_dataset if data is not None]
-
-
-    train_dataset = train_dataset4+train_dataset8
-
-    model_load_path = r'./checkpoints/gum18.pth'
-    loss_save_path = r'./checkpoints/loss18.png'
-
-    train_dataloader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
-    
+    manifest = load_manifest(cfg.manifest)
+    # packs only: uint8 batches (4x less to copy), normalized on the device (the online augmentation normalizes its own batches)
+    on_device_normalize = all(is_packed(d) for d in ([] if cfg.online_augmentation else manifest['train']) + manifest['val'])
+    augmentation = None
+    if cfg.online_augmentation:
+        if not manifest['original']:
+            raise ValueError(f'[Train] online_augmentation needs the original images (original) in {cfg.manifest}')
+        train_dataset = load_original_dataset(manifest['original'], cfg.augmentation_repeat)
+        train_dataloader = get_dataloader(train_dataset, cfg, shuffle=True, collate_fn=collate_original)
+        augmentation = OnlineAugmentation(HandleDataAugmentator(manifest['original'][0], None, None), seed=cfg.seed) # default ranges of the offline path
+    else:
+        train_dataset = load_dataset(manifest['train'], normalize=not on_device_normalize)
+        train_dataloader = get_dataloader(train_dataset, cfg, shuffle=True)
+    print(f'[Train] {len(train_dataset)} samples')
+    val_dataloader = None
+    if manifest['val']:
+        val_dataset = load_dataset(manifest['val'], normalize=not on_device_normalize)
+        print(f'[Val] {len(val_dataset)} samples')
+        val_dataloader = get_dataloader(val_dataset, cfg, shuffle=False)
+
     ## model
-    model = HandleGraspUnlockModel(resnet_depth=RESNET_DEPTH, pretrained=True,device=device).to(device)
+    model = HandleGraspUnlockModel(resnet_depth=cfg.resnet_depth, pretrained=cfg.pretrained and not resume, device=device, fusion=cfg.fusion).to(device)
     model.train()
 
-    ## loss function and optimizer
+    ## loss function, optimizer, scheduler
     loss_fn = nn.MSELoss()
-    optimizer = torch.optim.Adam(model.parameters(), lr=LR)
+    optimizer = torch.optim.Adam(model.parameters(), lr=cfg.lr, weight_decay=cfg.weight_decay)
+    scheduler = get_scheduler(optimizer, cfg)
+    scaler = torch.cuda.amp.GradScaler(enabled=amp)
 
-    losses = []
-    plt.ion()
-    fig, ax = plt.subplots()
+    ## resume
+    start_epoch, best_val_loss = 0, float('inf')
+    if resume and os.path.exists(last_path):
+        checkpoint = torch.load(last_path, map_location=device)
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scheduler.load_state_dict(checkpoint['scheduler'])
+        scaler.load_state_dict(checkpoint['scaler'])
+        start_epoch, best_val_loss = checkpoint['epoch'] + 1, checkpoint['best_val_loss']
+        print(f'[Resume] {last_path}: epoch {start_epoch}, best val loss {best_val_loss:.4f}')
+    with open(os.path.join(save_dir, 'cfg.json'), 'w') as f:
+        json.dump({**vars(cfg), 'manifest': manifest}, f, indent=4)
 
     start_time = time.time()
+    for epoch in range(start_epoch, cfg.n_epochs):
+        epoch_start_time = time.time()
+        loss_sum = torch.zeros((), device=device)
+        for i, batch in enumerate(train_dataloader):
+            if augmentation is not None:
+                images, masks, sizes, datas = batch
+                images, masks, targets, _ = augmentation(images.to(device, non_blocking=True), masks.to(device, non_blocking=True), sizes, datas)
+            else:
+                images, masks, targets = to_device(*batch, device, on_device_normalize)
 
-    for epoch in range(N_EPOCHS):
-        for i, (images, masks, targets) in enumerate(train_dataloader):
             ## forward
-            outputs = model(images, masks)
-            
+            with torch.autocast(device_type=device.type, enabled=amp):
+                outputs = model(images, masks)
+            loss = loss_fn(outputs.float(), targets)
+
             ## backward
-            loss = loss_fn(outputs, targets.to(device))
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
-            
-            ## print
-            if (i+1) % 10 == 0:
-                print(f'Epoch [{epoch+1}/{N_EPOCHS}], Step [{i+1}/{len(train_dataloader)}], Loss: {loss.item():.4f}')
-                ## vis
-                losses.append(loss.item())
-                ax.clear()
-                ax.plot(losses)
-                ax.set_title('Training Loss')
-                ax.set_xlabel('Iteration')
-                ax.set_ylabel('Loss')
-                plt.pause(0.1)
-        plt.ioff()
-        fig.savefig(loss_save_path)
-
-        # ## save model
-        torch.save(model.state_dict(), model_load_path)
-        print(f'[All Time] {time.time()-start_time}')
-    
+            optimizer.zero_grad(set_to_none=True)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            loss_sum += loss.detach()
+
+            ## print (.item() syncs with the gpu, only every log_every steps)
+            if (i+1) % cfg.log_every == 0:
+                print(f'Epoch [{epoch+1}/{cfg.n_epochs}], Step [{i+1}/{len(train_dataloader)}], Loss: {loss.item():.4f}')
+        lr = optimizer.param_groups[0]['lr']
+        scheduler.step()
+        train_loss = loss_sum.item() / max(len(train_dataloader), 1)
+
+        ## validate
+        row = {'epoch': epoch+1, 'lr': lr, 'train_loss': train_loss, 'val_loss': '', 'val_mae_dx': '', 'val_mae_dy': '', 'val_mae_R': ''}
+        if val_dataloader is not None and ((epoch+1) % cfg.val_every == 0 or epoch+1 == cfg.n_epochs):
+            val_loss, (mae_dx, mae_dy, mae_R) = validate(model, val_dataloader, device, on_device_normalize, amp)
+            row.update({'val_loss': val_loss, 'val_mae_dx': mae_dx, 'val_mae_dy': mae_dy, 'val_mae_R': mae_R})
+            print(f'[Val] Epoch [{epoch+1}/{cfg.n_epochs}], Loss: {val_loss:.4f}, MAE dx: {mae_dx:.2f}, dy: {mae_dy:.2f}, R: {mae_R:.2f}')
+            if val_loss < best_val_loss:
+                best_val_loss = val_loss
+                torch.save(model.state_dict(), best_path)
+                print(f'[Best] {best_path}')
+        elif val_dataloader is None:
+            # no val split: the last epoch is the best one
+            torch.save(model.state_dict(), best_path)
+        row['time'] = time.time() - epoch_start_time
+
+        ## save
+        save_metrics(metrics_path, row)
+        plot_losses(metrics_path, os.path.join(save_dir, 'loss.png'))
+        save_checkpoint(last_path, epoch, model, optimizer, scheduler, scaler, best_val_loss, cfg)
+        print(f'[Epoch Time] {row["time"]:.1f} s, [All Time] {time.time()-start_time:.1f} s')
+
+def main(args):
+    cfg = read_yaml_file(args.cfg_path, is_convert_dict_to_class=True)
+    for key in ['manifest', 'name', 'n_epochs', 'batch_size', 'lr', 'num_workers', 'fusion', 'resnet_depth', 'online_augmentation']:
+        if getattr(args, key) is not None:
+            setattr(cfg, key, getattr(args, key))
+    if cfg.fusion is None:
+        cfg.fusion = read_yaml_file(f'{root_dir}/cfg/cfg_gum.yaml', is_convert_dict_to_class=True).fusion
+    device = torch.device(args.device if args.device else ("cuda:0" if torch.cuda.is_available() else "cpu"))
+    train(cfg, device, args.resume)
+
 if __name__ == "__main__":
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    train(device)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-cfg", "--cfg_path", type=str, default=f'{root_dir}/cfg/cfg_gum_train.yaml', help="Training config.")
+    parser.add_argument("-manifest", "--manifest", type=str, default=None, help="Datasets to merge (manifests/*.yaml).")
+    parser.add_argument("-name", "--name", type=str, default=None, help="Run name, checkpoints/{name}/.")
+    parser.add_argument("-e", "--n_epochs", type=int, default=None, help="Number of epochs.")
+    parser.add_argument("-b", "--batch_size", type=int, default=None, help="Batch size.")
+    parser.add_argument("-lr", "--lr", type=float, default=None, help="Learning rate.")
+    parser.add_argument("-w", "--num_workers", type=int, default=None, help="DataLoader workers.")
+    parser.add_argument("-fusion", "--fusion", type=str, default=None, choices=['shared','dual','early'], help="Fusion of the image and the mask.")
+    parser.add_argument("-depth", "--resnet_depth", type=int, default=None, help="Resnet depth.")
+    parser.add_argument("-online", "--online_augmentation", default=None, action='store_true', help="Augment the original images on the fly (online_augmentation).")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run on.")
+    parser.add_argument("-resume", "--resume", default=False, action='store_true', help="Resume from checkpoints/{name}/last.pth.")
+    main(parser.parse_args())
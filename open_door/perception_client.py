@@ -0,0 +1,97 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-08-02 10:12:40
+Version: v1
+File:
+Brief: client for perception_server.py (the daemon that keeps Detic+SAM, GUM and RANSAC in memory on the server)
+'''
+import json
+import http.client
+import urllib.request
+import urllib.error
+
+from utils.lib_io import *
+from utils.lib_codec import *
+
+class PerceptionClientError(RuntimeError):
+    ''' any failed request (error of the server, daemon down, connection reset, timeout): the caller falls back to the ssh scripts '''
+    pass
+
+class PerceptionClient(object):
+    def __init__(self,host='127.0.0.1',port=8765,timeout=60,enable=True,transport='payload',if_vis=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.enable = enable
+        self.transport = transport # 'payload': send encoded images in the request, 'file': upload by sftp and send paths
+        self.if_vis = if_vis # payload mode only: let the server write visualizations, fetch them later
+        self.url = f'http://{self.host}:{self.port}'
+
+    @classmethod
+    def init_from_yaml(cls,cfg_path='cfg/cfg_perception.yaml'):
+        cfg = read_yaml_file(cfg_path, is_convert_dict_to_class=True)
+        return cls(cfg.host,cfg.port,cfg.timeout,cfg.enable,cfg.transport,cfg.if_vis)
+
+    def __str__(self):
+        return f'[PerceptionClient]: url: {self.url}, timeout: {self.timeout}, enable: {self.enable}, transport: {self.transport}, if_vis: {self.if_vis}'
+
+    def is_alive(self):
+        try:
+            with urllib.request.urlopen(f'{self.url}/health',timeout=2) as response:
+                return json.loads(response.read()).get('status') == 'ok'
+        except (urllib.error.URLError,OSError,ValueError):
+            return False
+
+    def request(self,route,data):
+        body = json.dumps(data).encode('utf-8')
+        req = urllib.request.Request(f'{self.url}/{route}',data=body,headers={'Content-Type':'application/json'},method='POST')
+        try:
+            with urllib.request.urlopen(req,timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read()).get('error',str(e))
+            except (ValueError,OSError):
+                error = str(e)
+            raise PerceptionClientError(f'[PerceptionClient] {route} failed: {error}') from e
+        except (urllib.error.URLError,OSError,http.client.HTTPException,ValueError) as e: # daemon down, reset, socket timeout, truncated reply
+            raise PerceptionClientError(f'[PerceptionClient] {route} failed: {e!r}') from e
+
+    def dtsam(self,img_path,classes='handle',threshold=0.3):
+        return self.request('dtsam',{'img_path':img_path,'classes':classes,'threshold':threshold})
+
+    def gum(self,image_path,mask_path):
+        return self.request('gum',{'image_path':image_path,'mask_path':mask_path})
+
+    def ransac(self,rgb_img_path,d_img_path,cfg_path,cam_path,seed_xy=None):
+        return self.request('ransac',{'rgb_img_path':rgb_img_path,'d_img_path':d_img_path,'cfg_path':cfg_path,'cam_path':cam_path,'seed_xy':seed_xy})
+
+    def dtsam_payload(self,rgb_img,classes='handle',threshold=0.3,vis_dir=None):
+        result = self.request('payload/dtsam',{'rgb':encode_image(rgb_img),'classes':classes,'threshold':threshold,'vis_dir':vis_dir})
+        result['mask'] = rle_to_mask(result['mask']) if result['mask'] is not None else None
+        return result
+
+    def gum_payload(self,rgb_img,mask_img):
+        return self.request('payload/gum',{'rgb':encode_image(rgb_img),'mask':encode_image(mask_img)})
+
+    def ransac_payload(self,rgb_img,d_img,cfg_text,cam_text,vis_dir=None,seed_xy=None):
+        return self.request('payload/ransac',{'rgb':encode_image(rgb_img),'depth':encode_image(d_img),'cfg':cfg_text,'cam':cam_text,'vis_dir':vis_dir,'seed_xy':seed_xy})
+
+    def perceive_grasp(self,rgb_img,d_img,cfg_text,cam_text,classes='handle',threshold=0.3,img_w=640,img_h=640,if_gum=True,vis_dir=None):
+        '''
+        one request for the whole grasp perception: dtsam, gum (crop + regression) and ransac on the server
+        ransac runs concurrently with dtsam, or seeded with the handle center concurrently with gum (RANSAC_config.guided)
+        return: {'dtsam':{...,'mask':bool array or None},'gum':{'dx','dy','R'} or None,'ransac':{...},'times':{...}}
+        '''
+        data = {'rgb':encode_image(rgb_img),'depth':encode_image(d_img),'cfg':cfg_text,'cam':cam_text,
+                'classes':classes,'threshold':threshold,'img_w':img_w,'img_h':img_h,'if_gum':if_gum,'vis_dir':vis_dir}
+        result = self.request('payload/grasp',data)
+        mask = result['dtsam']['mask']
+        result['dtsam']['mask'] = rle_to_mask(mask) if mask is not None else None
+        return result
+
+if __name__ == "__main__":
+    client = PerceptionClient.init_from_yaml(cfg_path='cfg/cfg_perception.yaml')
+    print(client)
+    print(f'alive: {client.is_alive()}')
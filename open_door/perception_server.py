@@ -0,0 +1,245 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-08-02 10:12:40
+Version: v1
+File:
+Brief: long-lived perception daemon (run it on the GPU server). Detic+SAM, GUM and the plane detector are loaded once and served over HTTP,
+       so a primitive only pays for inference instead of interpreter startup + weight loading + CUDA init on every call.
+       usage: cd open_door; python perception_server.py -p 8765 -d cuda:0
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import hashlib
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from PIL import Image
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, f'{ROOT_DIR}/gum_package')
+sys.path.insert(0, f'{ROOT_DIR}/dtsam_package')
+
+from utils.lib_codec import *
+from utils.lib_rgbd import crop_image, mask2center_image
+
+class PerceptionModels(object):
+    '''
+    Holds every perception model in memory. All paths received by the daemon must be absolute,
+    because detic_sam.py changes the working directory to dtsam_package/Detic when it is imported.
+    '''
+    def __init__(self,device='cuda:0',gum_model_path='checkpoints/gum.pth',if_p=True):
+        self.device = device
+        self.gum_model_path = gum_model_path
+        self.if_p = if_p
+        self.gpu_lock = threading.Lock() # detic/sam/gum share one GPU, one request at a time
+        self.ransac_lock = threading.Lock() # plane detection runs on the cpu, so it can overlap with the gpu models
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.plane_detectors = {}
+        self.load()
+
+    def load(self):
+        start_time = time.time()
+
+        ## dtsam (detic_sam.py chdirs into Detic/ and relies on relative paths from there)
+        os.chdir(f'{ROOT_DIR}/dtsam_package')
+        import detic_sam
+        self.detic_sam = detic_sam
+        self.dtsam_engine = detic_sam.get_engine(self.device) # detic_sam() picks up the same engine
+
+        ## gum
+        import get_dxdyR
+        self.get_dxdyR = get_dxdyR
+        self.gum_session = get_dxdyR.GUMInferenceSession(self.gum_model_path,self.device,root_dir=f'{ROOT_DIR}/gum_package')
+
+        ## ransac
+        from ransac_package import plane_detector
+        self.plane_detector = plane_detector
+
+        if self.if_p:
+            print(f'[Perception Server] models loaded on {self.device} in {time.time()-start_time:.2f} s')
+
+    def get_plane_detector(self,cfg_path,cam_path):
+        key = (cfg_path,cam_path)
+        if key not in self.plane_detectors:
+            self.plane_detectors[key] = self.plane_detector.PlaneDetector(cfg_path,cam_path)
+        return self.plane_detectors[key]
+
+    def get_plane_detector_from_text(self,cfg_text,cam_text):
+        key = hashlib.md5(f'{cfg_text}\n{cam_text}'.encode('utf-8')).hexdigest()
+        if key not in self.plane_detectors:
+            cfg_dir = f'{tempfile.gettempdir()}/perception_server/{key}'
+            os.makedirs(cfg_dir,exist_ok=True)
+            with open(f'{cfg_dir}/cfg_ransac.yaml','w') as f:
+                f.write(cfg_text)
+            with open(f'{cfg_dir}/cfg_cam.yaml','w') as f:
+                f.write(cam_text)
+            self.plane_detectors[key] = self.plane_detector.PlaneDetector(f'{cfg_dir}/cfg_ransac.yaml',f'{cfg_dir}/cfg_cam.yaml')
+        return self.plane_detectors[key]
+
+    ## file mode: inputs were uploaded by sftp, results are written next to them
+    def dtsam(self,img_path,classes='handle',threshold=0.3):
+        if isinstance(classes,str):
+            classes = [classes]
+        with self.gpu_lock:
+            result = self.detic_sam.detic_sam(img_path,classes,self.device,threshold,return_result=True)
+        return result
+
+    def gum(self,image_path,mask_path):
+        with self.gpu_lock:
+            dx,dy,R = self.get_dxdyR.get_dxdyR(image_path,mask_path,device=self.device,model=self.gum_session.model)
+        return {'dx':dx,'dy':dy,'R':R}
+
+    def ransac(self,rgb_img_path,d_img_path,cfg_path,cam_path,seed_xy=None):
+        with self.ransac_lock:
+            detector = self.get_plane_detector(cfg_path,cam_path)
+            result = self.plane_detector.plane_detector(rgb_img_path,d_img_path,cfg_path,cam_path,detector=detector,return_result=True,seed_xy=seed_xy)
+        return result
+
+    ## payload mode: images come with the request, only the structured result goes back (vis is written on the server if vis_dir is given)
+    def dtsam_payload(self,rgb,classes='handle',threshold=0.3,vis_dir=None):
+        if isinstance(classes,str):
+            classes = [classes]
+        image = cv2.cvtColor(decode_image(rgb),cv2.COLOR_BGR2RGB)
+        if vis_dir:
+            os.makedirs(vis_dir,exist_ok=True)
+        with self.gpu_lock:
+            result,mask = self.dtsam_engine.detect(image,classes,threshold,image_dir=vis_dir)
+        result['mask'] = mask_to_rle(mask) if mask is not None else None
+        return result
+
+    def gum_payload(self,rgb,mask):
+        image = Image.fromarray(cv2.cvtColor(decode_image(rgb),cv2.COLOR_BGR2RGB))
+        mask = Image.fromarray(cv2.cvtColor(decode_image(mask),cv2.COLOR_BGR2RGB))
+        with self.gpu_lock:
+            dx,dy,R = self.gum_session.predict(image,mask)
+        return {'dx':dx,'dy':dy,'R':R}
+
+    def ransac_payload(self,rgb,depth,cfg,cam,vis_dir=None,seed_xy=None):
+        rgb_img = decode_image(rgb)
+        d_img = decode_image(depth)
+        if vis_dir:
+            os.makedirs(vis_dir,exist_ok=True)
+        with self.ransac_lock:
+            detector = self.get_plane_detector_from_text(cfg,cam)
+            list_plane_params = self.plane_detector.plane_detector_array(rgb_img,d_img,detector,image_dir=vis_dir,seed_xy=seed_xy)
+        return list_plane_params[0].to_dict()
+
+    ## grasp: dtsam -> gum (crop + regression) and ransac in one request
+    ## ransac runs concurrently with detic/sam, or with gum when its sampling is guided by the handle center from dtsam
+    def perceive_grasp(self,rgb,depth,cfg,cam,classes='handle',threshold=0.3,img_w=640,img_h=640,if_gum=True,vis_dir=None):
+        if isinstance(classes,str):
+            classes = [classes]
+        rgb_img = decode_image(rgb)
+        d_img = decode_image(depth)
+        dtsam_vis_dir = f'{vis_dir}/dtsam' if vis_dir else None
+        ransac_vis_dir = f'{vis_dir}/ransac' if vis_dir else None
+        for _dir in [dtsam_vis_dir,ransac_vis_dir]:
+            if _dir:
+                os.makedirs(_dir,exist_ok=True)
+        times = {}
+
+        def ransac(seed_xy=None):
+            start_time = time.time()
+            with self.ransac_lock:
+                list_plane_params = self.plane_detector.plane_detector_array(rgb_img,d_img,detector,image_dir=ransac_vis_dir,seed_xy=seed_xy)
+            times['ransac'] = time.time()-start_time
+            return list_plane_params[0].to_dict()
+        with self.ransac_lock:
+            detector = self.get_plane_detector_from_text(cfg,cam)
+        if_guided = detector.is_guided()
+        if not if_guided:
+            ransac_future = self.executor.submit(ransac)
+
+        ## dtsam
+        start_time = time.time()
+        image = cv2.cvtColor(rgb_img,cv2.COLOR_BGR2RGB)
+        with self.gpu_lock:
+            dtsam_result,mask = self.dtsam_engine.detect(image,classes,threshold,image_dir=dtsam_vis_dir)
+        dtsam_result['mask'] = mask_to_rle(mask) if mask is not None else None
+        times['dtsam'] = time.time()-start_time
+        if if_guided:
+            ransac_future = self.executor.submit(ransac,(dtsam_result['Cx'],dtsam_result['Cy']) if mask is not None else None)
+
+        ## gum (same crop as primitive.py did on the client: center.png and rgb cropped around the mask center)
+        gum_result = None
+        if if_gum and mask is not None:
+            start_time = time.time()
+            Cx,Cy = dtsam_result['Cx'],dtsam_result['Cy']
+            rgb_cropped = crop_image(Image.fromarray(image),center_x=Cx,center_y=Cy,new_w=img_w,new_h=img_h)
+            mask_cropped = crop_image(mask2center_image(mask,Cx,Cy,dot_size=5),center_x=Cx,center_y=Cy,new_w=img_w,new_h=img_h)
+            with self.gpu_lock:
+                dx,dy,R = self.gum_session.predict(rgb_cropped,mask_cropped)
+            gum_result = {'dx':dx,'dy':dy,'R':R}
+            times['gum'] = time.time()-start_time
+
+        ransac_result = ransac_future.result()
+        return {'dtsam':dtsam_result,'gum':gum_result,'ransac':ransac_result,'times':times}
+
+class PerceptionRequestHandler(BaseHTTPRequestHandler):
+    models = None
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200,{'status':'ok','device':self.models.device})
+        else:
+            self.send_json(404,{'error':f'unknown route {self.path}'})
+
+    def do_POST(self):
+        routes = {'/dtsam':self.models.dtsam,
+                  '/gum':self.models.gum,
+                  '/ransac':self.models.ransac,
+                  '/payload/dtsam':self.models.dtsam_payload,
+                  '/payload/gum':self.models.gum_payload,
+                  '/payload/ransac':self.models.ransac_payload,
+                  '/payload/grasp':self.models.perceive_grasp,
+        }
+        if self.path not in routes:
+            self.send_json(404,{'error':f'unknown route {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length',0))
+            data = json.loads(self.rfile.read(length))
+            start_time = time.time()
+            result = routes[self.path](**data)
+            result['time'] = time.time()-start_time
+            self.send_json(200,result)
+        except Exception as e:
+            traceback.print_exc()
+            self.send_json(500,{'error':f'{type(e).__name__}: {e}'})
+
+    def send_json(self,code,data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        print(f'[Perception Server] {self.address_string()} - {format%args}')
+
+def main(args):
+    PerceptionRequestHandler.models = PerceptionModels(device=args.device,gum_model_path=args.gum_model_path)
+    httpd = ThreadingHTTPServer((args.host,args.port),PerceptionRequestHandler)
+    print(f'[Perception Server] listening on {args.host}:{args.port}')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-host", "--host", type=str, default="0.0.0.0", help="Host to bind.")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port to bind.")
+    parser.add_argument("-d", "--device", type=str, default="cuda:0", help="Device to run on.")
+    parser.add_argument("-model", "--gum_model_path", type=str, default="checkpoints/gum.pth", help="GUM model path (relative to gum_package).")
+    main(parser.parse_args())
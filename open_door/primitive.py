@@ -26,14 +26,17 @@ from camera import Camera
 from head import Head
 from dtsam import DTSAM
 from server import Server
+from perception_client import PerceptionClient, PerceptionClientError
 from ransac import RANSAC
 from dmp import DMP
+from current_monitor import CurrentMonitor
 from gum import GUM
 
 from utils.lib_math import *
 from utils.lib_io import *
 from utils.lib_rgbd import *
 from utils.lib_log import *
+from utils.lib_trace import get_tracer, trace
 from utils.lib_clip import *
 from utils.lib_gemini import *
 from prompt import *
@@ -41,7 +44,8 @@ from prompt import *
 def time_it(func):
     def wrapper(*args, **kwargs):
         start_time = time.time() 
-        result = func(*args, **kwargs)
+        with get_tracer().span(func.__name__,cat='primitive',action_num=args[0].action_num):
+            result = func(*args, **kwargs)
         end_time = time.time()
         execution_time = end_time - start_time 
         print(f"[Time] {func.__name__} execution time: {execution_time:.4f} s")
@@ -66,6 +70,14 @@ class Primitive(object):
         ## init two arms
         self.arm_r = Arm.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_arm_right}')
         self.arm_l = Arm.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_arm_left}')
+        # dmp of the grasp reference trajectories (weights cached in cfg/dmp_cache/)
+        self.arm_l.load_dmp(cfg.grasp.grasp_dmp_refer_tjt_path_left)
+        self.arm_r.load_dmp(cfg.grasp.grasp_dmp_refer_tjt_path_right)
+
+        ## init current monitor (sampling thread + ring buffer, thresholds below)
+        self.current_monitor = CurrentMonitor(rate=cfg.monitor.rate,buffer_size=cfg.monitor.buffer_size)
+        self.current_max = [0]*7
+        self.current_min = [0]*7
         
         ## init camera
         self.camera = Camera.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_cam}')
@@ -78,6 +90,14 @@ class Primitive(object):
         
         ## init server
         self.server = Server.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_server}')
+
+        ## init perception client (perception_server.py keeps dtsam/gum/ransac in memory on the server)
+        self.perception = PerceptionClient.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_perception}')
+        self.perception_client = self.perception if self.perception.enable and self.perception.is_alive() else None
+        if self.perception.enable and self.perception_client is None:
+            print(f'[Perception] {self.perception.url} is not reachable, fall back to running the scripts through ssh')
+        self.if_payload = self.perception_client is not None and self.perception.transport == 'payload' # send arrays instead of sftp files
+        self.perception_vis_dirs = [] # (remote_dir,local_dir) of visualizations to fetch lazily
         
         ## init ransac
         self.ransac = RANSAC(cfg_ransac=f'{root_dir}/{cfg.cfg_ransac}',cfg_cam=f'{root_dir}/{cfg.cfg_cam}')
@@ -87,6 +107,8 @@ class Primitive(object):
 
         ## init handle_grasp_model
         self.gum = GUM.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_gum}')
+        if self.gum.if_local:
+            self.gum.load_local() # load the exported model before the first grasp
 
         ## init gemini
         self.gemini = GEMINI.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_gemini}')
@@ -98,6 +120,11 @@ class Primitive(object):
         self.logger = Logger.init_from_yaml(cfg_path=f'{root_dir}/{cfg.cfg_logger}')
         self.logger.log_path = f'{self.tjt_dir}/log'
 
+        ## init tracer (stage timings of every primitive, {tjt_dir}/trace.jsonl)
+        self.tracer = get_tracer()
+        self.tracer.open(f'{self.tjt_dir}/trace.jsonl',tjt_num=self.tjt_num,type=self.type)
+        self.save_meta()
+
         ## remote
         self.remote_python_path = cfg.remote_python_path
         self.remote_root_dir = cfg.remote_root_dir
@@ -161,6 +188,7 @@ class Primitive(object):
         self.last_pmt = _Primitive(action="START",id=self.START,ret=1,param=[0,0,0],error="START")
         self.this_pmt = _Primitive(action="START",id=self.START,ret=1,param=[0,0,0],error="START")
         self.primitives = {0:self.last_pmt.to_list()}
+        self.detections = {}
 
     def disconnect_robot(self):
         print('========== Disconnecting... ==========')
@@ -169,11 +197,43 @@ class Primitive(object):
         self.arm_l.disconnect()
         self.base.disconnect()
         self.head.disconnect()
+        self.fetch_perception_vis()
         self.server.disconnect()
         print('========== Disconnected ==========')
 
     def __str__(self):
         return ''
+
+    def perception_vis_dir(self,name):
+        # payload mode: the server only writes visualizations if asked, they are downloaded in fetch_perception_vis()
+        if not self.perception.if_vis:
+            return None
+        remote_dir = f'{self.remote_img_dir}/tjt_{self.tjt_num:03d}/{self.action_num}/{name}/'
+        local_dir = f'{self.tjt_dir}/{self.action_num}/{name}/'
+        self.perception_vis_dirs.append((remote_dir,local_dir))
+        return remote_dir
+
+    def drop_perception_client(self,e,stage):
+        # the daemon died or stalled after the start: this request and the rest of the run go through the ssh scripts
+        self.logger.error(f'[Perception] - {stage} - {e} - fall back to running the scripts through ssh')
+        self.perception_client = None
+        self.if_payload = False
+
+    def perceive_grasp(self,rgb_img,d_img,if_gum=True):
+        # dtsam -> gum crop + regression, and ransac, in a single request to the perception server
+        cfg_text,cam_text = self.ransac.read_cfg_text()
+        return self.perception_client.perceive_grasp(rgb_img,d_img,cfg_text,cam_text,
+                                                     classes=self.dtsam.classes,threshold=self.dtsam.threshold,
+                                                     img_w=self.gum.img_w,img_h=self.gum.img_h,
+                                                     if_gum=if_gum,vis_dir=self.perception_vis_dir(''))
+
+    def fetch_perception_vis(self):
+        for remote_dir,local_dir in self.perception_vis_dirs:
+            try:
+                self.server.transfer_folder_remote2local(remote_dir,local_dir)
+            except Exception as e:
+                print(f'[Perception] failed to fetch {remote_dir}: {e}')
+        self.perception_vis_dirs = []
     
     def action2num(self,action):
         if action == "premove":
@@ -224,7 +284,8 @@ class Primitive(object):
                 "this_id": self.this_pmt.id,
                 "this_ret": self.this_pmt.ret,
                 "this_param": self.this_pmt.param,
-                "this_error": self.this_pmt.error
+                "this_error": self.this_pmt.error,
+                "detections": self.detections
                 }
         
         with open(save_path,'w') as json_file:
@@ -235,7 +296,20 @@ class Primitive(object):
             setattr(self.last_pmt, attr, getattr(self.this_pmt, attr))
 
         self.primitives[self.action_num] = self.this_pmt.to_list()
+        self.detections = {}
     
+    def record_detection(self,detector,success,result,text,probs):
+        # clip / gemini check of this action, saved in {action_num}.json by update() (utils/lib_tjt_db.py)
+        self.detections[detector] = {"success": bool(success), "result": int(result), "text": str(text), "probs": np.asarray(probs,dtype=float).tolist()}
+
+    def save_meta(self,save_path=None):
+        # what the folder alone does not tell: handle type and start time of the run (utils/lib_tjt_db.py)
+        if save_path is None:
+            save_path=f'{self.tjt_dir}/meta.json'
+        meta = {"tjt_num": self.tjt_num, "type": self.type, "start_time": time.time()}
+        with open(save_path,'w') as json_file:
+            json.dump(meta,json_file,indent=4)
+
     def save_primitives(self,save_path=None):
         if save_path is None:
             save_path=f'{self.tjt_dir}/primitives.json'
@@ -244,6 +318,7 @@ class Primitive(object):
             json.dump(self.primitives,json_file,indent=4)
 
     # @time_it
+    @trace('capture')
     def capture(self,if_d=False,vis=False,if_update=True):
         # print('========== Image Capturing ... ==========')
         self.logger.info(f'[Camera] - Capture Image')
@@ -254,7 +329,9 @@ class Primitive(object):
             self.d_img_path = f'{self.tjt_dir}/{self.action_num}/d.png'
             mkfile(self.d_img_path)
             rgb_img,d_img = self.camera.capture_rgbd(rgb_save_path=self.rgb_img_path,d_save_path=self.d_img_path)
+            self.rgb_img,self.d_img = rgb_img,d_img
             if vis:
+                self.camera.wait_writes()
                 save_dir = f'{self.tjt_dir}/{self.action_num}/vis/'
                 mkdir(save_dir)
                 vis_rgbd(d_img_path=self.d_img_path,rgb_img_path=self.rgb_img_path,save_path=f'{save_dir}/vis_rgbd.png')
@@ -263,6 +340,7 @@ class Primitive(object):
         else:
             if if_update:
                 rgb_img = self.camera.capture_rgb(rgb_save_path=self.rgb_img_path)
+                self.rgb_img = rgb_img
             else:
                 rgb_img = self.camera.capture_rgb(f'{self.tjt_dir}/temp.png')
             return rgb_img
@@ -270,74 +348,54 @@ class Primitive(object):
     def start_current_monitor_thread(self,thresholds_safety,thresholds_event=None,if_event_stop=True):
         # print(f'[thresholds_safety]: {thresholds_safety}')
         # print(f'[thresholds_event]: {thresholds_event}')
-        self.current_data = {i: [] for i in range(7)}
-        self.current_max = [0]*7
-        self.current_min = [0]*7
-        self.current_data_start_time = time.time()
-        self.monitor_running = True
-        self.current_monitor_thread = threading.Thread(target=self.current_monitor_loop, args=(thresholds_safety,thresholds_event,if_event_stop))
-        self.current_monitor_thread.daemon = True
-        self.current_monitor_thread.start()
-
-    def current_monitor_loop(self,thresholds_safety,thresholds_event,if_event_stop):
-        while self.monitor_running:
-            current_check_result,current = self.check_current_safety(thresholds_safety,thresholds_event)
-            if current_check_result == -1:
-                # print(f"!!! SAFETY ISSUE !!!")
-                self.logger.error(f'[Monitor] - SAFETY_ISSUE !!!')
-                self.this_pmt.ret = self.SAFETY_ISSUE
-                self.this_pmt.error = 'SAFETY_ISSUE'
-                # print(f'[Now Current]: {current}')
-                self.logger.info(f'[Monitor] - now_current: {current}')
-                self.arm.move_stop(if_p=True)
-                self.base.move_stop(if_p=True)
-                break
-            elif current_check_result == 0:
-                # print(f"!!! Event Detected !!!")
-                self.logger.info(f'[Monitor] - EVENT_DETECTED !!!')
-                self.this_pmt.ret = self.EVENT_DETECTED
-                self.this_pmt.error = 'EVENT_DETECTED'
-                # print(f'[Now Current]: {current}')
-                self.logger.info(f'[Monitor] - now_current: {current}')
-                self.action_T = time.time() - self.current_data_start_time
-                if if_event_stop:
-                    self.arm.move_stop(if_p=True)
-                    self.base.move_stop(if_p=True)
-                break
-            elif current_check_result == 1:
-                self.this_pmt.ret = self.NO_ISSUE
-                self.this_pmt.error = 'NO_ISSUE'
-                self.action_T = time.time() - self.current_data_start_time
-            time.sleep(0.1)
-
-    def check_current_safety(self,thresholds_safety,thresholds_event):
-        current = self.arm.get_c()
-        for i in range(7):
-            self.current_data[i].append(current[i])
-            self.current_max[i] = max(self.current_max[i],current[i])
-            self.current_min[i] = min(self.current_min[i],current[i])
-        # safety issue
-        for i, (min_current, max_current) in enumerate(thresholds_safety):
-            if current[i] < min_current or current[i] > max_current:
-                return -1,current
-        # event detected
-        if thresholds_event:
-            for i, (min_current, max_current) in enumerate(thresholds_event):
-                if current[i] < min_current or current[i] > max_current:
-                    return 0,current
-        # no issue
-        return 1,current
+        self.current_monitor.start(get_current=self.arm.get_c,thresholds_safety=thresholds_safety,thresholds_event=thresholds_event,
+                                   on_issue=self.on_current_issue,on_stop=self.on_current_stop,if_event_stop=if_event_stop)
+        self.current_data_start_time = self.current_monitor.start_time
+
+    def on_current_issue(self,current_check_result,current,t):
+        if current_check_result == -1:
+            # print(f"!!! SAFETY ISSUE !!!")
+            self.logger.error(f'[Monitor] - SAFETY_ISSUE !!!')
+            self.this_pmt.ret = self.SAFETY_ISSUE
+            self.this_pmt.error = 'SAFETY_ISSUE'
+        elif current_check_result == 0:
+            # print(f"!!! Event Detected !!!")
+            self.logger.info(f'[Monitor] - EVENT_DETECTED !!!')
+            self.this_pmt.ret = self.EVENT_DETECTED
+            self.this_pmt.error = 'EVENT_DETECTED'
+            self.action_T = t
+        # print(f'[Now Current]: {current}')
+        self.logger.info(f'[Monitor] - now_current: {current}')
+
+    def on_current_stop(self):
+        self.arm.move_stop(if_p=True)
+        self.base.move_stop(if_p=True)
+
+    def stop_current_monitor(self):
+        '''
+        Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
+        '''
+        result = self.current_monitor.stop()
+        if result is None:
+            self.this_pmt.ret = self.NO_ISSUE
+            self.this_pmt.error = 'NO_ISSUE'
+            self.action_T = time.time() - self.current_data_start_time
+        data = self.current_monitor.get_data()
+        if len(data):
+            self.current_max = np.maximum(0,data[:,1:].max(axis=0)).tolist()
+            self.current_min = np.minimum(0,data[:,1:].min(axis=0)).tolist()
+        return result
 
     def vis_current_data(self,img_save_path=None,csv_save_path=None,show=False):
+        data = self.current_monitor.get_data() # time since start, current of joint 0-6
         if img_save_path is None:
             img_save_path = f'{self.tjt_dir}/{self.action_num}/haptics/current.png'
         mkfile(img_save_path)
         plt.figure()
         colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
-        time_elapsed = [t - self.current_data_start_time for t in range(len(self.current_data[0]))] 
         for i in range(7):
-            plt.plot(time_elapsed, self.current_data[i], label=f'Joint {i}', color=colors[i])
-        plt.xlabel('Time')
+            plt.plot(data[:,0], data[:,i+1], label=f'Joint {i}', color=colors[i])
+        plt.xlabel('Time (s)')
         plt.ylabel('Current Value')
         plt.title('Current Data of Each Joint')
         plt.legend()
@@ -345,6 +403,7 @@ class Primitive(object):
         plt.savefig(img_save_path)
         if show:
             plt.show()
+        plt.close()
 
         # save current data
         if csv_save_path is None:  
@@ -353,9 +412,7 @@ class Primitive(object):
         with open(csv_save_path, 'w', newline='') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(['Time'] + [f'Joint {i}' for i in range(7)])
-            for i in range(len(time_elapsed)):
-                row = [time_elapsed[i]] + [self.current_data[j][i] for j in range(7)]
-                writer.writerow(row)
+            writer.writerows(data.tolist())
 
     @time_it
     def premove(self,param):
@@ -373,28 +430,40 @@ class Primitive(object):
 
         rgb_img_path = f'{self.tjt_dir}/{self.action_num}/rgb.png'
         mkfile(rgb_img_path)
+        self.camera.wait_writes() # rgb.png / d.png of the capture before this primitive
         shutil.copy2(self.rgb_img_path, rgb_img_path)
         d_img_path = self.d_img_path
 
         # print(f'RANSAC ...')
         self.logger.flag(f'[Premove] - RANSAC Start')
+        self.tracer.begin('RANSAC')
         last_time = time.time()
-        self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_server(rgb_img_path,d_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
+        try:
+            if self.if_payload:
+                self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_payload(self.rgb_img,self.d_img,self.perception_client,vis_dir=self.perception_vis_dir('ransac'))
+            else:
+                self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_server(rgb_img_path,d_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir,client=self.perception_client)
+        except PerceptionClientError as e:
+            self.drop_perception_client(e,'Premove RANSAC')
+            self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_server(rgb_img_path,d_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
         now_time = time.time()
         # print(f'[Time ransac]: {now_time-last_time} s')
         # print(f'[RANSAC Result] normal: {self.normal} weights: {self.weights}')
         self.logger.info(f'[Premove] - RANSAC Result - normal: {self.normal} weights: {self.weights} 3d_center: {self._3d_center} 2d_center: {self._2d_center} mask_color: {self.mask_color}')
-        self.logger.time(f'[Premove] - RANSAC Time - {now_time-last_time} s')
+        self.logger.time(f'[Premove] - RANSAC Time - {now_time-last_time} s',primitive='Premove',stage='RANSAC',duration=now_time-last_time)
         self.logger.flag(f'[Premove] - RANSAC End')
+        self.tracer.end('RANSAC')
 
         self.logger.flag(f'[Premove] - Moving Start')
+        self.tracer.begin('move')
         self.move_T,self.move_distance = self.base.move_to_door(self.weights,self.cfg.premove.offset_in_front,self.cfg.premove.d2t_coefficient,self.cfg.premove.linear_velocity)
         time.sleep(2)
         # print(f'[Time Moving] move_T: {self.move_T} s')
         # print(f'[Moving Result] weights: {self.weights} offset_in_front: {self.cfg.premove.offset_in_front} d2t_coefficient: {self.cfg.premove.d2t_coefficient} linear_velocity: {self.cfg.premove.linear_velocity}')
         self.logger.info(f'[Premove] - Moving Input - weights: {self.weights} offset_in_front: {self.cfg.premove.offset_in_front} d2t_coefficient: {self.cfg.premove.d2t_coefficient} linear_velocity: {self.cfg.premove.linear_velocity}')
-        self.logger.time(f'[Premove] - Moving Output - move_T: {self.move_T} s move_distance: {self.move_distance}')
+        self.logger.time(f'[Premove] - Moving Output - move_T: {self.move_T} s move_distance: {self.move_distance}',primitive='Premove',stage='Moving',duration=self.move_T,move_distance=self.move_distance)
         self.logger.flag(f'[Premove] - Moving End')
+        self.tracer.end('move')
 
         self.this_pmt.ret = self.SUCCESS
         self.this_pmt.error = "NONE"
@@ -409,7 +478,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Premove] - Premove End')
         end_time = time.time()
-        self.logger.time(f'[Premove] - Premove Time: {end_time-start_time} s')
+        self.logger.time(f'[Premove] - Premove Time: {end_time-start_time} s',primitive='Premove',stage='total',duration=end_time-start_time)
 
         print(f'========== Premove Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -428,6 +497,7 @@ class Primitive(object):
         ## os
         rgb_img_path = f'{self.tjt_dir}/{self.action_num}/rgb.png'
         mkfile(rgb_img_path)
+        self.camera.wait_writes() # rgb.png / d.png of the capture before this primitive
         shutil.copy2(self.rgb_img_path, rgb_img_path)
         d_img_path = self.d_img_path
 
@@ -440,16 +510,36 @@ class Primitive(object):
         ## dtsam
         # print('DTSAM ...')
         self.logger.flag(f'[Grasp] - DTSAM Start')
+        self.tracer.begin('DTSAM')
         last_time = time.time()
         if self.type == 'knob':
             self.dtsam.classes = 'doorknob'
-        self.x1_2d,self.y1_2d,self.orientation,self.w,self.h,self.box = self.dtsam.get_xy_server(rgb_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
-        now_time = time.time()
-        # print(f'[Time dtsam]: {now_time-last_time} s')
+        if self.if_payload:
+            # dtsam, gum and ransac in one request (ransac runs next to dtsam on the server)
+            try:
+                self.perception_result = self.perceive_grasp(self.rgb_img,self.d_img,if_gum=not param and not self.gum.if_local)
+            except PerceptionClientError as e:
+                self.drop_perception_client(e,'Grasp Perception') # if_payload is now False: dtsam below, gum and ransac through ssh
+        if self.if_payload:
+            dtsam_result = self.perception_result['dtsam']
+            self.x1_2d,self.y1_2d,self.orientation = dtsam_result['Cx'],dtsam_result['Cy'],dtsam_result['orientation']
+            self.w,self.h,self.box,self.handle_mask = dtsam_result['w'],dtsam_result['h'],dtsam_result['box'],dtsam_result['mask']
+            perception_time = time.time()-last_time
+            self.logger.time(f'[Grasp] - Perception Time - {perception_time} s',primitive='Grasp',stage='Perception',duration=perception_time)
+            dtsam_time = self.perception_result['times']['dtsam']
+        else:
+            try:
+                self.x1_2d,self.y1_2d,self.orientation,self.w,self.h,self.box = self.dtsam.get_xy_server(rgb_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir,client=self.perception_client)
+            except PerceptionClientError as e:
+                self.drop_perception_client(e,'Grasp DTSAM')
+                self.x1_2d,self.y1_2d,self.orientation,self.w,self.h,self.box = self.dtsam.get_xy_server(rgb_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
+            dtsam_time = time.time()-last_time
+        # print(f'[Time dtsam]: {dtsam_time} s')
         # print(f'[DTSAM Result] x1_2d: {self.x1_2d}, y1_2d: {self.y1_2d}, orientation: {self.orientation}, w: {self.w}, h: {self.h}, box: {self.box}')
-        self.logger.time(f'[Grasp] - DTSAM Time - {now_time-last_time} s')
+        self.logger.time(f'[Grasp] - DTSAM Time - {dtsam_time} s',primitive='Grasp',stage='DTSAM',duration=dtsam_time)
         self.logger.info(f'[Grasp] - DTSAM Result - x1_2d: {self.x1_2d}, y1_2d: {self.y1_2d}, orientation: {self.orientation}, w: {self.w}, h: {self.h}, box: {self.box}')
         self.logger.flag(f'[Grasp] - DTSAM End')
+        self.tracer.end('DTSAM',dtsam_time=dtsam_time)
 
         if self.w == 0 and self.h == 0:
             self.this_pmt.ret = self.GRASP_NO_HANDLE
@@ -461,20 +551,40 @@ class Primitive(object):
             if not param:
                 # print('GUM ...')
                 self.logger.flag(f'[Grasp] - GUM Start')
-                crop_rgb_img_path = f'{os.path.dirname(rgb_img_path)}/gum/rgb_cropped.png'
-                crop_image(rgb_img_path, center_x=self.x1_2d, center_y=self.y1_2d, new_w=self.gum.img_w, new_h=self.gum.img_h, save_path=crop_rgb_img_path)
-                mask_path = f'{os.path.dirname(rgb_img_path)}/dtsam/center.png'
-                crop_mask_path = f'{os.path.dirname(rgb_img_path)}/gum/mask_cropped.png'
-                mask_image = crop_image(mask_path, center_x=self.x1_2d, center_y=self.y1_2d, new_w=self.gum.img_w, new_h=self.gum.img_h, save_path=crop_mask_path)
-                
-                last_time = time.time()
-                self.dx,self.dy,self.R = self.gum.get_dxdyR_server(crop_rgb_img_path,crop_mask_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
-                now_time = time.time()
-                # print(f'[Time gum]: {now_time-last_time} s')
+                self.tracer.begin('GUM')
+                if self.if_payload:
+                    # the mask came back as rle, so keep center.png for the record
+                    mask2center_image(self.handle_mask,self.x1_2d,self.y1_2d,dot_size=5,save_path=f'{os.path.dirname(rgb_img_path)}/dtsam/center.png')
+                if self.if_payload and not self.gum.if_local:
+                    # already cropped and regressed on the server
+                    gum_result = self.perception_result['gum']
+                    self.dx,self.dy,self.R = gum_result['dx'],gum_result['dy'],gum_result['R']
+                    gum_time = self.perception_result['times']['gum']
+                else:
+                    mkdir(f'{os.path.dirname(rgb_img_path)}/gum/')
+                    crop_rgb_img_path = f'{os.path.dirname(rgb_img_path)}/gum/rgb_cropped.png'
+                    crop_image(rgb_img_path, center_x=self.x1_2d, center_y=self.y1_2d, new_w=self.gum.img_w, new_h=self.gum.img_h, save_path=crop_rgb_img_path)
+                    mask_path = f'{os.path.dirname(rgb_img_path)}/dtsam/center.png'
+                    crop_mask_path = f'{os.path.dirname(rgb_img_path)}/gum/mask_cropped.png'
+                    mask_image = crop_image(mask_path, center_x=self.x1_2d, center_y=self.y1_2d, new_w=self.gum.img_w, new_h=self.gum.img_h, save_path=crop_mask_path)
+                    
+                    last_time = time.time()
+                    if self.gum.if_local:
+                        # exported model on this cpu (cfg_gum.yaml backend: 'local'), no ssh hop
+                        self.dx,self.dy,self.R = self.gum.get_dxdyR_local(crop_rgb_img_path,crop_mask_path)
+                    else:
+                        try:
+                            self.dx,self.dy,self.R = self.gum.get_dxdyR_server(crop_rgb_img_path,crop_mask_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir,client=self.perception_client)
+                        except PerceptionClientError as e:
+                            self.drop_perception_client(e,'Grasp GUM')
+                            self.dx,self.dy,self.R = self.gum.get_dxdyR_server(crop_rgb_img_path,crop_mask_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
+                    gum_time = time.time()-last_time
+                # print(f'[Time gum]: {gum_time} s')
                 # print(f'[GUM Result]: dx: {self.dx}, dy: {self.dy}, R: {self.R}')
-                self.logger.time(f'[Grasp] - GUM Time - {now_time-last_time} s')
+                self.logger.time(f'[Grasp] - GUM Time - {gum_time} s',primitive='Grasp',stage='GUM',duration=gum_time)
                 self.logger.info(f'[Grasp] - GUM Result - dx: {self.dx}, dy: {self.dy}, R: {self.R}')
                 self.logger.flag(f'[Grasp] - GUM End')
+                self.tracer.end('GUM',gum_time=gum_time)
             else:
                 self.dx,self.dy,self.R = param[:3]
                 # print(f'dx: {self.dx}, dy: {self.dy}, R: {self.R}')
@@ -524,6 +634,7 @@ class Primitive(object):
             self.logger.info(f'[Grasp] - Arm Choice - {self.r_l}')
 
             ## get handle depth
+            self.tracer.begin('depth')
             self.handle_depth = self.camera.get_depth_point(self.x1_2d,self.y1_2d,d_img=d_img_path)
             self.logger.info(f'[Grasp] - Depth Result - {self.handle_depth}')
             if self.handle_depth == 0:
@@ -533,6 +644,7 @@ class Primitive(object):
                     self.handle_depth = self.camera.get_depth_roi(self.x1_2d,self.y1_2d,d_img=d_img_path,radius=15,depth_threshold=0.05,valid_ratio_threshold=0.50)
                     self.logger.info(f'[Grasp] - Depth Result - {self.handle_depth}')
             # print(f'[Depth Result]: {self.handle_depth}')
+            self.tracer.end('depth',handle_depth=self.handle_depth)
 
             ## xy_depth 2 xyz
             self.x1_3d,self.y1_3d,self.z1_3d = self.camera.xy_depth_2_xyz(self.x1_2d,self.y1_2d,self.handle_depth)
@@ -545,14 +657,28 @@ class Primitive(object):
             ## ransac
             # print('RANSAC ...')
             self.logger.flag(f'[Grasp] - RANSAC Start')
+            self.tracer.begin('RANSAC')
             last_time = time.time()
-            self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_server(rgb_img_path,d_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir)
-            now_time = time.time()
-            # print(f'[Time ransac]: {now_time-last_time} s')
+            if self.if_payload:
+                # already done on the server together with dtsam
+                ransac_result = self.perception_result['ransac']
+                self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = ransac_result['normal'],ransac_result['weights'],ransac_result['3d_center'],ransac_result['2d_center'],ransac_result['mask_color']
+                ransac_time = self.perception_result['times']['ransac']
+                self.logger.info(f'[Grasp] - RANSAC Iterations - {ransac_result.get("ransac_iterations")}')
+            else:
+                # the handle center is on the door, it guides the ransac sampling (RANSAC_config.guided)
+                try:
+                    self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_server(rgb_img_path,d_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir,client=self.perception_client,seed_xy=(int(self.x1_2d),int(self.y1_2d)))
+                except PerceptionClientError as e:
+                    self.drop_perception_client(e,'Grasp RANSAC')
+                    self.normal,self.weights,self._3d_center,self._2d_center,self.mask_color = self.ransac.get_normal_server(rgb_img_path,d_img_path,self.server,self.remote_python_path,self.remote_root_dir,self.remote_img_dir,seed_xy=(int(self.x1_2d),int(self.y1_2d)))
+                ransac_time = time.time()-last_time
+            # print(f'[Time ransac]: {ransac_time} s')
             # print(f'[RANSAC Result] normal: {self.normal} weights: {self.weights}')
-            self.logger.time(f'[Grasp] - RANSAC Time - {now_time-last_time} s')
+            self.logger.time(f'[Grasp] - RANSAC Time - {ransac_time} s',primitive='Grasp',stage='RANSAC',duration=ransac_time)
             self.logger.info(f'[Grasp] - RANSAC Result - normal: {self.normal} weights: {self.weights} 3d_center: {self._3d_center} 2d_center: {self._2d_center} mask_color: {self.mask_color}')
             self.logger.flag(f'[Grasp] - RANSAC End')
+            self.tracer.end('RANSAC',ransac_time=ransac_time)
 
             ## normal2rxryrz
             self.rx,self.ry,self.rz = normal2rxryrz(self.normal)
@@ -575,7 +701,7 @@ class Primitive(object):
             self.logger.info(f'[Grasp] - p1_3d_base_xyzrxryrz original - {self.p1_3d_base_xyzrxryrz}')
             self.logger.info(f'[Grasp] - p2_3d_base_xyzrxryrz original - {self.p2_3d_base_xyzrxryrz}')
 
-"""
+            """
             ## p1 offset and p2 offset
             if param:
                 if len(param) == 4:
@@ -655,7 +781,7 @@ class Primitive(object):
             self.logger.info(f'[Grasp] - p2_depth_offset - {self.cfg.grasp.p2_depth_offset}')
             self.logger.info(f'[Grasp] - p1_3d_base_xyzrxryrz after offset - {self.p1_3d_base_xyzrxryrz}')
             self.logger.info(f'[Grasp] - p2_3d_base_xyzrxryrz after offset - {self.p2_3d_base_xyzrxryrz}')
-"""
+            """
             ## Current Detection Begin
             self.start_current_monitor_thread(thresholds_safety=self.grasp_thresholds)
             self.logger.info(f'[Grasp] - Current Detection Start')
@@ -663,6 +789,7 @@ class Primitive(object):
             ## move to handle(DMP)
             # print(f'Moving ...')
             self.logger.flag(f'[Grasp] - Moving Start')
+            self.tracer.begin('move')
 
             ## method 1
             middle_point = self.p1_3d_base_xyzrxryrz.copy()
@@ -682,27 +809,31 @@ class Primitive(object):
             self.p1_joint = self.arm.get_j()
             self.logger.info(f'[Grasp] - Moving Result - Failure tag: {tag}')
             self.logger.flag(f'[Grasp] - Moving End')
+            self.tracer.end('move')
 
             ## close gripper
             # print(f'Closing Gripper ...')
             self.logger.flag(f'[Grasp] - Gripper Closing Start')
+            self.tracer.begin('gripper')
             if not tag:
                 self.arm.control_gripper(self.cfg.grasp.gripper_value)
                 time.sleep(2)
             self.logger.flag(f'[Grasp] - Gipper Value: {self.cfg.grasp.gripper_value}')
             self.logger.flag(f'[Grasp] - Gripper Closing End')
+            self.tracer.end('gripper')
 
             ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-            self.monitor_running = False
-            self.current_monitor_thread.join()
+            self.stop_current_monitor()
             self.vis_current_data()
             self.logger.info(f'[Grasp] - Current Detection End')
             
             ## clip
             text_prompt=["handle with gripper grasped firmly", "handle without gripper grasped firmly"]
+            self.camera.wait_writes(self.rgb_img_path)
             clip_result,clip_text,clip_probs = self.clip.clip_detection(rgb_img=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
             clip_success = (clip_result == 0 and self.arm.get_gripper_grasp_return(if_p=False) == 2) or (clip_result == 1 and self.arm.get_gripper_grasp_return(if_p=False) != 2)
             self.logger.info(f'[Grasp] - CLIP Result - clip_success: {clip_success} text_prompt: {text_prompt} clip_result: {clip_result} clip_text: {clip_text} clip_probs: {clip_probs}')
+            self.record_detection('clip',clip_success,clip_result,clip_text,clip_probs)
             
             ## gemini
             # gemini_result,gemini_text,gemini_probs =  self.gemini.gemini_detection(img_path=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
@@ -736,7 +867,7 @@ class Primitive(object):
         
         self.logger.flag(f'[Grasp] - Grasp End')
         end_time = time.time()
-        self.logger.time(f'[Grasp] - Grasp Time: {end_time-start_time} s')
+        self.logger.time(f'[Grasp] - Grasp Time: {end_time-start_time} s',primitive='Grasp',stage='total',duration=end_time-start_time)
 
         print(f'========== Grasp Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -755,10 +886,12 @@ class Primitive(object):
         ## close gripper
         # print(f'Closing Gripper ...')
         self.logger.flag(f'[Unlock] - Gripper Closing Start')
+        self.tracer.begin('gripper')
         self.arm.control_gripper(self.cfg.unlock.gripper_value_before)
         time.sleep(2)
         self.logger.flag(f'[Unlock] - Gipper Value Before: {self.cfg.unlock.gripper_value_before}')
         self.logger.flag(f'[Unlock] - Gripper Closing End')
+        self.tracer.end('gripper')
 
         ## Current Detection Begin
         if self.r_l == 'right':
@@ -770,14 +903,15 @@ class Primitive(object):
         ## unlock
         # print(f'Unlocking ...')
         self.logger.flag(f'[Unlock] - Moving Start')
+        self.tracer.begin('move')
         tag = self.arm.move_p(pos=self.p2_3d_base_xyzrxryrz,vel=self.cfg.unlock.unlock_v,if_p=True)
         time.sleep(2)
         self.logger.info(f'[Unlock] - Moving Result - tag: {tag} unlock vel: {self.cfg.unlock.unlock_v}')
         self.logger.flag(f'[Unlock] - Moving End')
+        self.tracer.end('move')
         
         ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-        self.monitor_running = False
-        self.current_monitor_thread.join()
+        self.stop_current_monitor()
         self.vis_current_data()
         self.logger.info(f'[Unlock] - Current Detection End')
 
@@ -785,21 +919,26 @@ class Primitive(object):
         if not self.this_pmt.ret == self.SAFETY_ISSUE:
             # print(f'Closing Gripper ...')
             self.logger.flag(f'[Unlock] - Gripper Closing Start')
+            self.tracer.begin('gripper')
             self.arm.control_gripper(self.cfg.unlock.gripper_value_after)
             time.sleep(2)
             self.logger.flag(f'[Unlock] - Gipper Value After: {self.cfg.unlock.gripper_value_after}')
             self.logger.flag(f'[Unlock] - Gripper Closing End')
+            self.tracer.end('gripper')
         
         ## clip
         text_prompt=["handle with gripper grasped firmly", "handle without gripper grasped firmly"]
+        self.camera.wait_writes(self.rgb_img_path)
         clip_result,clip_text,clip_probs = self.clip.clip_detection(rgb_img=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
         clip_success = (clip_result == 0 and self.arm.get_gripper_grasp_return(if_p=False) == 2) or (clip_result == 1 and self.arm.get_gripper_grasp_return(if_p=False) != 2)
         self.logger.info(f'[Unlock] - CLIP Result - clip_success: {clip_success} text_prompt: {text_prompt} clip_result: {clip_result} clip_text: {clip_text} clip_probs: {clip_probs}')
+        self.record_detection('clip',clip_success,clip_result,clip_text,clip_probs)
         
         ## gemini
         gemini_result,gemini_text,gemini_probs =  self.gemini.gemini_detection(img_path=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
         gemini_success = (gemini_result == 0 and self.arm.get_gripper_grasp_return(if_p=False) == 2) or (gemini_result == 1 and self.arm.get_gripper_grasp_return(if_p=False) != 2)
         self.logger.info(f'[Unlock] - gemini Result - gemini_success: {gemini_success} text_prompt: {text_prompt} gemini_result: {gemini_result} gemini_text: {gemini_text} gemini_probs: {gemini_probs}')
+        self.record_detection('gemini',gemini_success,gemini_result,gemini_text,gemini_probs)
 
         ## update
         if self.this_pmt.ret == self.SAFETY_ISSUE:
@@ -840,7 +979,7 @@ class Primitive(object):
         # print(f'[Primitive INFO] ret: {self.this_pmt.ret}, error: {self.this_pmt.error}')
         self.logger.flag(f'[Unlock] - Unlock End')
         end_time = time.time()
-        self.logger.time(f'[Unlock] - Unlock Time: {end_time-start_time} s')
+        self.logger.time(f'[Unlock] - Unlock Time: {end_time-start_time} s',primitive='Unlock',stage='total',duration=end_time-start_time)
 
         print(f'========== Unlock Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -859,10 +998,12 @@ class Primitive(object):
         ## close gripper
         # print(f'Closing Gripper ...')
         self.logger.flag(f'[Rotate] - Gripper Closing Start')
+        self.tracer.begin('gripper')
         self.arm.control_gripper(self.cfg.rotate.gripper_value)
         time.sleep(1)
         self.logger.flag(f'[Rotate] - Gipper Value Before: {self.cfg.rotate.gripper_value}')
         self.logger.flag(f'[Rotate] - Gripper Closing End')
+        self.tracer.end('gripper')
 
         ## Current Detection Begin
         if self.r_l == 'right':
@@ -874,24 +1015,27 @@ class Primitive(object):
         ## rotate
         # print(f'Rotating ...')
         self.logger.flag(f'[Rotate] - Moving Start')
+        self.tracer.begin('move')
         joint = self.arm.get_j()
         joint[6] += 75
         tag = self.arm.move_j(joint=joint,vel=self.cfg.rotate.rotate_v)
         time.sleep(2)
         self.logger.info(f'[Rotate] - Moving Result - tag: {tag} rotate vel: {self.cfg.rotate.rotate_v}')
         self.logger.flag(f'[Rotate] - Moving End')
+        self.tracer.end('move')
 
         ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-        self.monitor_running = False
-        self.current_monitor_thread.join()
+        self.stop_current_monitor()
         self.vis_current_data()
         self.logger.info(f'[Rotate] - Current Detection End')
 
         ## clip
         text_prompt=["handle with gripper grasped firmly", "handle without gripper grasped firmly"]
+        self.camera.wait_writes(self.rgb_img_path)
         clip_result,clip_text,clip_probs = self.clip.clip_detection(rgb_img=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
         clip_success = (clip_result == 0 and self.arm.get_gripper_grasp_return(if_p=False) == 2) or (clip_result == 1 and self.arm.get_gripper_grasp_return(if_p=False) != 2)
         self.logger.info(f'[Rotate] - CLIP Result - clip_success: {clip_success} text_prompt: {text_prompt} clip_result: {clip_result} clip_text: {clip_text} clip_probs: {clip_probs}')
+        self.record_detection('clip',clip_success,clip_result,clip_text,clip_probs)
         
         ## gemini
         # gemini_result,gemini_text,gemini_probs =  self.gemini.gemini_detection(img_path=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
@@ -928,7 +1072,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Rotate] - Rotate End')
         end_time = time.time()
-        self.logger.time(f'[Rotate] - Rotate Time: {end_time-start_time} s')
+        self.logger.time(f'[Rotate] - Rotate Time: {end_time-start_time} s',primitive='Rotate',stage='total',duration=end_time-start_time)
 
         print(f'========== Rotate Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -964,10 +1108,12 @@ class Primitive(object):
         ## close gripper
         # print(f'Close Gripper ...')
         self.logger.flag(f'[Open] - Gripper Closing Start')
+        self.tracer.begin('gripper')
         self.arm.control_gripper(self.cfg.open.gripper_value_pull)
         time.sleep(2)
         self.logger.info(f'[Open] - Gipper Value: {self.cfg.open.gripper_value_pull}')
         self.logger.flag(f'[Open] - Gripper Closing End')
+        self.tracer.end('gripper')
 
         ## open
         # print(f'opening ...')
@@ -978,8 +1124,7 @@ class Primitive(object):
         self.logger.flag(f'[Open] - Open End')
 
         ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-        self.monitor_running = False
-        self.current_monitor_thread.join()
+        self.stop_current_monitor()
         self.vis_current_data()
         self.logger.info(f'[Open] - Current Detection End')
 
@@ -1001,7 +1146,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Open] - Open End')
         end_time = time.time()
-        self.logger.time(f'[Open] - Open Time: {end_time-start_time} s')
+        self.logger.time(f'[Open] - Open Time: {end_time-start_time} s',primitive='Open',stage='total',duration=end_time-start_time)
         
         print(f'========== Open Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1041,22 +1186,25 @@ class Primitive(object):
         ## close gripper
         # print(f'Close Gripper ...')
         self.logger.flag(f'[Open] - Gripper Closing Start')
+        self.tracer.begin('gripper')
         self.arm.control_gripper(self.cfg.open.gripper_value_pull)
         time.sleep(2)
         self.logger.info(f'[Open] - Gipper Value: {self.cfg.open.gripper_value_pull}')
         self.logger.flag(f'[Open] - Gripper Closing End')
+        self.tracer.end('gripper')
 
         ## explore (pull)
         # print(f'exploring (pull)...')
         self.logger.flag(f'[Open] - Explore Start')
+        self.tracer.begin('explore')
         self.base.move_T(-self.cfg.open.explore_T,self.cfg.open.explore_vel)
         time.sleep(1)
         self.logger.info(f'[Open] - explore_T: {self.cfg.open.explore_T} explore_vel: {self.cfg.open.explore_vel}')
         self.logger.flag(f'[Open] - Explore End')
+        self.tracer.end('explore')
 
         ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-        self.monitor_running = False
-        self.current_monitor_thread.join()
+        self.stop_current_monitor()
         self.vis_current_data()
         self.logger.info(f'[Open] - Current Detection End')
 
@@ -1078,14 +1226,15 @@ class Primitive(object):
                     ## open (push)
                     # print(f'opening (push)...')
                     self.logger.flag(f'[Open] - Push Start')
+                    self.tracer.begin('push')
                     self.base.move_open_door(self.cfg.open.open_T,self.cfg.open.linear_velocity,self.cfg.open.angular_velocity*direction)
                     time.sleep(3)
                     self.logger.info(f'[Open] - open_T: {self.cfg.open.open_T} linear_velocity: {self.cfg.open.linear_velocity} angular_velocity: {self.cfg.open.angular_velocity}')
                     self.logger.flag(f'[Open] - Push End')
+                    self.tracer.end('push')
                     
                     ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-                    self.monitor_running = False
-                    self.current_monitor_thread.join()
+                    self.stop_current_monitor()
                     self.vis_current_data()
 
                     if self.this_pmt.ret == self.NO_ISSUE:
@@ -1110,14 +1259,15 @@ class Primitive(object):
                     ## open (pull)
                     # print(f'opening (pull)...')
                     self.logger.flag(f'[Open] - Pull Start')
+                    self.tracer.begin('pull')
                     self.base.move_open_door(self.cfg.open.open_T,-self.cfg.open.linear_velocity,-self.cfg.open.angular_velocity*direction)
                     time.sleep(3)
                     self.logger.info(f'[Open] - open_T: {self.cfg.open.open_T} linear_velocity: {self.cfg.open.linear_velocity} angular_velocity: {self.cfg.open.angular_velocity}')
                     self.logger.flag(f'[Open] - Pull End')
+                    self.tracer.end('pull')
 
                     ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-                    self.monitor_running = False
-                    self.current_monitor_thread.join()
+                    self.stop_current_monitor()
                     self.vis_current_data()
 
                     if self.this_pmt.ret == self.NO_ISSUE:
@@ -1139,9 +1289,11 @@ class Primitive(object):
 
         ## clip
         text_prompt=["handle with gripper grasped firmly", "handle without gripper grasped firmly"]
+        self.camera.wait_writes(self.rgb_img_path)
         clip_result,clip_text,clip_probs = self.clip.clip_detection(rgb_img=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
         clip_success = (clip_result == 0 and self.arm.get_gripper_grasp_return(if_p=False) == 2) or (clip_result == 1 and self.arm.get_gripper_grasp_return(if_p=False) != 2)
         self.logger.info(f'[Open] - CLIP Result - clip_success: {clip_success} text_prompt: {text_prompt} clip_result: {clip_result} clip_text: {clip_text} clip_probs: {clip_probs}')
+        self.record_detection('clip',clip_success,clip_result,clip_text,clip_probs)
         
         # ## gemini
         # gemini_result,gemini_text,gemini_probs =  self.gemini.gemini_detection(img_path=self.rgb_img_path,text_prompt=text_prompt,if_p=False)
@@ -1158,7 +1310,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Open] - Open End')
         end_time = time.time()
-        self.logger.time(f'[Open] - Open Time: {end_time-start_time} s')
+        self.logger.time(f'[Open] - Open Time: {end_time-start_time} s',primitive='Open',stage='total',duration=end_time-start_time)
         
         print(f'========== Open Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1248,8 +1400,7 @@ class Primitive(object):
         self.arm2.go_home(vel=self.cfg.swing.swing_v)
 
         ## Current Detection End (1.[safety issue] or 2.[event detected] or 3.[code runs to this line])
-        self.monitor_running = False
-        self.current_monitor_thread.join()
+        self.stop_current_monitor()
         self.vis_current_data()
         self.logger.info(f'[Swing] - Current Detection End')
 
@@ -1270,7 +1421,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Swing] -  Swing End')
         end_time = time.time()
-        self.logger.time(f'[Swing] - Swing Time: {end_time-start_time} s')
+        self.logger.time(f'[Swing] - Swing Time: {end_time-start_time} s',primitive='Swing',stage='total',duration=end_time-start_time)
 
         print(f'========== Swing Done ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1312,7 +1463,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Tele] - Tele End')
         end_time = time.time()
-        self.logger.time(f'[Tele] - Tele Time: {end_time-start_time} s')
+        self.logger.time(f'[Tele] - Tele Time: {end_time-start_time} s',primitive='Tele',stage='total',duration=end_time-start_time)
 
         print(f'========== Finish Done... ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1338,7 +1489,7 @@ class Primitive(object):
 
         self.logger.flag(f'[TeleArmL] - TeleArmL End')
         end_time = time.time()
-        self.logger.time(f'[TeleArmL] - TeleArmL Time: {end_time-start_time} s')
+        self.logger.time(f'[TeleArmL] - TeleArmL Time: {end_time-start_time} s',primitive='TeleArmL',stage='total',duration=end_time-start_time)
 
         print(f'========== TeleArmL Done... ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1364,7 +1515,7 @@ class Primitive(object):
 
         self.logger.flag(f'[TeleArmR] - TeleArmR End')
         end_time = time.time()
-        self.logger.time(f'[TeleArmR] - TeleArmR Time: {end_time-start_time} s')
+        self.logger.time(f'[TeleArmR] - TeleArmR Time: {end_time-start_time} s',primitive='TeleArmR',stage='total',duration=end_time-start_time)
 
         print(f'========== TeleArmR Done... ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1397,7 +1548,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Home] - Home End')
         end_time = time.time()
-        self.logger.time(f'[Home] - Home Time: {end_time-start_time} s')
+        self.logger.time(f'[Home] - Home Time: {end_time-start_time} s',primitive='Home',stage='total',duration=end_time-start_time)
 
         print(f'========== Home Done... ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1428,7 +1579,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Back] - Back End')
         end_time = time.time()
-        self.logger.time(f'[Back] - Back Time: {end_time-start_time} s')
+        self.logger.time(f'[Back] - Back Time: {end_time-start_time} s',primitive='Back',stage='total',duration=end_time-start_time)
 
         print(f'========== Back Done... ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1464,7 +1615,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Finish] - Finish End')
         end_time = time.time()
-        self.logger.time(f'[Finish] - Finish Time: {end_time-start_time} s')
+        self.logger.time(f'[Finish] - Finish Time: {end_time-start_time} s',primitive='Finish',stage='total',duration=end_time-start_time)
 
         print(f'========== Finish Done... ==========')
         return self.this_pmt.ret,self.this_pmt.error
@@ -1482,6 +1633,7 @@ class Primitive(object):
         self.this_pmt = _Primitive()
 
         self.primitives = {0:self.last_pmt.to_list()}
+        self.detections = {}
         
         self.current_max = [0]*7
         self.current_min = [0]*7
@@ -1489,6 +1641,9 @@ class Primitive(object):
         if os.path.exists(self.tjt_dir):
              shutil.rmtree(self.tjt_dir)
         os.makedirs(self.tjt_dir)
+        self.logger.reopen() # the log files were in tjt_dir
+        self.tracer.open(f'{self.tjt_dir}/trace.jsonl',tjt_num=self.tjt_num,type=self.type)
+        self.save_meta()
 
         ret = 1
         error = "CLEAR"
@@ -1498,7 +1653,7 @@ class Primitive(object):
 
         self.logger.flag(f'[Clear] - Clear End')
         end_time = time.time()
-        self.logger.time(f'[Clear] - Clear Time: {end_time-start_time} s')
+        self.logger.time(f'[Clear] - Clear Time: {end_time-start_time} s',primitive='Clear',stage='total',duration=end_time-start_time)
 
         print(f'========== Clear Done... ==========')
         return ret,error
@@ -1506,6 +1661,7 @@ class Primitive(object):
     @time_it
     def hl_VLM(self):
         img_path = f'{self.tjt_dir}/temp.png'
+        self.camera.wait_writes(img_path)
         last_pmt_action = self.last_pmt.action
         last_pmt_error = self.last_pmt.error
         hl_prompt = gen_hl_prompt(last_pmt_action,last_pmt_error)
@@ -1517,6 +1673,7 @@ class Primitive(object):
     @time_it
     def ll_VLM(self):
         img_path = f'{self.tjt_dir}/temp.png'
+        self.camera.wait_writes(img_path)
         # response = self.gemini.text_img_to_text(text=ll_prompt,img_path=img_path,if_p=False)
 
         example_param1 = [-42.79, 9.61, 94.04]
@@ -19,7 +19,7 @@ class RANSAC():
         normal = plane_detector(rgb_img_path,d_img_path,self.config_file_path,self.camera_info_file_path,self.vis)
         return normal
 
-    def get_normal_server(self,rgb_img_path,d_img_path,server,remote_python_path,remote_root_dir,remote_img_dir):
+    def get_normal_server(self,rgb_img_path,d_img_path,server,remote_python_path,remote_root_dir,remote_img_dir,client=None,seed_xy=None):
         local_rgb_img_path = rgb_img_path
         remote_rgb_img_path = f'{remote_img_dir}/{os.path.basename(local_rgb_img_path)}'
         local_d_img_path = d_img_path
@@ -36,10 +36,16 @@ class RANSAC():
         server.transfer_file_local2remote(local_config_file_path,remote_config_file_path)
         server.transfer_file_local2remote(local_camera_info_file_path,remote_camera_info_file_path)
 
-        # ransac
+        # ransac (perception daemon: the detector is already built on the server and the result comes back in the response)
+        if client is not None:
+            data = client.ransac(remote_rgb_img_path,remote_d_img_path,remote_config_file_path,remote_camera_info_file_path,seed_xy=seed_xy)
+            return data['normal'],data['weights'],data['3d_center'],data['2d_center'],data['mask_color']
+
         remote_ransac_script_dir = f'{remote_root_dir}/ransac_package/'
         remote_ransac_script_path = f'plane_detector.py'
         ransac_cmd = f'cd {remote_ransac_script_dir}; {remote_python_path} {remote_ransac_script_path} -rgb {remote_rgb_img_path} -d {remote_d_img_path} -cfg {remote_config_file_path} -camera {remote_camera_info_file_path}'
+        if seed_xy is not None:
+            ransac_cmd += f' -seed {seed_xy[0]} {seed_xy[1]}'
         server.exec_cmd(ransac_cmd)
 
         # transfer the output dir to the server
@@ -55,5 +61,23 @@ class RANSAC():
             mask_color = data['mask_color']
         return normal,weights,_3d_center,_2d_center,mask_color
 
+    def read_cfg_text(self):
+        # the cfg files are sent with the request in payload mode, so the server doesn't need them on its disk
+        with open(self.config_file_path,'r') as f:
+            cfg_text = f.read()
+        with open(self.camera_info_file_path,'r') as f:
+            cam_text = f.read()
+        return cfg_text,cam_text
+
+    def get_normal_payload(self,rgb_img,d_img,client,vis_dir=None,seed_xy=None):
+        '''
+        rgb_img: BGR array, d_img: uint16 depth array, sent to the perception server in the request together with the cfg files (no sftp)
+        vis_dir: remote dir for ransac_result.json and plane.png, None to skip them
+        seed_xy: (x,y) pixel on the door (e.g. handle center) for the guided sampling (RANSAC_config.guided)
+        '''
+        cfg_text,cam_text = self.read_cfg_text()
+        data = client.ransac_payload(rgb_img,d_img,cfg_text,cam_text,vis_dir=vis_dir,seed_xy=seed_xy)
+        return data['normal'],data['weights'],data['3d_center'],data['2d_center'],data['mask_color']
+
 if __name__ == "__main__":  
     ransac = RANSAC(cfg_ransac='cfg/cfg_ransac.yaml',cfg_cam='cfg/cfg_cam.yaml',vis=False)
\ No newline at end of file
@@ -2,43 +2,55 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import open3d
 import cv2
 import matplotlib.pyplot as plt
 import copy
 import argparse
 import os
 import json
-
-from utils.lib_io import read_yaml_file
-from utils.lib_ransac import PlaneModel, RansacPlane
-from utils.lib_geo_trans import world2pixel
-from utils_rgbd.lib_rgbd import CameraInfo, resize_color_and_depth
-from utils_rgbd.lib_open3d import wrap_open3d_point_cloud_with_my_functions
-from utils_rgbd.lib_plot_rgbd import drawMaskFrom2dPoints, draw3dArrowOnImage
-wrap_open3d_point_cloud_with_my_functions()
+import time
+
+try: # imported as `ransac_package.plane_detector` (e.g. by ransac.py or perception_server.py)
+    from .utils.lib_io import read_yaml_file
+    from .utils.lib_ransac import PlaneModel, RansacPlane, RansacPlaneBatch
+    from .utils.lib_geo_trans import world2pixel
+    from .utils_rgbd.lib_rgbd import CameraInfo, resize_color_and_depth, create_point_cloud_from_depth
+    from .utils_rgbd.lib_plot_rgbd import draw3dArrowOnImage
+except ImportError: # run as a script inside ransac_package/
+    from utils.lib_io import read_yaml_file
+    from utils.lib_ransac import PlaneModel, RansacPlane, RansacPlaneBatch
+    from utils.lib_geo_trans import world2pixel
+    from utils_rgbd.lib_rgbd import CameraInfo, resize_color_and_depth, create_point_cloud_from_depth
+    from utils_rgbd.lib_plot_rgbd import draw3dArrowOnImage
+# open3d is only imported by the open3d point cloud backend and the debug 3d drawing (see `_import_open3d`).
 
 MAX_OF_MAX_PLANE_NUMBERS = 5
 
 
-def subtract_points(points, indices_to_subtract):
-    ''' Subtract points by indices and return a new sub cloud. '''
-    all_indices = np.arange(len(points))
-    rest_indices = np.setdiff1d(all_indices, indices_to_subtract)
-    points = points[rest_indices]
-    return points
+def _import_open3d():
+    ''' Import open3d and add my functions to its point cloud class. '''
+    import open3d
+    try:
+        from .utils_rgbd.lib_open3d import wrap_open3d_point_cloud_with_my_functions
+    except ImportError:
+        from utils_rgbd.lib_open3d import wrap_open3d_point_cloud_with_my_functions
+    wrap_open3d_point_cloud_with_my_functions()
+    return open3d
 
 
 class PlaneParam(object):
     ''' The parameters of the detected plane are stored in this class. '''
 
     def __init__(
-            self, w, pts_3d_center, normal_vector, pts_2d_center, mask_color):
+            self, w, pts_3d_center, normal_vector, pts_2d_center, mask_color,
+            ransac_time=None, ransac_iterations=None):
         self.w = w
         self.pts_3d_center = pts_3d_center
         self.normal_vector = normal_vector
         self.pts_2d_center = pts_2d_center
         self.mask_color = mask_color
+        self.ransac_time = ransac_time
+        self.ransac_iterations = ransac_iterations
 
     def resize_2d_params(self, ratio):
         self.pts_2d_center *= ratio
@@ -52,14 +64,21 @@ class PlaneParam(object):
         print("     3d center: {}".format(self.pts_3d_center))
         print("     2d center: {}".format(self.pts_2d_center))
         print("     mask color: {}".format(self.mask_color))
+        print("     ransac: {} iterations, {} s".format(self.ransac_iterations, self.ransac_time))
     
-    def save_plane_params(self,save_path=''):
+    def to_dict(self):
         data = {'weights': self.w.tolist(),
                 'normal': self.normal_vector.tolist(),
                 '3d_center': self.pts_3d_center.tolist(),
                 '2d_center': self.pts_2d_center.tolist(),
-                'mask_color': self.mask_color.tolist()
+                'mask_color': self.mask_color.tolist(),
+                'ransac_time': self.ransac_time,
+                'ransac_iterations': self.ransac_iterations
                 }
+        return data
+
+    def save_plane_params(self,save_path=''):
+        data = self.to_dict()
         with open(save_path, 'w') as json_file:
             json.dump(data, json_file,indent=4)
         print("Saved plane parameters to {}".format(save_path))
@@ -87,7 +106,7 @@ class PlaneDetector(object):
         # -- Visualization settings.
         self._cmap = plt.get_cmap(self._cfg.visualization["color_map_name"])
 
-    def detect_planes(self, depth_img, color_img=None):
+    def detect_planes(self, depth_img, color_img=None, seed_xy=None, roi_mask=None):
         '''
         Arguments:
             depth_img {np.ndarry, np.uint16}:
@@ -95,6 +114,14 @@ class PlaneDetector(object):
             color_img {None} or {np.ndarry, np.uint8, bgr, undistorted}:
                 Color image is only for visualiation purpose.
                 If None, color_img will be created as a black image.
+            seed_xy {None} or {(x, y)}: pixel (in the original image) to guide the sampling of RANSAC,
+                e.g. the handle center, which lies on the door plane.
+                Only used when RANSAC_config.guided is True.
+            roi_mask {None} or {np.ndarray, bool}: same size as depth_img,
+                only the pixels in the mask are turned into points (e.g. the door region).
+        Return:
+            list_plane_params, planes_mask, planes_img_viz,
+            pcd {open3d.geometry.PointCloud} or {None}: None with the numpy point cloud backend.
         '''
 
         # -- Check input.
@@ -108,51 +135,95 @@ class PlaneDetector(object):
         color_img_resized, depth_img_resized = resize_color_and_depth(
             color_img, depth_img, self._cfg.img_resize_ratio)
 
+        if roi_mask is not None:
+            roi_mask = cv2.resize(
+                roi_mask.astype(np.uint8), dsize=self._shape_resized[::-1],
+                interpolation=cv2.INTER_NEAREST) > 0
+
         # -- Compute point cloud.
-        pcd = self._create_point_cloud(color_img_resized, depth_img_resized)
-        if self._cfg.debug["draw_3d_point_cloud"]:
-            pcd.draw()
-        points = pcd.get_xyzs()
+        if self._use_numpy_point_cloud():
+            # Only xyz is needed by RANSAC, so skip the open3d images and colors.
+            points, pixel_indices = create_point_cloud_from_depth(
+                depth_img_resized, self._cam_intrin_resized,
+                self._cfg.depth_unit, self._cfg.depth_trunc, roi_mask)
+            pcd = None
+            if self._cfg.debug["draw_3d_point_cloud"]:
+                open3d = _import_open3d()
+                pcd = open3d.geometry.PointCloud()
+                pcd.points = open3d.utility.Vector3dVector(points.astype(np.float64))
+                pcd.draw()
+        else:
+            if roi_mask is not None:
+                depth_img_resized = depth_img_resized * roi_mask.astype(depth_img_resized.dtype)
+            pcd = self._create_point_cloud(color_img_resized, depth_img_resized)
+            if self._cfg.debug["draw_3d_point_cloud"]:
+                pcd.draw()
+            points = pcd.get_xyzs()
+            pixel_indices = self._project_to_pixel_indices(points)
         # points.shape=(N, 3). Each row is a point's 3d position of (x, y, z).
+        # pixel_indices.shape=(N, ). Row-major pixel index (resized image) of each point.
 
         # -- Detect plane one by one until there is no plane.
+        # One point buffer for all the planes (float32 for the vectorized RANSAC, converted once):
+        #   labels[j] is the plane of the jth point (-1: no plane yet), each plane only keeps the indices of its points,
+        #   and RANSAC gets the indices of the remaining points instead of a copy of them
+        #   (only the non-vectorized RansacPlane still gathers them for every plane).
+        if self._cfg.RANSAC_config.get("vectorized", False):
+            ransac_points = np.ascontiguousarray(points, dtype=np.float32)
+        else:
+            ransac_points = points
+        labels = np.full(len(points), -1, dtype=np.int32)
+        rest_indices = np.arange(len(points))
         planes = []
         for i in range(self._cfg.max_number_of_planes):
             print("-------------------------")
             print("Start detecting {}th plane ...".format(i))
 
-            # Detect plane by RANSAC.
-            is_succeed, plane_weights, plane_pts_indices = \
-                self._detect_plane_by_RANSAC(points)
+            # Detect plane by RANSAC on the points which are not in a plane yet.
+            t0 = time.time()
+            indices = None if i == 0 else rest_indices
+            sample_order = self._get_sample_order(seed_xy, pixel_indices, indices)
+            is_succeed, plane_weights, plane_pts_indices, n_iter = \
+                self._detect_plane_by_RANSAC(ransac_points, sample_order, indices)
             if not is_succeed:
                 break
 
             # Store plane result.
-            plane_points = points[plane_pts_indices]
-            planes.append(self._Plane(plane_weights, plane_points))
+            plane_indices = rest_indices[plane_pts_indices]
+            labels[plane_indices] = i
+            planes.append(self._Plane(
+                plane_weights, plane_indices, time.time() - t0, n_iter))
 
-            # Use the remaining point cloud to detect next plane.
-            points = subtract_points(points, plane_pts_indices)
+            # Use the remaining points to detect next plane.
+            rest_indices = rest_indices[labels[rest_indices] < 0]
         print("-------------------------")
         print("Plane detection completes. Detect {} planes.".format(len(planes)))
 
         # -- Process planes to obtain desired plane parameters.
         list_plane_params, planes_mask, planes_img_viz = \
-            self._compute_planes_info(planes, color_img)
+            self._compute_planes_info(planes, color_img, points, pixel_indices)
 
         # -- Return.
         return list_plane_params, planes_mask, planes_img_viz, pcd
 
     class _Plane(object):
-        def __init__(self, plane_weights, plane_points):
+        def __init__(self, plane_weights, plane_indices, ransac_time=None, ransac_iterations=None):
             self.weights = plane_weights
-            self.points = plane_points
+            self.indices = plane_indices  # Indices of the plane's points in the point cloud.
+            self.ransac_time = ransac_time
+            self.ransac_iterations = ransac_iterations
+
+    def _use_numpy_point_cloud(self):
+        ''' numpy back-projection, unless open3d is required by the config (or the voxel downsampling). '''
+        return getattr(self._cfg, "point_cloud_backend", "open3d") == "numpy" \
+            and self._cfg.cloud_downsample_voxel_size <= 0
 
     def _create_point_cloud(self, color_img_resized, depth_img_resized):
         ''' Create point cloud from color and depth image.
         Return:
             pcd {open3d.geometry.PointCloud}
         '''
+        open3d = _import_open3d()
 
         # rgbd_image = open3d.create_rgbd_image_from_color_and_depth( # for old version
         rgbd_image = open3d.geometry.RGBDImage.create_from_color_and_depth( # for new version
@@ -177,21 +248,74 @@ class PlaneDetector(object):
 
         return pcd
 
-    def _detect_plane_by_RANSAC(self, points):
+    def is_guided(self):
+        ''' Whether RANSAC uses the seed pixel given to detect_planes. '''
+        cfg = self._cfg.RANSAC_config
+        return cfg.get("vectorized", False) and cfg.get("guided", False)
+
+    def _project_to_pixel_indices(self, points):
+        ''' Row-major pixel indices (resized image) of the points, -1 if out of the image.
+        Only for the open3d point cloud, the numpy one keeps the pixel of each point.
+        '''
+        rows, cols = self._shape_resized[:2]
+        pts_2d_resized = world2pixel(
+            points,
+            T_cam_to_world=np.identity(4),
+            camera_intrinsics=self._cam_intrin_resized.intrinsic_matrix(type="matrix"))
+        xs, ys = np.rint(pts_2d_resized).astype(np.int64)
+        valid = (0 <= xs) & (xs < cols) & (0 <= ys) & (ys < rows)
+        return np.where(valid, ys * cols + xs, -1)
+
+    def _pixel_indices_to_xy(self, pixel_indices):
+        ''' Row-major pixel indices --> (N, 2) pixel positions (x, y) in the resized image. '''
+        cols = self._shape_resized[1]
+        return np.stack((pixel_indices % cols, pixel_indices // cols), axis=1)
+
+    def _get_sample_order(self, seed_xy, pixel_indices, indices=None):
+        ''' Point indices sorted by the pixel distance to seed_xy, for the guided sampling of RANSAC.
+        indices: only these points, the order is then of positions in indices.
+        Return:
+            None if there is no seed or the guided sampling is disabled.
+        '''
+        if seed_xy is None or not self.is_guided():
+            return None
+        if indices is not None:
+            pixel_indices = pixel_indices[indices]
+        if len(pixel_indices) == 0:
+            return None
+        pts_2d_resized = self._pixel_indices_to_xy(pixel_indices)
+        seed_resized = np.array(seed_xy, dtype=np.float32) * self._cfg.img_resize_ratio
+        dists = np.linalg.norm(pts_2d_resized - seed_resized, axis=1)
+        return np.argsort(dists, kind="stable")
+
+    def _detect_plane_by_RANSAC(self, points, sample_order=None, indices=None):
         ''' Use RANSAC to detect plane from point pcd.
         The plane weights(parameters) w means:
             w[0] + w[1]*x + w[2]*y + w[3]*z = 0
         Arguments:
             points {np.ndarray}: (N, 3).
+            sample_order {None} or {np.ndarray}: point indices sorted by priority (guided sampling).
+            indices {None} or {np.ndarray}: only these points, sample_order and the returned indices are positions in it.
         Return:
             is_succeed {bool}: Is plane detected successfully.
-
+            n_iter {int}: Number of RANSAC iterations.
         '''
-        FAILURE_RETURN = False, None, None
+        FAILURE_RETURN = False, None, None, None
         cfg = self._cfg.RANSAC_config
 
-        print("\nRANSAC starts: Source points = {}".format(len(points)))
-        ransac = RansacPlane()
+        print("\nRANSAC starts: Source points = {}".format(len(points) if indices is None else len(indices)))
+        # vectorized: all hypotheses are scored at once (RansacPlaneBatch), so hundreds of iterations are cheap.
+        #   confidence: adaptive number of iterations, guided: sample around the seed pixel first.
+        if cfg.get("vectorized", False):
+            ransac = RansacPlaneBatch()
+            kwargs = {"confidence": cfg.get("confidence", None),
+                      "sample_order": sample_order,
+                      "indices": indices}
+        else:
+            ransac = RansacPlane()
+            kwargs = {}
+            if indices is not None:
+                points = points[indices]
         is_succeed, plane_weights, plane_pts_indices = ransac.fit(
             points,
             model=PlaneModel(),
@@ -200,7 +324,9 @@ class PlaneDetector(object):
             max_iter=cfg["iterations"],
             dist_thresh=cfg["dist_thresh"],
             is_print_res=cfg["is_print_res"],
+            **kwargs
         )
+        n_iter = getattr(ransac, "n_iter", cfg["iterations"])
 
         if not is_succeed:
             print("RANSAC Failed.")
@@ -212,12 +338,15 @@ class PlaneDetector(object):
         #       which means that the norm's z component should be negative.
         if plane_weights[-1] > 0:
             plane_weights *= -1
-        return is_succeed, plane_weights, plane_pts_indices
+        return is_succeed, plane_weights, plane_pts_indices, n_iter
 
-    def _compute_planes_info(self, planes, color_img):
+    def _compute_planes_info(self, planes, color_img, points, pixel_indices):
         '''
         Arguments:
             planes {list of `class _Plane`}
+            points {np.ndarray}: (N, 3), the point cloud which `plane.indices` refer to.
+            pixel_indices {np.ndarray}: (N, ), row-major pixel index (resized image) of each point.
+                The masks are drawn from them directly, the points are not projected again.
         Returns:
             list_plane_params {list of `class PlaneParam`}
             planes_mask {image}: Mask of the detected planes.
@@ -231,8 +360,6 @@ class PlaneDetector(object):
         shape, shape_resized = self._shape, self._shape_resized
 
         intrin_mat = self._cam_intrin.intrinsic_matrix(type="matrix")
-        intrin_mat_resized = self._cam_intrin_resized.intrinsic_matrix(
-            type="matrix")  # For the resized smaller image.
         resize_ratio = self._cfg.img_resize_ratio
         cfg_viz = self._cfg.visualization
 
@@ -244,20 +371,19 @@ class PlaneDetector(object):
 
         # -- Process each plane.
         for i, plane in enumerate(planes):
-            w, pts_3d = plane.weights, plane.points
+            w, pts_3d = plane.weights, points[plane.indices]
 
-            # Project 3d points to 2d by using
-            # the resized intrinsics,
+            # The pixels (of the resized image) of the plane's points,
             # so the created mask is small, and costs less time.
-            pts_2d_resized = world2pixel(
-                pts_3d,
-                T_cam_to_world=np.identity(4),
-                camera_intrinsics=intrin_mat_resized).T
-            mask_resized = drawMaskFrom2dPoints(
-                pts_2d_resized,
-                shape_resized[:2],
-                dilation_kernel_size=3,
-                dilation_times=1)
+            plane_pixel_indices = pixel_indices[plane.indices]
+            plane_pixel_indices = plane_pixel_indices[plane_pixel_indices >= 0]
+            pts_2d_resized = self._pixel_indices_to_xy(plane_pixel_indices)
+            mask_resized = np.zeros(shape_resized[0] * shape_resized[1], np.uint8)
+            mask_resized[plane_pixel_indices] = 255
+            mask_resized = cv2.dilate(
+                src=mask_resized.reshape(shape_resized[:2]),
+                kernel=np.ones((3, 3), np.uint8),
+                iterations=1)
             mask_resized = mask_resized > 0
             color = self._get_ith_color(i)
             merged_masks[mask_resized] = color
@@ -270,7 +396,8 @@ class PlaneDetector(object):
             pts_3d_center = np.mean(pts_3d, axis=0)
             pts_2d_center = np.mean(pts_2d_resized, axis=0) / resize_ratio
             plane_param = PlaneParam(
-                w, pts_3d_center, normal_vector, pts_2d_center, color)
+                w, pts_3d_center, normal_vector, pts_2d_center, color,
+                plane.ransac_time, plane.ransac_iterations)
             list_plane_params.append(plane_param)
 
             # -- Draw arrow on `planes_img_viz`.
@@ -329,23 +456,24 @@ def calc_opposite_point(p0, p1, length=5.0, to_int=True):
     return (x2, y2)
 
 
-def plane_detector(rgb_img_path='images/rgb_img.png',d_img_path='images/d_img.png',config_file_path="config/plane_detector_config_ours.yaml",camera_info_file_path="config/cam_params_realsense_ours.json",vis=False):
-    # -- Read color image and depth images
-    image_dir = os.path.dirname(rgb_img_path)+'/ransac'
-    rgb_img = cv2.imread(rgb_img_path)
+def plane_detector_array(rgb_img, d_img, detector, image_dir=None, vis=False, seed_xy=None, roi_mask=None):
+    '''
+    rgb_img: np.uint8 BGR array (as read by cv2), d_img: np.uint16 depth array.
+    ransac_result.json and plane.png are only written when image_dir is given.
+    seed_xy: (x, y) pixel on the door (e.g. the handle center) for the guided sampling, None for uniform sampling.
+    roi_mask: bool array (same size as d_img), only detect planes in this region, None for the whole image.
+    '''
     rgb_img = cv2.cvtColor(rgb_img, cv2.COLOR_BGR2RGB)
-    d_img = cv2.imread(d_img_path, cv2.IMREAD_UNCHANGED)
-
-    # -- create a detector
-    detector = PlaneDetector(config_file_path, camera_info_file_path)
 
     # -- Detect planes.
     list_plane_params, planes_mask, planes_img_viz, pcd = detector.detect_planes(
-        d_img, rgb_img)
+        d_img, rgb_img, seed_xy=seed_xy, roi_mask=roi_mask)
 
     # -- Print result. (set the max_number_of_planes=1 in config file before)
     for i, plane_param in enumerate(list_plane_params):
         plane_param.print_params(index=i+1)
+        if image_dir is None:
+            continue
         plane_param.save_plane_params(save_path=f'{image_dir}/ransac_result.json')
 
     # -- Plot result.
@@ -357,8 +485,26 @@ def plane_detector(rgb_img_path='images/rgb_img.png',d_img_path='images/d_img.pn
         plt.imshow(planes_img_viz)
         plt.title("Planes normals.")
         plt.savefig(f'{image_dir}/plane.png')
+        if not vis:
+            plt.close()
     if vis:
         plt.show()
+    return list_plane_params
+
+def plane_detector(rgb_img_path='images/rgb_img.png',d_img_path='images/d_img.png',config_file_path="config/plane_detector_config_ours.yaml",camera_info_file_path="config/cam_params_realsense_ours.json",vis=False,detector=None,return_result=False,seed_xy=None):
+    # -- Read color image and depth images
+    image_dir = os.path.dirname(rgb_img_path)+'/ransac'
+    if not os.path.exists(image_dir):
+        os.makedirs(image_dir)
+    rgb_img = cv2.imread(rgb_img_path)
+    d_img = cv2.imread(d_img_path, cv2.IMREAD_UNCHANGED)
+
+    # -- create a detector (a detector can be passed in by a long-lived process, e.g. perception_server.py)
+    if detector is None:
+        detector = PlaneDetector(config_file_path, camera_info_file_path)
+
+    # -- Detect planes.
+    list_plane_params = plane_detector_array(rgb_img, d_img, detector, image_dir=image_dir, vis=vis, seed_xy=seed_xy)
     
     ## 3d show
     # for i, plane_param in enumerate(list_plane_params):
@@ -377,6 +523,8 @@ def plane_detector(rgb_img_path='images/rgb_img.png',d_img_path='images/d_img.pn
     #     vis.run()
     #     vis.destroy_window()
 
+    if return_result:
+        return list_plane_params[0].to_dict()
     normal = list_plane_params[0].normal_vector.tolist()
     return normal
 
@@ -385,7 +533,8 @@ def main(args):
                    d_img_path=args.d_img_path,
                    config_file_path = args.config_file_path,
                    camera_info_file_path = args.camera_info_file_path,
-                   vis=args.vis)
+                   vis=args.vis,
+                   seed_xy=args.seed_xy)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -394,4 +543,5 @@ if __name__ == '__main__':
     parser.add_argument("-cfg","--config_file_path",default="config/plane_detector_config_ours.yaml")
     parser.add_argument("-camera","--camera_info_file_path",default="config/cam_params_realsense_ours.json")
     parser.add_argument("-v","--vis",default=False,action='store_true',help="if vis.")
+    parser.add_argument("-seed","--seed_xy",nargs=2,type=float,default=None,help="Pixel (x y) on the door to guide the RANSAC sampling, e.g. the handle center.")
     main(parser.parse_args())
\ No newline at end of file
@@ -41,7 +41,7 @@ class PlaneModel(object):
         X = points
         X_mean = np.mean(X, axis=0)  # Squash each column to compute mean.
         Xc = X - X_mean[np.newaxis, :]
-        U, S, W = np.linalg.svd(Xc)
+        U, S, W = np.linalg.svd(Xc, full_matrices=False)  # U is not needed, skip the NxN matrix.
         plane_normal = W[-1, :]
 
         '''
@@ -188,3 +188,188 @@ class RansacPlane(object):
         maybe_error = model.get_error(maybe_data, maybe_w)
         all_error = model.get_error(data, maybe_w)
         return maybe_w, maybe_error, all_error
+
+
+class RansacPlaneBatch(object):
+    ''' Vectorized version of RansacPlane.
+    All the minimal sets (3 points) are sampled at once and their planes are computed in closed form (cross product).
+    The inliers of all hypotheses are counted with one matrix product per chunk,
+    and only the best hypothesis is refined with PlaneModel.fit_plane.
+    Optional:
+        confidence: adaptive RANSAC, hypotheses are scored round by round and the required number of
+            iterations is updated from the best inlier ratio so far, stop as soon as it is reached.
+        sample_order: guided sampling (PROSAC-like), points sorted by priority (e.g. distance to the handle).
+            The first hypotheses are sampled from the top points, the pool grows to all the points at max_iter.
+        indices: fit on these points of the cloud only (e.g. the ones not in a plane yet), without copying them out:
+            only the sampled triplets and one block of points at a time are gathered.
+    '''
+    _POINTS_PER_BLOCK = 2**16  # Points gathered at once by the distance computations with indices.
+
+    def __init__(self, max_elements_per_chunk=2**23, seed=None):
+        # max_elements_per_chunk: bounds the (N points x hypotheses) distance matrix of one chunk.
+        self._max_elements_per_chunk = max_elements_per_chunk
+        self._rng = np.random.default_rng(seed)
+        self.n_iter = 0  # Number of hypotheses scored by the last fit.
+
+    def fit(self,
+            points,  # 3xN or Nx3 points of xyz positions.
+            model,  # The PlaneModel, used to refine the best hypothesis.
+            n_pts_fit_model,  # Kept for the same interface as RansacPlane. A plane hypothesis uses 3 points.
+            n_min_pts_inlier,  # Min number of points for a valid plane.
+            max_iter,  # Max number of hypotheses.
+            dist_thresh,  # A point is considered as inlier if its distance to the plane is smaller than this.
+            is_print_iter=False,
+            is_print_res=True,  # Print final results.
+            confidence=None,  # e.g. 0.999. None: score all max_iter hypotheses.
+            round_size=32,  # Hypotheses per round in the adaptive mode.
+            sample_order=None,  # 1D array, point indices sorted by priority. None: uniform sampling.
+            indices=None,  # 1D array, the points of the cloud to fit on. None: all the points.
+            ):
+        '''
+        Return:
+            is_succeed {bool}
+            best_w {1D array, size=4}: weight of the detected plane.
+                Plane model: w[0] + w[1]*x + w[2]*y + w[3]*z = 0.
+            best_res_inliers {1D array}: Indices of the points in the source point cloud
+                which are part of the detected plane (positions in indices if indices is given).
+        With indices, sample_order and best_res_inliers are positions in indices.
+        '''
+        FAILURE_RETURN = False, None, None
+        self.n_iter = 0
+
+        # -- Check input
+        if points.shape[1] != 3:  # shape: (3, N) --> (N, 3)
+            points = points.T
+        N = len(points) if indices is None else len(indices)  # Number of data points.
+        if N < n_min_pts_inlier:
+            return FAILURE_RETURN
+
+        # -- Init variables
+        t0 = time.time()  # Timer
+        points_f32 = np.ascontiguousarray(points, dtype=np.float32)  # No copy for a float32 cloud.
+        to_cloud = (lambda idxs: idxs) if indices is None else (lambda idxs: indices[idxs])  # Positions -> cloud indices.
+        if confidence is None:
+            round_size = max_iter
+        required_iter = max_iter
+        best_w, best_n_inliers = None, -1
+
+        # -- Step 1 & 2: Sample minimal sets, compute their planes and count their inliers, round by round.
+        while self.n_iter < min(required_iter, max_iter):
+            n = min(round_size, max_iter - self.n_iter)
+            idxs = self._sample_indices(N, n, self.n_iter, max_iter, n_min_pts_inlier, sample_order)
+            self.n_iter += n
+            W = self._compute_planes(points_f32, to_cloud(idxs))
+            if len(W) == 0:
+                continue
+            n_inliers = self._count_inliers(points_f32, W, dist_thresh, indices)
+            i = int(np.argmax(n_inliers))
+            if n_inliers[i] > best_n_inliers:
+                best_w, best_n_inliers = W[i], n_inliers[i]
+            if confidence is not None and best_w is not None:
+                if sample_order is None:
+                    inlier_ratio = best_n_inliers / N
+                else:  # Inlier ratio of the current sampling pool, which is what the next round draws from.
+                    pool = sample_order[:self._pool_size(N, self.n_iter, max_iter, n_min_pts_inlier)]
+                    inlier_ratio = np.count_nonzero(
+                        np.abs(points_f32[to_cloud(pool)].dot(best_w[1:]) + best_w[0]) < dist_thresh) / len(pool)
+                required_iter = self.required_iterations(inlier_ratio, confidence)
+            if is_print_iter:
+                print("Iter {}: best number of inliers = {}, required iterations = {}".format(
+                    self.n_iter, best_n_inliers, required_iter))
+        if best_n_inliers < n_min_pts_inlier:
+            return FAILURE_RETURN
+
+        # -- Step 3: Refine the best hypothesis with (part of) its inliers, same as RansacPlane.
+        all_error = self._get_distances(points_f32, best_w, indices)
+        also_idxs = np.flatnonzero(all_error < dist_thresh)
+        self._rng.shuffle(also_idxs)
+        also_idxs = also_idxs[:n_min_pts_inlier]
+        best_w = model.fit_plane(points[to_cloud(also_idxs)])
+        if indices is None:
+            all_error = model.get_error(points, best_w)
+        else:
+            all_error = self._get_distances(points, best_w, indices) / np.linalg.norm(best_w[1:])
+        best_res_inliers = np.flatnonzero(all_error < dist_thresh)
+        if len(best_res_inliers) < n_min_pts_inlier:
+            return FAILURE_RETURN
+
+        # -- Print time cost.
+        if is_print_res:
+            print("RANSAC (batch) performance report:")
+            print("    Source data points = {}".format(N))
+            print("    Inlier data points = {}".format(len(best_res_inliers)))
+            print("    Iterations = {}".format(self.n_iter))
+            print("    Time cost = {:.3} seconds".format(time.time()-t0))
+            print("    Plane model: w[0] + w[1]*x + w[2]*y + w[3]*z = 0")
+            print("    Weights: w = {}".format(best_w))
+
+        # -- Return result.
+        return True, best_w, best_res_inliers
+
+    @staticmethod
+    def required_iterations(inlier_ratio, confidence, n_sample=3):
+        ''' Number of iterations to draw at least one all-inlier minimal set with the given confidence. '''
+        p_good = inlier_ratio ** n_sample
+        if p_good >= 1.0:
+            return 1
+        if p_good <= 0.0:
+            return np.inf
+        return int(np.ceil(np.log(1.0 - confidence) / np.log(1.0 - p_good)))
+
+    def _sample_indices(self, N, n, i_start, max_iter, n_min_pool, sample_order=None):
+        ''' Indices of n point triplets, shape=(n, 3).
+        With sample_order, the kth hypothesis is sampled from the first
+            n_min_pool + (N - n_min_pool) * k / max_iter points of sample_order.
+        '''
+        if sample_order is None:
+            return self._rng.integers(0, N, size=(n, 3))
+        pool = self._pool_size(N, np.arange(i_start, i_start + n), max_iter, n_min_pool)
+        ranks = (self._rng.random((n, 3)) * pool[:, np.newaxis]).astype(np.int64)
+        return sample_order[ranks]
+
+    @staticmethod
+    def _pool_size(N, k, max_iter, n_min_pool):
+        ''' Number of top points of sample_order used by the kth hypothesis. '''
+        n_min_pool = min(max(n_min_pool, 3), N)
+        return np.minimum(n_min_pool + (N - n_min_pool) * (k + 1) // max_iter, N)
+
+    def _compute_planes(self, points, idxs):
+        ''' Planes through the point triplets idxs.
+        Return:
+            W: shape=(M, 4), M <= len(idxs). Degenerate (collinear) triplets are dropped.
+                Each row is a plane with unit normal: w[0] + w[1]*x + w[2]*y + w[3]*z = 0
+        '''
+        p0, p1, p2 = points[idxs[:, 0]], points[idxs[:, 1]], points[idxs[:, 2]]
+        normals = np.cross(p1 - p0, p2 - p0)
+        norms = np.linalg.norm(normals, axis=1)
+        valid = norms > 1e-9
+        normals = normals[valid] / norms[valid, np.newaxis]
+        w0 = -np.einsum('ij,ij->i', normals, p0[valid])
+        return np.hstack((w0[:, np.newaxis], normals)).astype(np.float32)
+
+    def _count_inliers(self, points, W, dist_thresh, indices=None):
+        ''' Number of inliers of each plane in W, computed block of points by block of points
+        (indices: only these points, one block gathered at a time).
+        Return:
+            n_inliers: shape=(M, )
+        '''
+        N = len(points) if indices is None else len(indices)
+        block = max(1, self._max_elements_per_chunk // max(len(W), 1))
+        n_inliers = np.zeros(len(W), dtype=np.int64)
+        for j in range(0, N, block):
+            pts = points[j:j+block] if indices is None else points[indices[j:j+block]]
+            dists = np.abs(pts.dot(W[:, 1:].T) + W[:, 0])  # (block, M)
+            n_inliers += np.count_nonzero(dists < dist_thresh, axis=0)
+        return n_inliers
+
+    def _get_distances(self, points, w, indices=None):
+        ''' |w[0] + w[1]*x + w[2]*y + w[3]*z| of the points (indices: only these points, gathered block by block).
+        Return:
+            dists: shape=(N, )
+        '''
+        if indices is None:
+            return np.abs(points.dot(w[1:]) + w[0])
+        dists = np.empty(len(indices), dtype=np.result_type(points.dtype, w.dtype))
+        for j in range(0, len(indices), self._POINTS_PER_BLOCK):
+            dists[j:j+self._POINTS_PER_BLOCK] = np.abs(points[indices[j:j+self._POINTS_PER_BLOCK]].dot(w[1:]) + w[0])
+        return dists
@@ -15,8 +15,12 @@ if True:  # Add project root
     ROOT = os.path.dirname(os.path.abspath(__file__))+'/../'
     sys.path.append(ROOT)
 
-    from utils.lib_geo_trans import xyz_to_T, rot3x3_to_4x4, rot, rotx, roty, rotz
-    from utils.lib_geo_trans import world2pixel, world2cam, cam2pixel
+    try: # imported as part of `ransac_package`
+        from ..utils.lib_geo_trans import xyz_to_T, rot3x3_to_4x4, rot, rotx, roty, rotz
+        from ..utils.lib_geo_trans import world2pixel, world2cam, cam2pixel
+    except ImportError:
+        from utils.lib_geo_trans import xyz_to_T, rot3x3_to_4x4, rot, rotx, roty, rotz
+        from utils.lib_geo_trans import world2pixel, world2cam, cam2pixel
 
 
 def to_ints(values):
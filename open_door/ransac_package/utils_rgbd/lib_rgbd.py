@@ -5,13 +5,12 @@
 
 Functions:
     create_open3d_point_cloud_from_rgbd
-    create_point_cloud_from_rgbd
+    create_point_cloud_from_depth
 '''
 import sys
 import os
 import numpy as np
 import cv2
-import open3d
 import simplejson
 import yaml
 
@@ -80,6 +79,7 @@ class CameraInfo():
         ''' Convert camera info to open3d format of `class open3d.camera.PinholeCameraIntrinsic`.
         Reference: http://www.open3d.org/docs/release/python_api/open3d.camera.PinholeCameraIntrinsic.html
         '''
+        import open3d
         row, col, fx, fy, cx, cy = self.get_cam_params()
         open3d_camera_info = open3d.camera.PinholeCameraIntrinsic(
             col, row, fx, fy, cx, cy)
@@ -108,6 +108,7 @@ def create_open3d_point_cloud_from_rgbd(
             See: http://www.open3d.org/docs/release/python_api/open3d.geometry.PointCloud.html
     Reference:
     '''
+    import open3d
 
     # Create `open3d.geometry.RGBDImage` from color_img and depth_img.
     # http://www.open3d.org/docs/0.7.0/python_api/open3d.geometry.create_rgbd_image_from_color_and_depth.html#open3d.geometry.create_rgbd_image_from_color_and_depth
@@ -131,6 +132,68 @@ def create_open3d_point_cloud_from_rgbd(
     return open3d_point_cloud
 
 
+_RAY_GRIDS = {}  # Cache of get_ray_grid, key: (rows, cols, fx, fy, cx, cy).
+
+
+def get_ray_grid(cam_info):
+    ''' The ray (x/z, y/z) of each pixel, row-major.
+    It only depends on the (resized) intrinsics, so it is computed once and cached.
+    Return:
+        rays {np.ndarray, np.float32}: (rows*cols, 2).
+    '''
+    row, col, fx, fy, cx, cy = cam_info.get_cam_params()
+    key = (row, col, fx, fy, cx, cy)
+    if key not in _RAY_GRIDS:
+        rays = np.empty((row * col, 2), dtype=np.float32)
+        rays[:, 0] = np.tile((np.arange(col, dtype=np.float32) - cx) / fx, row)
+        rays[:, 1] = np.repeat((np.arange(row, dtype=np.float32) - cy) / fy, col)
+        _RAY_GRIDS[key] = rays
+    return _RAY_GRIDS[key]
+
+
+def create_point_cloud_from_depth(
+        depth_img,
+        cam_info,
+        depth_unit=0.001,
+        depth_trunc=3.0,
+        roi_mask=None):
+    ''' Back-project a depth image into 3D points with numpy.
+    The points are the same as the open3d point cloud created from the rgbd image,
+        but no color is computed and open3d is not needed.
+    Arguments:
+        depth_img {np.ndarry, np.uint16}:
+            Undistorted depth image, its size matches cam_info.
+        cam_info {CameraInfo}
+        depth_unit {float}:
+            if depth_img[i, j] is x, then the real depth is x*depth_unit meters.
+        depth_trunc {float}:
+            Pixels with depth larger than ${depth_trunc} meters are dropped.
+        roi_mask {None} or {np.ndarray, bool}:
+            Same size as depth_img. Only the pixels in the mask are back-projected.
+    Output:
+        points {np.ndarray, np.float32}: (N, 3). Each row is (x, y, z) in the camera frame.
+        pixel_indices {np.ndarray, np.int64}: (N, ).
+            Row-major index of the pixel each point comes from: row = index // cols, col = index % cols.
+    '''
+    rays = get_ray_grid(cam_info)
+    if depth_img.size != len(rays):
+        raise RuntimeError("The depth image size doesn't match the camera info.")
+
+    # -- Depth in meters, then keep (0, depth_trunc] (and the ROI).
+    depths = depth_img.ravel().astype(np.float32) * np.float32(depth_unit)
+    valid = (depths > 0) & (depths <= depth_trunc)
+    if roi_mask is not None:
+        valid &= roi_mask.ravel().astype(bool)
+    pixel_indices = np.flatnonzero(valid)
+
+    # -- Scale the rays by depth.
+    depths = depths[pixel_indices]
+    points = np.empty((len(pixel_indices), 3), dtype=np.float32)
+    points[:, :2] = rays[pixel_indices] * depths[:, np.newaxis]
+    points[:, 2] = depths
+    return points, pixel_indices
+
+
 def read_json_file(file_path):
     with open(file_path, 'r') as f:
         data = simplejson.load(f)
@@ -0,0 +1,15 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-12 10:05:31
+Version: v1
+File:
+Brief: the tests import the modules as the scripts do, from open_door/
+       usage: cd open_door && python -m pytest -q tests (the tests of modules whose dependencies are missing are skipped)
+'''
+import os
+import sys
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
@@ -0,0 +1,36 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-12 10:20:05
+Version: v1
+File:
+Brief: round trips of the payload encoding of the perception server (utils/lib_codec.py)
+'''
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+pytest.importorskip('PIL')
+from utils.lib_codec import mask_to_rle, rle_to_mask, encode_image, decode_image
+
+@pytest.mark.parametrize('mask', [
+    np.zeros((4, 5), dtype=bool),
+    np.ones((4, 5), dtype=bool),
+    np.eye(6, dtype=bool),
+    np.random.default_rng(0).random((48, 64)) > 0.5,
+])
+def test_rle_round_trip(mask):
+    rle = json.loads(json.dumps(mask_to_rle(mask))) # as sent in the json payload
+    assert rle['size'] == list(mask.shape)
+    assert sum(rle['counts']) == mask.size
+    decoded = rle_to_mask(rle)
+    assert decoded.dtype == bool
+    np.testing.assert_array_equal(decoded, mask)
+
+def test_image_round_trip():
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, (32, 40, 3), dtype=np.uint8)
+    depth = rng.integers(0, 65536, (32, 40), dtype=np.uint16)
+    np.testing.assert_array_equal(decode_image(encode_image(rgb)), rgb)
+    np.testing.assert_array_equal(decode_image(encode_image(depth)), depth)
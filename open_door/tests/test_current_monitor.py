@@ -0,0 +1,60 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-12 10:44:52
+Version: v1
+File:
+Brief: current monitor (current_monitor.py) with a fake get_c() instead of the arm
+'''
+import time
+import threading
+import numpy as np
+
+from current_monitor import CurrentMonitor, NUM_JOINTS
+
+SAFETY = [[-10, 10]]*NUM_JOINTS
+EVENT = [[-5, 5]]*NUM_JOINTS
+
+def test_check():
+    monitor = CurrentMonitor(rate=100, buffer_size=10)
+    monitor.safety_lows, monitor.safety_highs = monitor.to_bands(SAFETY)
+    monitor.event_lows, monitor.event_highs = monitor.to_bands(EVENT[:2]) # no event band for joints 2-6
+    currents = np.zeros((4, NUM_JOINTS))
+    currents[1, 0] = 6 # event
+    currents[2, 6] = -11 # safety
+    currents[3, 6] = 6 # outside the event band of joint 0, but joint 6 has none
+    assert monitor.check(currents).tolist() == [1, 0, -1, 1]
+    assert monitor.check(currents[2]) == CurrentMonitor.SAFETY_ISSUE
+
+def test_event_stops_session():
+    values = iter([0.0]*5 + [6.0] + [0.0]*1000)
+    issues, stops = [], []
+    monitor = CurrentMonitor(rate=1000, buffer_size=4)
+    monitor.start(lambda: [next(values)]*NUM_JOINTS, SAFETY, EVENT, on_issue=lambda *issue: issues.append(issue), on_stop=lambda: stops.append(1))
+    monitor.thread.join(2)
+    result = monitor.stop()
+    assert result[0] == CurrentMonitor.EVENT_DETECTED and result[1][0] == 6.0
+    assert len(issues) == 1 and stops == [1]
+    data = monitor.get_data() # ring buffer of 4: the last 4 of the 6 samples, in time order
+    assert data.shape == (4, 1+NUM_JOINTS)
+    assert data[-1, 1] == 6.0 and np.all(np.diff(data[:, 0]) >= 0)
+
+def test_stop_does_not_wait_for_get_c():
+    release = threading.Event()
+    def get_current():
+        release.wait(2) # an arm slow to answer
+        return [6.0]*NUM_JOINTS # an event, but of a stopped session
+    issues = []
+    monitor = CurrentMonitor(rate=200, buffer_size=100, stop_timeout=0.05)
+    monitor.start(get_current, SAFETY, EVENT, on_issue=lambda *issue: issues.append(issue))
+    time.sleep(0.02)
+    start_time = time.perf_counter()
+    assert monitor.stop() is None
+    assert time.perf_counter() - start_time < 0.01 # flag only
+    start_time = time.perf_counter()
+    monitor.start(lambda: [0.0]*NUM_JOINTS, SAFETY, EVENT) # waits stop_timeout at most for the hung get_c()
+    assert time.perf_counter() - start_time < 0.5
+    release.set()
+    time.sleep(0.05)
+    assert monitor.stop() is None and issues == [] # the late sample of the first session is dropped
+    assert np.all(monitor.get_data()[:, 1:] == 0)
@@ -0,0 +1,50 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-12 10:12:48
+Version: v1
+File:
+Brief: dmp_discrete.rollout (one lfilter per dimension) against the step() loop it replaced, on a fixed demo
+'''
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+pytest.importorskip('matplotlib')
+from dmp_package.dmp_discrete import dmp_discrete
+
+def get_dmp(data_len=300):
+    t = np.linspace(0, 1.5*np.pi, data_len)
+    y_demo = np.stack([np.sin(t), np.cos(t), 0.5*t])
+    dmp = dmp_discrete(n_dmps=y_demo.shape[0], n_bfs=100, dt=1.0/data_len)
+    dmp.learning(y_demo)
+    return dmp
+
+def reproduce_loop(dmp, initial, goal, tau=None):
+    ''' the old reproduce(): step() timesteps times '''
+    timesteps = dmp.timesteps if tau is None else round(dmp.timesteps/tau)
+    dmp.y0, dmp.goal = np.array(initial, dtype=float), np.array(goal, dtype=float)
+    dmp.reset_state()
+    y, dy, ddy = np.zeros((3, timesteps, dmp.n_dmps))
+    for t in range(timesteps):
+        y[t], dy[t], ddy[t] = [v.copy() for v in dmp.step(tau=tau)]
+    return y, dy, ddy
+
+@pytest.mark.parametrize('tau', [None, 2.0])
+def test_rollout_matches_step_loop(tau):
+    dmp = get_dmp()
+    initial, goal = [0.1, 0.9, 0.0], [-1.2, 0.3, 2.0]
+    expected = reproduce_loop(dmp, initial, goal, tau)
+    result = dmp.reproduce(tau=tau, initial=initial, goal=goal)
+    for e, r in zip(expected, result):
+        np.testing.assert_allclose(r, e, rtol=1e-7, atol=1e-7)
+    np.testing.assert_allclose(dmp.y, expected[0][-1], atol=1e-7) # state left as step() leaves it
+
+def test_reproduce_batch_matches_reproduce():
+    dmp = get_dmp()
+    initials = [[0.1, 0.9, 0.0], [0.0, 1.0, 0.2]]
+    goals = [[-1.2, 0.3, 2.0], [-0.8, -0.2, 2.5]]
+    y_batch, _, _ = dmp.reproduce_batch(initials, goals)
+    for k in range(len(goals)):
+        y, _, _ = dmp.reproduce(initial=initials[k], goal=goals[k])
+        np.testing.assert_allclose(y_batch[k], y, atol=1e-9)
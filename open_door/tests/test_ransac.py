@@ -0,0 +1,61 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-12 10:58:36
+Version: v1
+File:
+Brief: RansacPlaneBatch (ransac_package/utils/lib_ransac.py) on a noisy plane with outliers
+'''
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+from ransac_package.utils.lib_ransac import PlaneModel, RansacPlaneBatch
+
+def get_points(n_plane=2000, n_outliers=500, seed=0):
+    ''' plane z = 0.2x - 0.1y + 1 (+-1 mm) and uniform outliers '''
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(-0.5, 0.5, (n_plane, 2))
+    z = 0.2*xy[:, 0] - 0.1*xy[:, 1] + 1 + rng.uniform(-0.001, 0.001, n_plane)
+    outliers = rng.uniform([-0.5, -0.5, 0.5], [0.5, 0.5, 1.5], (n_outliers, 3))
+    return np.vstack([np.column_stack([xy, z]), outliers])
+
+def test_fit_plane():
+    points = get_points()
+    is_succeed, w, inliers = RansacPlaneBatch(seed=0).fit(points, PlaneModel(), 3, 1000, 200, 0.005, is_print_res=False)
+    assert is_succeed
+    normal = w[1:]/np.linalg.norm(w[1:])
+    expected = np.array([0.2, -0.1, -1])/np.linalg.norm([0.2, -0.1, -1])
+    assert abs(abs(normal.dot(expected)) - 1) < 1e-4
+    assert np.count_nonzero(inliers < 2000) >= 1990
+    assert np.count_nonzero(inliers >= 2000) < 50
+
+def test_too_few_points():
+    assert RansacPlaneBatch(seed=0).fit(get_points(50, 0), PlaneModel(), 3, 100, 50, 0.005, is_print_res=False) == (False, None, None)
+
+def test_adaptive_stops_early():
+    ''' confidence: the iterations stop as soon as the best inlier ratio makes them enough '''
+    points = get_points()
+    ransac = RansacPlaneBatch(seed=0)
+    is_succeed, w, inliers = ransac.fit(points, PlaneModel(), 3, 1000, 5000, 0.005, is_print_res=False, confidence=0.999)
+    assert is_succeed and np.count_nonzero(inliers < 2000) >= 1990
+    assert ransac.n_iter < 5000
+
+def test_guided_sampling():
+    ''' sample_order: the plane points first, found with few hypotheses '''
+    points = get_points()
+    ransac = RansacPlaneBatch(seed=0)
+    is_succeed, w, inliers = ransac.fit(points, PlaneModel(), 3, 1000, 500, 0.005, is_print_res=False, confidence=0.999, sample_order=np.arange(len(points)))
+    assert is_succeed and np.count_nonzero(inliers < 2000) >= 1990
+    assert RansacPlaneBatch.required_iterations(1.0, 0.999) == 1
+    assert RansacPlaneBatch.required_iterations(0.5, 0.99) == 35
+
+def test_indices_same_as_copy():
+    ''' fit on indices of the cloud (remaining points of detect_planes) = fit on a copy of these points '''
+    points = get_points()
+    rest = np.sort(np.random.default_rng(1).choice(len(points), 1800, replace=False))
+    expected = RansacPlaneBatch(seed=3).fit(points[rest], PlaneModel(), 3, 500, 200, 0.005, is_print_res=False, confidence=0.999)
+    ransac = RansacPlaneBatch(max_elements_per_chunk=5000, seed=3) # several blocks of points
+    result = ransac.fit(points, PlaneModel(), 3, 500, 200, 0.005, is_print_res=False, confidence=0.999, indices=rest)
+    np.testing.assert_allclose(result[1], expected[1], atol=1e-6)
+    np.testing.assert_array_equal(result[2], expected[2])
@@ -0,0 +1,69 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-12 10:31:17
+Version: v1
+File:
+Brief: a trajectory folder as Primitive writes it, ingested into the trajectory db and read back (utils/lib_tjt_db.py)
+'''
+import os
+import json
+import pytest
+
+from utils.lib_tjt_db import TrajectoryDB
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+def write_trajectory(tjt_dir, type='lever'):
+    os.makedirs(tjt_dir)
+    write_json(os.path.join(tjt_dir, 'meta.json'), {'tjt_num': 7, 'type': type, 'start_time': 1.0})
+    actions = [('START', 0, 1, None, 'NO_ISSUE', {}),
+               ('GRASP', 1, 1, [0.1, 0.2], 'NO_ISSUE', {'clip': {'success': True, 'result': 1, 'text': 'grasped', 'probs': [0.1, 0.9]}}),
+               ('UNLOCK', 2, -1, None, 'SAFETY_ISSUE', {'gemini': {'success': False, 'result': 0, 'text': 'locked', 'probs': []}})]
+    for action_num, (action, id, ret, param, error, detections) in enumerate(actions):
+        write_json(os.path.join(tjt_dir, f'{action_num}.json'), {'this_action': action, 'this_id': id, 'this_ret': ret, 'this_param': param, 'this_error': error, 'detections': detections})
+    spans = [{'i': 1, 'p': 0, 'n': 'grasp', 'c': 'primitive', 'ts': 0, 'd': 3000000, 't': 1, 'a': {'action_num': 1}},
+             {'i': 2, 'p': 1, 'n': 'DTSAM', 'c': 'stage', 'ts': 0, 'd': 500000, 't': 1, 'a': {}}]
+    with open(os.path.join(tjt_dir, 'trace.jsonl'), 'w') as f:
+        f.write('\n'.join(json.dumps(span) for span in spans) + '\n')
+
+@pytest.fixture
+def db(tmp_path):
+    db = TrajectoryDB(str(tmp_path / 'trajectory.db'))
+    yield db
+    db.close()
+
+def test_ingest_round_trip(tmp_path, db):
+    root = tmp_path / 'trajectory'
+    write_trajectory(str(root / 'tjt_007'))
+    assert db.ingest(str(root), if_p=False) == 1
+
+    assert db.conn.execute('SELECT tjt_num, type, num_actions FROM trajectories').fetchall() == [(7, 'lever', 3)]
+    assert db.conn.execute('SELECT action_num, action, ret, success FROM actions ORDER BY action_num').fetchall() == [(0, 'START', 1, 1), (1, 'GRASP', 1, 1), (2, 'UNLOCK', -1, 0)]
+    assert sorted(db.conn.execute('SELECT primitive, detector, success FROM detections').fetchall()) == [('GRASP', 'clip', 1), ('UNLOCK', 'gemini', 0)]
+    assert sorted(db.conn.execute('SELECT action_num, primitive, stage, duration, source FROM timings').fetchall()) == [(1, 'GRASP', 'DTSAM', 0.5, 'trace'), (1, 'GRASP', 'total', 3.0, 'trace')]
+
+    columns, rows = db.query('success', type='lever')
+    assert columns == ['type', 'action', 'total', 'success', 'rate']
+    assert rows == [('lever', 'GRASP', 1, 1, 100.0), ('lever', 'UNLOCK', 1, 0, 0.0)]
+    assert db.query('success', type='drawer')[1] == []
+
+def test_ingest_only_changed_and_prune(tmp_path, db):
+    root = tmp_path / 'trajectory'
+    write_trajectory(str(root / 'tjt_001'))
+    write_trajectory(str(root / 'tjt_002'), type='drawer')
+    assert db.ingest(str(root), if_p=False) == 2
+    assert db.ingest(str(root), if_p=False) == 0 # nothing changed
+
+    write_json(str(root / 'tjt_002' / 'meta.json'), {'tjt_num': 2, 'type': 'knob'})
+    assert db.ingest(str(root), if_p=False) == 1
+    assert db.conn.execute("SELECT type FROM trajectories WHERE tjt_num = 2").fetchall() == [('knob',)]
+
+    for f in os.listdir(root / 'tjt_001'):
+        os.remove(root / 'tjt_001' / f)
+    os.rmdir(root / 'tjt_001')
+    db.ingest(str(root), if_p=False)
+    assert db.conn.execute('SELECT COUNT(*) FROM trajectories').fetchone()[0] == 1
+    assert db.conn.execute('SELECT COUNT(*) FROM actions').fetchone()[0] == 3
@@ -0,0 +1,56 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-08-05 16:40:11
+Version: v1
+File:
+Brief: encode/decode images and masks so they can be sent to the perception server in a json payload
+'''
+import base64
+import numpy as np
+import cv2
+from PIL import Image
+
+def encode_image(img,ext='.png'):
+    '''
+    img: np.ndarray in cv2 order (BGR / uint16 depth) or PIL.Image (RGB)
+    return: base64 string of the encoded image (png is lossless, also for uint16 depth)
+    '''
+    if isinstance(img,Image.Image):
+        img = np.array(img.convert('RGB'))[:,:,::-1]
+    ok,buf = cv2.imencode(ext,img)
+    if not ok:
+        raise ValueError(f'failed to encode image with {ext}')
+    return base64.b64encode(buf.tobytes()).decode('ascii')
+
+def decode_image(data,flags=cv2.IMREAD_UNCHANGED):
+    '''
+    data: base64 string from encode_image
+    return: np.ndarray in cv2 order (BGR / uint16 depth)
+    '''
+    buf = np.frombuffer(base64.b64decode(data),dtype=np.uint8)
+    img = cv2.imdecode(buf,flags)
+    if img is None:
+        raise ValueError('failed to decode image')
+    return img
+
+def mask_to_rle(mask):
+    '''
+    mask: (h,w) bool array
+    return: {'size':[h,w],'counts':[...]}, run lengths of the row-major flattened mask, starting with a run of False
+    '''
+    mask = np.asarray(mask,dtype=bool)
+    h,w = mask.shape
+    flat = np.concatenate([[False],mask.ravel(),[False]])
+    changes = np.flatnonzero(flat[1:] != flat[:-1])
+    runs = np.diff(np.concatenate([[0],changes,[h*w]]))
+    if len(runs) > 1 and runs[-1] == 0: # mask ends with a run of True
+        runs = runs[:-1]
+    return {'size':[int(h),int(w)],'counts':runs.astype(int).tolist()}
+
+def rle_to_mask(rle):
+    h,w = rle['size']
+    counts = np.asarray(rle['counts'],dtype=np.int64)
+    values = np.arange(len(counts)) % 2 == 1 # runs alternate False,True,False,...
+    mask = np.repeat(values,counts)
+    return mask.reshape(h,w)
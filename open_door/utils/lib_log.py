@@ -3,12 +3,19 @@ Author: TX-Leo
 Mail: tx.leo.wz@gmail.com
 Date: 2024-07-27 15:40:25
 Version: v1
-File: 
-Brief: 
+File:
+Brief: logger of the primitive runs
+       the calls only put the record on a queue, a QueueListener thread writes it with persistent handlers:
+       {log_path} (human log, rotated at midnight), the console, and {log_path}.jsonl (one json per record: time, level, kind, primitive, stage, message, duration, values)
+       primitive, stage and duration are passed by the caller, the other keyword arguments are kept as values,
+       e.g. logger.time(f'[Grasp] - GUM Time - {t} s', primitive='Grasp', stage='GUM', duration=t)
 '''
 import os
+import json
+import queue
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 import sys
 root_dir = '../'
@@ -16,76 +23,130 @@ sys.path.append(root_dir)
 
 from utils.lib_io import *
 
+KINDS = {'info': 'INFO', 'time': 'TIME', 'flag': 'FLAG'} # prefix of the message in the human log
+
+def to_jsonable(value):
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+class JsonlFormatter(logging.Formatter):
+    def format(self, record):
+        duration = getattr(record, 'duration', None)
+        item = {'time': record.created,
+                'asctime': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+                'level': record.levelname,
+                'kind': getattr(record, 'kind', record.levelname),
+                'primitive': getattr(record, 'primitive', None),
+                'stage': getattr(record, 'stage', None),
+                'message': getattr(record, 'raw_message', record.getMessage()),
+                'duration': float(duration) if duration is not None else None,
+                'values': getattr(record, 'values', {}),
+        }
+        return json.dumps(item, default=to_jsonable)
+
 class Logger(object):
     def __init__(self,log_path='./log'):
-        mkfile(log_path)
-        # self.log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '%s' % log_path)
-        self.log_path = log_path
-        self.logger = logging.getLogger(__name__)
+        self.logger = logging.getLogger(f'{__name__}.{id(self)}') # one per Logger, the handlers are not shared
         self.logger.setLevel(logging.DEBUG)
         self.logger.propagate = False
         self.formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', '%Y-%m-%d %H:%M:%S')
-    
+        self.queue = queue.SimpleQueue()
+        self.logger.addHandler(QueueHandler(self.queue))
+        self.handlers = []
+        self.listener = None
+        self._log_path = None
+        self.log_path = log_path
+        atexit.register(self.close)
+
     @classmethod
     def init_from_yaml(cls,cfg_path='cfg/cfg_logger.yaml'):
         cfg = read_yaml_file(cfg_path, is_convert_dict_to_class=True)
         return cls(cfg.log_path)
-    
-    def console(self, level, message):
-        # Create a TimedRotatingFileHandler for writing to local files
+
+    @property
+    def log_path(self):
+        return self._log_path
+
+    @log_path.setter
+    def log_path(self, log_path):
+        self._log_path = log_path
+        self.reopen()
+
+    def get_handlers(self):
+        # TimedRotatingFileHandler for writing to local files
         fh = TimedRotatingFileHandler(self.log_path, when='MIDNIGHT', interval=1, encoding='utf-8')
         fh.suffix = '%Y-%m-%d.log'
         fh.setLevel(logging.DEBUG)
         fh.setFormatter(self.formatter)
-        self.logger.addHandler(fh)
 
-        # Create a StreamHandler for output to the console
+        # StreamHandler for output to the console
         ch = logging.StreamHandler()
         ch.setLevel(logging.DEBUG)
         ch.setFormatter(self.formatter)
-        self.logger.addHandler(ch)
 
+        # FileHandler for the machine-readable stream
+        jh = logging.FileHandler(f'{self.log_path}.jsonl', encoding='utf-8')
+        jh.setLevel(logging.DEBUG)
+        jh.setFormatter(JsonlFormatter())
+        return [fh, ch, jh]
+
+    def reopen(self):
+        '''
+        (re)create the handlers at log_path, after log_path changed or its folder was removed
+        the records already queued are written to the old files first
+        '''
+        self.close()
+        mkfile(self.log_path)
+        self.handlers = self.get_handlers()
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def close(self):
+        ''' write everything queued and close the files '''
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            handler.close()
+        self.handlers = []
+
+    def console(self, level, message, primitive=None, stage=None, duration=None, **values):
+        extra = {'kind': KINDS.get(level, level.upper().rstrip('_')), 'raw_message': message, 'values': values,
+                 'primitive': primitive, 'stage': stage, 'duration': duration}
         if level == 'info':
-            self.logger.info(f"INFO - {message}") 
+            self.logger.info(f"INFO - {message}", extra=extra)
         elif level == 'debug':
-            self.logger.debug(message)
+            self.logger.debug(message, extra=extra)
         elif level == 'warning':
-            self.logger.warning(message)
+            self.logger.warning(message, extra=extra)
         elif level == 'error':
-            self.logger.error(message)  # Do not display error stack
+            self.logger.error(message, extra=extra)  # Do not display error stack
         elif level == 'error_':
-            self.logger.error(message, exc_info=1) # Display error stack
+            self.logger.error(message, exc_info=1, extra=extra) # Display error stack
         elif level == 'time':
-            self.logger.info(f"TIME - {message}") 
+            self.logger.info(f"TIME - {message}", extra=extra)
         elif level == 'flag':
-            self.logger.info(f"FLAG - {message}") 
-
-        # To avoid duplicate log output
-        self.logger.removeHandler(ch)
-        self.logger.removeHandler(fh)
+            self.logger.info(f"FLAG - {message}", extra=extra)
 
-        fh.close()
+    def debug(self, message, **values):
+        self.console('debug', message, **values)
 
-    def debug(self, message):
-        self.console('debug', message)
+    def info(self, message, **values):
+        self.console('info', message, **values)
 
-    def info(self, message):
-        self.console('info', message)
+    def warning(self, message, **values):
+        self.console('warning', message, **values)
 
-    def warning(self, message):
-        self.console('warning', message)
+    def error(self, message, **values):
+        self.console('error', message, **values)
 
-    def error(self, message):
-        self.console('error', message)
+    def error_(self, message, **values):
+        self.console('error_', message, **values)
 
-    def error_(self, message):
-        self.console('error_', message)
+    def time(self, message, **values):
+        self.console('time', message, **values)
 
-    def time(self, message):
-        self.console('time', message)
-    
-    def flag(self, message):
-        self.console('flag', message)
+    def flag(self, message, **values):
+        self.console('flag', message, **values)
 
 if __name__ == '__main__':
     logger = Logger.init_from_yaml(cfg_path='cfg/cfg_logger.yaml')
@@ -93,3 +154,4 @@ if __name__ == '__main__':
     logger.warning(f'Set_Joint_Speed:{1+1}')
     logger.error(f'Set_Joint_Speed:{1+1}')
     logger.error_(f'Set_Joint_Speed:{1+1}')
+    logger.time(f'[Grasp] - GUM Time - {0.5} s', primitive='Grasp', stage='GUM', duration=0.5)
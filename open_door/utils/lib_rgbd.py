@@ -30,6 +30,22 @@ def rotate_point(x1_2d,y1_2d,R,orientation='horizontal',angle=90):
         y2_2d += Oy
         return x2_2d,y2_2d,Ox,Oy
 
+def rotate_points(x1_2d,y1_2d,R,orientation,angle=90):
+    '''
+    rotate_point for arrays (N), orientation: array of 'horizontal'/'vertical'
+    '''
+    x1_2d,y1_2d,R = np.asarray(x1_2d,dtype=np.float64),np.asarray(y1_2d,dtype=np.float64),np.asarray(R,dtype=np.float64)
+    is_horizontal = np.asarray(orientation) == 'horizontal'
+    Ox = np.where(is_horizontal,x1_2d+R,x1_2d)
+    Oy = np.where(is_horizontal,y1_2d,y1_2d+R)
+    angle_rad = np.full(x1_2d.shape,np.radians(angle))
+    angle_rad = np.where((is_horizontal & (R > 0)) | (~is_horizontal & (R < 0)),-angle_rad,angle_rad)
+    x1_2d = x1_2d - Ox
+    y1_2d = y1_2d - Oy
+    x2_2d = x1_2d * np.cos(angle_rad) - y1_2d * np.sin(angle_rad) + Ox
+    y2_2d = x1_2d * np.sin(angle_rad) + y1_2d * np.cos(angle_rad) + Oy
+    return x2_2d,y2_2d,Ox,Oy
+
 def add_point_to_image(img, x, y, dot_size=1, dot_color=(255, 0, 0),save_path=None):
     if isinstance(img,str):
         image = Image.open(img).convert("RGB")
@@ -47,6 +63,17 @@ def add_point_to_image(img, x, y, dot_size=1, dot_color=(255, 0, 0),save_path=No
     if save_path:
         image.save(save_path)
 
+def mask2center_image(mask, Cx, Cy, dot_size=5, save_path=None):
+    '''
+    rebuild dtsam/center.png (the gum mask input) from a bool mask: white mask on black with a red dot at the mask center
+    '''
+    image = Image.fromarray(np.where(mask > 0, 255, 0).astype(np.uint8)).convert("RGB")
+    add_point_to_image(image, x=Cx, y=Cy, dot_size=dot_size, dot_color=(255,0,0))
+    if save_path:
+        mkfile(save_path)
+        image.save(save_path)
+    return image
+
 def vis_grasp(img_path, dx, dy, x1, y1, x2, y2, Ox, Oy, R, orientation='horizontal', angle=90, save_path=None, show=False):
     # pattern
     dot_size=5
@@ -188,8 +215,11 @@ def vis_d_color(d_img_path,save_path,show=False):
         plt.show()
 
 def crop_image(img_path, center_x, center_y, new_w, new_h, save_path=None):
-    # Open the image
-    image = Image.open(img_path)
+    # Open the image (path or PIL image)
+    if isinstance(img_path,str):
+        image = Image.open(img_path)
+    else:
+        image = img_path
     
     # Get the width and height of the image
     img_width, img_height = image.size
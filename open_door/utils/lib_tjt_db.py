@@ -0,0 +1,252 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-08 20:41:12
+Version: v1
+File:
+Brief: sqlite index of the trajectory folders (trajectory/tjt_*/), instead of scanning every text log for each table
+       ingested per trajectory: meta.json (handle type), {n}.json of every action (ret, error, clip/gemini detections), primitives.json,
+       trace.jsonl (stage timings, lib_trace.py), and the text logs only for the runs recorded before these files existed
+       a trajectory is re-ingested only when one of its files changed (size / mtime), so re-running the ingest on a growing trajectory/ is cheap
+       usage: python lib_tjt_db.py -i ../trajectory -q success
+              python lib_tjt_db.py -q latency -type lever
+              python lib_tjt_db.py -q errors / detections
+'''
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+
+SUCCESS = 1 # errors.success of cfg.yaml
+DB_NAME = 'trajectory.db'
+TRAJECTORY_FILES = re.compile(r'^(\d+\.json|primitives\.json|meta\.json|trace\.jsonl|log.*)$')
+ACTION_FILE = re.compile(r'^(\d+)\.json$')
+LOG_TAG = re.compile(r'\[(.*?)\]')
+LOG_TIME = re.compile(r'TIME - \[(?P<primitive>[^\]]+)\]\s*-\s*(?P<stage>.+?)(?:\s+-\s|:)\s*(?P<duration>-?\d+(?:\.\d+)?(?:[eE]-?\d+)?)\s*s\b')
+LOG_DETECTION = re.compile(r'(?P<detector>CLIP|gemini) Result - (?:clip|gemini)_success:\s*(?P<success>True|False)')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS trajectories (path TEXT PRIMARY KEY, tjt_num INTEGER, type TEXT, start_time REAL, num_actions INTEGER, fingerprint TEXT, ingested_time REAL);
+CREATE TABLE IF NOT EXISTS actions (path TEXT, action_num INTEGER, action TEXT, id INTEGER, ret INTEGER, param TEXT, error TEXT, success INTEGER, PRIMARY KEY (path, action_num));
+CREATE TABLE IF NOT EXISTS detections (path TEXT, action_num INTEGER, primitive TEXT, detector TEXT, success INTEGER, result INTEGER, probs TEXT);
+CREATE TABLE IF NOT EXISTS timings (path TEXT, action_num INTEGER, primitive TEXT, stage TEXT, duration REAL, source TEXT);
+CREATE INDEX IF NOT EXISTS actions_action ON actions (action);
+CREATE INDEX IF NOT EXISTS detections_path ON detections (path);
+CREATE INDEX IF NOT EXISTS timings_path ON timings (path);
+CREATE INDEX IF NOT EXISTS trajectories_type ON trajectories (type);
+'''
+
+QUERIES = {
+    'success': '''SELECT t.type, a.action, COUNT(*) AS total, SUM(a.success) AS success, ROUND(100.0*SUM(a.success)/COUNT(*), 1) AS rate
+                  FROM actions a JOIN trajectories t ON a.path = t.path
+                  WHERE a.action NOT IN ('START', 'CLEAR') {where} GROUP BY t.type, a.action ORDER BY t.type, a.action''',
+    'latency': '''SELECT t.type, s.primitive, s.stage, COUNT(*) AS num, ROUND(AVG(s.duration), 3) AS mean, ROUND(MIN(s.duration), 3) AS min, ROUND(MAX(s.duration), 3) AS max
+                  FROM timings s JOIN trajectories t ON s.path = t.path
+                  WHERE 1 {where} GROUP BY t.type, s.primitive, s.stage ORDER BY t.type, s.primitive, mean DESC''',
+    'errors': '''SELECT t.type, a.action, a.error, COUNT(*) AS num
+                 FROM actions a JOIN trajectories t ON a.path = t.path
+                 WHERE a.success = 0 AND a.action NOT IN ('START', 'CLEAR') {where} GROUP BY t.type, a.action, a.error ORDER BY t.type, a.action, num DESC''',
+    'detections': '''SELECT t.type, d.primitive, d.detector, COUNT(*) AS total, SUM(d.success) AS success, ROUND(100.0*SUM(d.success)/COUNT(*), 1) AS rate
+                     FROM detections d JOIN trajectories t ON d.path = t.path
+                     WHERE 1 {where} GROUP BY t.type, d.primitive, d.detector ORDER BY t.type, d.primitive, d.detector''',
+}
+
+def read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError: # written while we read it
+        return default
+
+def get_fingerprint(tjt_dir):
+    ''' names, sizes and mtimes of the files of the trajectory (not the image folders) '''
+    entries = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in os.scandir(tjt_dir) if entry.is_file() and TRAJECTORY_FILES.match(entry.name))
+    return hashlib.sha1(json.dumps(entries).encode()).hexdigest()
+
+def find_trajectories(root):
+    ''' folders with {n}.json / primitives.json / meta.json, not looking inside them '''
+    tjt_dirs = []
+    for dir, dirs, files in os.walk(root):
+        if any(ACTION_FILE.match(f) or f in ['primitives.json', 'meta.json'] for f in files):
+            tjt_dirs.append(dir)
+            dirs[:] = []
+        else:
+            dirs.sort()
+    return tjt_dirs
+
+def load_actions(tjt_dir):
+    '''
+    return: {action_num: (action, id, ret, param, error)}, {action_num: detections}
+    '''
+    actions, detections = {}, {}
+    primitives = read_json(os.path.join(tjt_dir, 'primitives.json'), {})
+    for action_num, (action, id, ret, param, error) in primitives.items():
+        actions[int(action_num)] = (action, id, ret, param, error)
+    for f in os.listdir(tjt_dir):
+        match = ACTION_FILE.match(f)
+        if not match:
+            continue
+        data = read_json(os.path.join(tjt_dir, f))
+        if not data:
+            continue
+        action_num = int(match.group(1))
+        actions[action_num] = (data['this_action'], data['this_id'], data['this_ret'], data['this_param'], data['this_error'])
+        if data.get('detections'):
+            detections[action_num] = data['detections']
+    return actions, detections
+
+def load_trace_timings(trace_path):
+    '''
+    return: [(action_num, primitive, stage, duration)], stages under their primitive span, 'total' for the primitive span itself
+    '''
+    spans = {}
+    with open(trace_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                spans[span['i']] = span
+    timings = []
+    for span in spans.values():
+        root = span
+        while root['p'] in spans:
+            root = spans[root['p']]
+        if root['c'] == 'primitive':
+            primitive, action_num = root['n'].upper(), root['a'].get('action_num')
+            stage = 'total' if root is span else span['n']
+        else:
+            primitive, action_num, stage = None, None, span['n']
+        timings.append((action_num, primitive, stage, span['d']/1e6))
+    return timings
+
+def scan_logs(tjt_dir):
+    '''
+    text logs of the runs without trace.jsonl / detections in {n}.json
+    return: [(primitive, stage, duration)], [(primitive, detector, success)]
+    '''
+    timings, detections = [], []
+    for f in sorted(os.listdir(tjt_dir)):
+        if not (f == 'log' or (f.startswith('log') and f.endswith('log'))):
+            continue
+        with open(os.path.join(tjt_dir, f), 'r', errors='ignore') as log:
+            for line in log:
+                tag = LOG_TAG.search(line)
+                if not tag:
+                    continue
+                primitive = tag.group(1).upper()
+                match = LOG_TIME.search(line)
+                if match:
+                    stage = match.group('stage').strip()
+                    stage = 'total' if stage.upper() == f'{primitive} TIME' else re.sub(r'\s*Time$', '', stage)
+                    timings.append((primitive, stage, float(match.group('duration'))))
+                match = LOG_DETECTION.search(line)
+                if match:
+                    detections.append((primitive, match.group('detector').lower(), int(match.group('success') == 'True')))
+    return timings, detections
+
+class TrajectoryDB(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        dir = os.path.dirname(db_path)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self, root, prune=True, if_p=True):
+        '''
+        add the new trajectories under root, re-ingest the changed ones, drop the removed ones (prune)
+        return: num of (re-)ingested trajectories
+        '''
+        fingerprints = dict(self.conn.execute('SELECT path, fingerprint FROM trajectories'))
+        tjt_dirs = find_trajectories(root)
+        num = 0
+        for tjt_dir in tjt_dirs:
+            path = os.path.abspath(tjt_dir)
+            fingerprint = get_fingerprint(tjt_dir)
+            if fingerprints.get(path) == fingerprint:
+                continue
+            self.ingest_trajectory(tjt_dir, fingerprint)
+            num += 1
+        if prune:
+            paths = set(os.path.abspath(tjt_dir) for tjt_dir in tjt_dirs)
+            root_path = os.path.abspath(root)
+            removed = [path for path in fingerprints if path.startswith(root_path) and path not in paths]
+            with self.conn:
+                for path in removed:
+                    self.delete(path)
+        if if_p:
+            print(f'[TrajectoryDB] {root}: {len(tjt_dirs)} trajectories, {num} ingested')
+        return num
+
+    def delete(self, path):
+        for table in ['trajectories', 'actions', 'detections', 'timings']:
+            self.conn.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+
+    def ingest_trajectory(self, tjt_dir, fingerprint=None):
+        path = os.path.abspath(tjt_dir)
+        meta = read_json(os.path.join(tjt_dir, 'meta.json'), {})
+        actions, detections = load_actions(tjt_dir)
+        match = re.search(r'tjt_(\d+)', os.path.basename(os.path.normpath(tjt_dir)))
+        tjt_num = meta.get('tjt_num', int(match.group(1)) if match else None)
+
+        action_rows = [(path, action_num, action, id, ret, json.dumps(param), error, int(ret == SUCCESS)) for action_num, (action, id, ret, param, error) in sorted(actions.items())]
+        detection_rows = [(path, action_num, actions[action_num][0] if action_num in actions else None, detector, int(bool(item['success'])), item.get('result'), json.dumps(item.get('probs')))
+                          for action_num, items in detections.items() for detector, item in items.items()]
+        trace_path = os.path.join(tjt_dir, 'trace.jsonl')
+        timing_rows = [(path, *timing, 'trace') for timing in load_trace_timings(trace_path)] if os.path.exists(trace_path) else []
+        if not timing_rows or not detection_rows:
+            log_timings, log_detections = scan_logs(tjt_dir)
+            if not timing_rows:
+                timing_rows = [(path, None, primitive, stage, duration, 'log') for primitive, stage, duration in log_timings]
+            if not detection_rows:
+                detection_rows = [(path, None, primitive, detector, success, None, None) for primitive, detector, success in log_detections]
+
+        with self.conn:
+            self.delete(path)
+            self.conn.execute('INSERT INTO trajectories VALUES (?, ?, ?, ?, ?, ?, ?)', (path, tjt_num, meta.get('type'), meta.get('start_time'), len(actions), fingerprint or get_fingerprint(tjt_dir), time.time()))
+            self.conn.executemany('INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?, ?)', action_rows)
+            self.conn.executemany('INSERT INTO detections VALUES (?, ?, ?, ?, ?, ?, ?)', detection_rows)
+            self.conn.executemany('INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?)', timing_rows)
+
+    def query(self, name, type=None):
+        '''
+        name: success / latency / errors / detections, type: handle type (lever/doorknob/crossbar/drawer), all if None
+        return: columns, rows
+        '''
+        sql = QUERIES[name].format(where='AND t.type = ?' if type else '')
+        cursor = self.conn.execute(sql, (type,) if type else ())
+        return [column[0] for column in cursor.description], cursor.fetchall()
+
+def print_table(columns, rows):
+    widths = [max([len(str(column))] + [len(str(row[i])) for row in rows]) for i, column in enumerate(columns)]
+    print('  '.join(f'{column:<{w}}' for column, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(f'{str(value):<{w}}' for value, w in zip(row, widths)))
+
+def main(args):
+    db_path = args.db_path if args.db_path else os.path.join(args.input_dir, DB_NAME)
+    db = TrajectoryDB(db_path)
+    if not args.no_ingest:
+        db.ingest(args.input_dir)
+    for name in args.queries:
+        print(f'========== {name} ==========')
+        print_table(*db.query(name, args.type))
+    db.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_dir", type=str, default='../trajectory', help="Folder of the trajectories.")
+    parser.add_argument("-db", "--db_path", type=str, default=None, help="Sqlite file, {input_dir}/trajectory.db if not given.")
+    parser.add_argument("-q", "--queries", nargs="+", default=['success'], choices=list(QUERIES.keys()), help="Tables to print.")
+    parser.add_argument("-type", "--type", type=str, default=None, help="Only this handle type.")
+    parser.add_argument("-n", "--no_ingest", action='store_true', help="Query the db as it is.")
+    main(parser.parse_args())
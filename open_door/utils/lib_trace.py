@@ -0,0 +1,172 @@
+'''
+Author: TX-Leo
+Mail: tx.leo.wz@gmail.com
+Date: 2024-10-05 11:27:40
+Version: v1
+File:
+Brief: nested stage timings of the primitives (capture -> DTSAM -> GUM -> depth -> RANSAC -> IK -> move -> gripper)
+       spans are opened with tracer.span(name) (context manager), @trace(name) (decorator) or tracer.begin(name) / tracer.end(name),
+       kept in memory and appended to {tjt_dir}/trace.jsonl when the outermost span of a thread closes (once per primitive)
+       one line per span: {"i": id, "p": parent id, "n": name, "c": category, "ts": start (us, epoch), "d": duration (us), "t": thread, "a": args}
+       usage: python lib_trace.py -i ../trajectory/tjt_001/trace.jsonl -o trace.json (open in chrome://tracing or ui.perfetto.dev)
+'''
+import os
+import json
+import time
+import argparse
+import functools
+import threading
+import itertools
+from contextlib import contextmanager
+
+class Tracer(object):
+    def __init__(self,trace_path=None,**meta):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.spans = [] # closed spans not written yet
+        self.trace_path = None
+        self.meta = {}
+        if trace_path is not None:
+            self.open(trace_path,**meta)
+
+    def open(self,trace_path,**meta):
+        ''' new trace file (e.g. per trajectory), meta: args of every span (tjt_num, ...) '''
+        self.flush()
+        self.trace_path = trace_path
+        self.meta = meta
+        dir = os.path.dirname(trace_path)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+
+    def get_stack(self):
+        if not hasattr(self.local,'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def begin(self,name,cat='stage',**args):
+        stack = self.get_stack()
+        span = {'i': next(self.ids), 'p': stack[-1]['i'] if stack else 0, 'n': name, 'c': cat,
+                'ts': int(time.time()*1e6), 't': threading.get_ident() % 100000, 'a': args, 'start': time.perf_counter()}
+        stack.append(span)
+        return span
+
+    def end(self,name=None,**args):
+        '''
+        close the innermost span called name (the innermost one if None), the spans still open inside it are closed too
+        args: added to the args of the span (results, times measured on the server, ...)
+        '''
+        stack = self.get_stack()
+        if not stack or (name is not None and name not in [span['n'] for span in stack]):
+            return None
+        now = time.perf_counter()
+        closed = []
+        while stack:
+            span = stack.pop()
+            span['d'] = int((now-span.pop('start'))*1e6)
+            closed.append(span)
+            if name is None or span['n'] == name:
+                span['a'].update(args)
+                break
+        with self.lock:
+            self.spans += closed
+        if not stack:
+            self.flush()
+        return closed[-1]
+
+    @contextmanager
+    def span(self,name,cat='stage',**args):
+        span = self.begin(name,cat,**args)
+        try:
+            yield span
+        finally:
+            stack = self.get_stack()
+            if span in stack:
+                self.end(name)
+
+    def add(self,name,start,duration,cat='stage',**args):
+        ''' span measured elsewhere (e.g. on the perception server), start: epoch s, duration: s '''
+        stack = self.get_stack()
+        span = {'i': next(self.ids), 'p': stack[-1]['i'] if stack else 0, 'n': name, 'c': cat,
+                'ts': int(start*1e6), 'd': int(duration*1e6), 't': threading.get_ident() % 100000, 'a': args}
+        with self.lock:
+            self.spans.append(span)
+        if not stack:
+            self.flush()
+        return span
+
+    def flush(self):
+        with self.lock:
+            spans, self.spans = self.spans, []
+            if self.trace_path is None or not spans:
+                return
+            with open(self.trace_path,'a') as f:
+                for span in sorted(spans,key=lambda span: span['ts']):
+                    if self.meta:
+                        span['a'] = {**self.meta,**span['a']}
+                    f.write(json.dumps(span,separators=(',',':'),default=str)+'\n')
+
+    def close(self):
+        self.flush()
+        self.trace_path = None
+
+TRACER = Tracer() # shared by the primitives, the arms and the camera, opened per trajectory by Primitive
+
+def get_tracer():
+    return TRACER
+
+def trace(name=None,cat='stage'):
+    ''' decorator: one span per call of the function on the shared tracer '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            with TRACER.span(name or func.__name__,cat):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def load_trace(trace_path):
+    with open(trace_path,'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def to_chrome_trace(spans,pid=0):
+    ''' complete events ("ph": "X") of the chrome trace event format, read by chrome://tracing and perfetto '''
+    events = [{'name': span['n'], 'cat': span['c'], 'ph': 'X', 'ts': span['ts'], 'dur': span['d'],
+               'pid': pid, 'tid': span['t'], 'args': {**span['a'], 'id': span['i'], 'parent': span['p']}} for span in spans]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def export_chrome_trace(trace_paths,output_path):
+    ''' one process per trace file (trajectory) '''
+    events = []
+    for pid,trace_path in enumerate(trace_paths):
+        events += to_chrome_trace(load_trace(trace_path),pid)['traceEvents']
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': os.path.dirname(os.path.abspath(trace_path))}})
+    with open(output_path,'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},f)
+    return output_path
+
+def summarize(spans):
+    ''' total / mean duration (s) and count per (category, name) '''
+    summary = {}
+    for span in spans:
+        item = summary.setdefault(f"{span['c']}/{span['n']}",{'count': 0, 'total': 0.0})
+        item['count'] += 1
+        item['total'] += span['d']/1e6
+    for item in summary.values():
+        item['mean'] = item['total']/item['count']
+    return summary
+
+def main(args):
+    output_path = export_chrome_trace(args.trace_paths,args.output_path)
+    print(f'[Trace] {output_path}')
+    if args.summary:
+        spans = [span for trace_path in args.trace_paths for span in load_trace(trace_path)]
+        for name,item in sorted(summarize(spans).items(),key=lambda x: -x[1]['total']):
+            print(f"{name:<32} count: {item['count']:>5} total: {item['total']:>9.3f} s mean: {item['mean']:>8.3f} s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--trace_paths", nargs="+", required=True, help="trace.jsonl of the trajectories.")
+    parser.add_argument("-o", "--output_path", type=str, default='trace.json', help="Chrome trace / Perfetto json.")
+    parser.add_argument("-s", "--summary", action='store_true', help="Print the time per stage.")
+    main(parser.parse_args())